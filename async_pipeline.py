@@ -0,0 +1,206 @@
+import argparse
+import asyncio
+import sys
+import time
+
+from pymongo import AsyncMongoClient, ASCENDING
+from bson.objectid import ObjectId
+
+import parse1
+import initial_main
+from indexes import index_hint
+from lookup_cache import TIMEZONE_PROJECTION
+from prefetch import (
+    daily_distance_cursor,
+    distance_by_day,
+    index_minor_violations,
+    metas_span_ends,
+    minor_violations_cursor,
+)
+from writers import OUTPUT_FORMATS, ChunkedWriter, CsvSink, output_target
+from connection import client_options, tunnel_port
+from config import DATASET_DIR, MONGO_DB, OUTPUT_FORMAT, mongo_uri
+
+# documents per fetched batch, and batches in flight between two stages
+FETCH_BATCH = 1000
+QUEUE_SIZE = 4
+
+# Not supported here; every run is a full scan of decoded dicts:
+#   LAZY_DECODE      documents are always decoded in full
+#   TRIM_VIOLATIONS  parse1's metas are fetched untrimmed
+#   INCREMENTAL      no watermark is read or saved, the output is rewritten
+#   DOWNSAMPLE_MODE  initial_main always thins in Python (the "python" mode)
+# Use the scripts themselves (or batch.py) for those.
+UNSUPPORTED_MODES = (
+    "LAZY_DECODE, TRIM_VIOLATIONS, incremental watermarks and "
+    "DOWNSAMPLE_MODE=two_phase are not supported; every run is a full scan."
+)
+
+
+# -------- STAGES --------
+async def fetch_stage(cursor, out_queue, batch_size):
+    while True:
+        batch = await cursor.to_list(batch_size)
+        if not batch:
+            break
+        await out_queue.put(batch)
+    await out_queue.put(None)
+
+
+async def transform_stage(in_queue, out_queue, transform):
+    # the transform is plain Python; a worker thread keeps the loop fetching
+    while (batch := await in_queue.get()) is not None:
+        await out_queue.put(await asyncio.to_thread(transform, batch))
+    await out_queue.put(None)
+
+
+async def write_stage(in_queue, writer):
+    while (records := await in_queue.get()) is not None:
+        await asyncio.to_thread(writer.write_many, records)
+
+
+async def run_pipeline(cursor, transform, writer, batch_size=FETCH_BATCH, queue_size=QUEUE_SIZE):
+    """
+    fetch -> transform -> write as concurrent stages joined by bounded queues.
+    transform(batch) must return that batch's records and carry any rolling
+    state across calls. A failing stage cancels the other two.
+    """
+    fetched = asyncio.Queue(queue_size)
+    transformed = asyncio.Queue(queue_size)
+
+    async with asyncio.TaskGroup() as group:
+        group.create_task(fetch_stage(cursor, fetched, batch_size))
+        group.create_task(transform_stage(fetched, transformed, transform))
+        group.create_task(write_stage(transformed, writer))
+
+    await asyncio.to_thread(writer.close)
+    return writer.rows
+
+
+# -------- METAS (parse1.py) --------
+async def driver_profile(db, driver_id, driver_projection):
+    # lookup_cache.driver_profile without the cache
+    driver = await db.drivers.find_one({"_id": driver_id}, dict(driver_projection))
+
+    driver_timezone = None
+    if driver and driver.get("timeZone"):
+        tz = await db.timezones.find_one({"_id": driver["timeZone"]}, dict(TIMEZONE_PROJECTION))
+        if tz:
+            driver_timezone = tz.get("tzCode")
+
+    return driver, driver_timezone
+
+
+async def minor_violation_index(db, driver_id, first_date, last_date):
+    cursor = minor_violations_cursor(db, driver_id, first_date, last_date)
+    return index_minor_violations(await cursor.to_list(None))
+
+
+async def daily_distance(db, driver_id, first_date, last_date):
+    cursor = daily_distance_cursor(db, driver_id, first_date, last_date)
+    return distance_by_day(await cursor.to_list(None))
+
+
+async def extract_driver_metas(db, driver_id, path, batch_size=FETCH_BATCH, open_sink=CsvSink):
+    query = {"driver": driver_id}
+
+    # profile, span ends and both prefetches are independent round-trips
+    (driver, driver_timezone), first, last = await asyncio.gather(
+        driver_profile(db, driver_id, parse1.DRIVER_PROJECTION),
+        *metas_span_ends(db, query),
+    )
+
+    minor_violations, distance_by_day = None, {}
+    if first and last:
+        minor_violations, distance_by_day = await asyncio.gather(
+            minor_violation_index(db, driver_id, first["createdAt"], last["createdAt"]),
+            daily_distance(db, driver_id, first["createdAt"], last["createdAt"]),
+        )
+
+    data = {
+        "driver": driver,
+        "timezone": driver_timezone,
+        "minor_violations": minor_violations,
+        "distance_by_day": distance_by_day,
+    }
+    state = parse1.DriverScanState()
+
+    def transform(batch):
+        return list(parse1.iter_driver_rows(driver_id, {**data, "metas": batch}, state))
+
+    cursor = db.metas.find(
+        query, dict(parse1.METAS_PROJECTION), hint=index_hint("metas")
+    ).sort("createdAt", ASCENDING)
+    writer = ChunkedWriter(open_sink(path), parse1.records_to_frame,
+                           columns=parse1.RECORD_COLUMNS, dict_columns=parse1.DICT_COLUMNS,
+                           column_types=parse1.COLUMN_DTYPES)
+    return await run_pipeline(cursor, transform, writer, batch_size)
+
+
+# -------- DRIVERLOCATIONS (initial_main.py) --------
+async def extract_vehicle_locations(db, vehicle_id, path, batch_size=FETCH_BATCH,
+                                    open_sink=CsvSink):
+    thinner = initial_main.LocationThinner()
+
+    def transform(batch):
+        return list(initial_main.iter_location_rows(vehicle_id, batch, thinner))
+
+    cursor = db.driverlocations.find(
+        initial_main.location_query(vehicle_id), dict(initial_main.LOCATION_PROJECTION),
+        hint=index_hint("driverlocations"),
+    ).sort("createdAt", ASCENDING)
+    writer = ChunkedWriter(open_sink(path), initial_main.records_to_frame,
+                           columns=initial_main.LOCATION_FIELDS,
+                           dict_columns=initial_main.DICT_FIELDS,
+                           column_types=initial_main.COLUMN_DTYPES)
+    return await run_pipeline(cursor, transform, writer, batch_size)
+
+
+PIPELINES = {
+    "parse1": (extract_driver_metas, lambda object_id: parse1.OUTPUT_FILE, parse1.PARQUET_LAYOUT),
+    "initial_main": (
+        extract_vehicle_locations, initial_main.output_file, initial_main.PARQUET_LAYOUT
+    ),
+}
+
+
+async def run(local_port, job, object_id, path, batch_size, open_sink=CsvSink):
+    client = AsyncMongoClient(mongo_uri(local_port), **client_options())
+    try:
+        extract = PIPELINES[job][0]
+        return await extract(client[MONGO_DB], object_id, path, batch_size, open_sink)
+    finally:
+        await client.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Run the parse1.py or initial_main.py extraction as an async pipeline.",
+        epilog=UNSUPPORTED_MODES,
+    )
+    parser.add_argument("job", choices=sorted(PIPELINES))
+    parser.add_argument("id", help="driver (parse1) or vehicle (initial_main) ObjectId")
+    parser.add_argument("--output", help="CSV path (defaults to the script's output file), "
+                        "or the Parquet dataset root (defaults to DATASET_DIR)")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, default=OUTPUT_FORMAT)
+    parser.add_argument("--batch-size", type=int, default=FETCH_BATCH)
+    args = parser.parse_args(argv)
+
+    object_id = ObjectId(args.id)
+    _, csv_path, layout = PIPELINES[args.job]
+    path, open_sink = output_target(
+        object_id, args.output or csv_path(object_id), layout, args.format,
+        args.output or DATASET_DIR,
+    )
+
+    # TUNNEL_PORT attaches to a running tunnel instead of opening one
+    with tunnel_port() as local_port:
+        started = time.perf_counter()
+        rows = asyncio.run(run(local_port, args.job, object_id, path, args.batch_size, open_sink))
+        print(f"Saved {rows} records to {path} in {time.perf_counter() - started:.2f}s")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,280 @@
+import argparse
+import os
+import sys
+import time
+from collections import namedtuple
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from functools import partial
+
+from bson.objectid import ObjectId
+
+import parse
+import parse1
+import initial_main
+from writers import OUTPUT_FORMATS, CsvSink, output_target
+from connection import MongoConnection
+from feature_store import FeatureSink, FeatureStore, with_features
+from index_advisor import check_indexes
+from instrumentation import Instrumentation
+from lookup_cache import LookupCache
+from watermarks import WATERMARK_DIR, ScanState, WatermarkStore, extract_to_csv
+from config import (
+    FEATURE_STORE_PATH, INDEX_HINTS, LOOKUP_CACHE_PATH, LOOKUP_CACHE_TTL, METRICS_FILE, OUTPUT_FORMAT, PROFILE_FILE,
+)
+
+# -------- JOBS --------
+Job = namedtuple(
+    "Job",
+    "fetch iter_records build_records to_frame state_class driver_projection columns dict_columns "
+    "column_types parquet_layout",
+)
+
+JOBS = {
+    "parse": Job(
+        parse.fetch_driver_data,
+        parse.iter_driver_records,
+        parse.build_driver_records,
+        parse.records_to_frame,
+        ScanState,
+        parse.DRIVER_PROJECTION,
+        None,
+        (),
+        None,
+        parse.PARQUET_LAYOUT,
+    ),
+    "parse1": Job(
+        parse1.fetch_driver_data,
+        parse1.iter_driver_rows,
+        parse1.build_driver_rows,
+        parse1.records_to_frame,
+        parse1.DriverScanState,
+        parse1.DRIVER_PROJECTION,
+        parse1.RECORD_COLUMNS,
+        parse1.DICT_COLUMNS,
+        parse1.COLUMN_DTYPES,
+        parse1.PARQUET_LAYOUT,
+    ),
+    "initial_main": Job(
+        initial_main.fetch_vehicle_locations,
+        initial_main.iter_location_rows,
+        initial_main.build_location_rows,
+        initial_main.records_to_frame,
+        initial_main.LocationThinner,
+        None,
+        initial_main.LOCATION_FIELDS,
+        initial_main.DICT_FIELDS,
+        initial_main.COLUMN_DTYPES,
+        initial_main.PARQUET_LAYOUT,
+    ),
+}
+
+# the jobs with daily driver rows for the feature store
+FEATURE_JOBS = ("parse", "parse1")
+
+
+def read_ids(ids, ids_file=None):
+    raw = list(ids)
+    if ids_file:
+        with open(ids_file) as f:
+            raw.extend(line.strip() for line in f)
+
+    # keep order, drop blanks, comments and duplicates
+    seen = set()
+    result = []
+    for value in raw:
+        if not value or value.startswith("#") or value in seen:
+            continue
+        seen.add(value)
+        result.append(ObjectId(value))
+    return result
+
+
+def transform(job, object_id, data, state):
+    # runs in a worker process; the updated state travels back with the records
+    return JOBS[job].build_records(object_id, data, state), state
+
+
+# -------- BATCH RUN --------
+def run_batch(db, job, object_ids, workers=8, processes=0, output_dir="batch_output",
+              combined_file=None, store=None, lookups=None, instruments=None, connection=None,
+              scan_partitions=1, output_format="csv", features=None):
+    """
+    With output_format="parquet" every ID is a partition of one dataset under
+    output_dir, so there is no combined file. `features` (a FeatureStore) also
+    gets every parse/parse1 row, upserted by driver and day.
+    """
+    spec = JOBS[job]
+    combined = None
+    if combined_file:
+        # incremental runs append to the combined file their watermarks continue
+        appending = (bool(store) and os.path.exists(combined_file)
+                     and os.path.getsize(combined_file) > 0)
+        if store and not appending:
+            # a new combined file needs every ID from the start
+            for object_id in object_ids:
+                store.clear(job, object_id)
+        combined = CsvSink(combined_file, append=appending)
+    process_pool = ProcessPoolExecutor(max_workers=processes) if processes else None
+
+    if not combined:
+        os.makedirs(output_dir, exist_ok=True)
+
+    fetch = spec.fetch
+    if spec.driver_projection and lookups:
+        # one $in round-trip for every driver profile and timezone up front
+        with instruments.stage("lookups") if instruments else nullcontext():
+            lookups.prefetch_driver_profiles(object_ids, spec.driver_projection)
+        fetch = partial(fetch, lookups=lookups)
+
+    if scan_partitions > 1:
+        # only initial_main.py has a sharded scan
+        fetch = partial(fetch, partitions=scan_partitions)
+
+    iter_records = spec.iter_records
+    if process_pool:
+        fetch = partial(fetch, materialize=True)
+
+        def iter_records(object_id, data, state):
+            records, new_state = process_pool.submit(transform, job, object_id, data, state).result()
+            state.__dict__.update(new_state.__dict__)
+            return records
+
+    def run_one(object_id):
+        if connection:
+            # pings at most every HEALTH_CHECK_SECONDS; reopens a dropped tunnel
+            connection.ensure()
+        started = time.perf_counter()
+        path, open_sink = output_target(
+            object_id, os.path.join(output_dir, f"{job}_{object_id}.csv"),
+            spec.parquet_layout, output_format, output_dir,
+        )
+        sink = combined
+        if features and job in FEATURE_JOBS:
+            if combined:
+                sink = FeatureSink(combined, features, job, object_id)
+            else:
+                open_sink = with_features(open_sink, features, job, object_id)
+        rows = extract_to_csv(
+            db, job, object_id, path,
+            fetch, iter_records, spec.to_frame, spec.state_class,
+            store=store, sink=sink, instruments=instruments,
+            columns=spec.columns, dict_columns=spec.dict_columns,
+            column_types=spec.column_types, open_sink=open_sink,
+        )
+        return rows, time.perf_counter() - started
+
+    total_rows = 0
+    failures = []
+    batch_started = time.perf_counter()
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(run_one, object_id): object_id for object_id in object_ids}
+
+            for done, future in enumerate(as_completed(futures), start=1):
+                object_id = futures[future]
+                try:
+                    rows, seconds = future.result()
+                except Exception as exc:
+                    failures.append((object_id, exc))
+                    print(f"[{done}/{len(futures)}] FAILED {object_id}: {exc!r}")
+                    continue
+
+                total_rows += rows
+                rate = rows / seconds if seconds else 0
+                print(f"[{done}/{len(futures)}] {object_id}: {rows} rows in {seconds:.2f}s "
+                      f"({rate:.0f} rows/s)")
+    finally:
+        if process_pool:
+            process_pool.shutdown()
+        if combined:
+            combined.close()
+
+    elapsed = time.perf_counter() - batch_started
+    print(f"Done: {len(object_ids) - len(failures)} ok, {len(failures)} failed, "
+          f"{total_rows} rows in {elapsed:.2f}s "
+          f"({len(object_ids) / elapsed if elapsed else 0:.2f} ids/s)")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Run parse.py / parse1.py / initial_main.py for many IDs over one tunnel."
+    )
+    parser.add_argument("job", choices=sorted(JOBS))
+    parser.add_argument("ids", nargs="*", help="driver or vehicle ObjectIds")
+    parser.add_argument("--ids-file", help="file with one ObjectId per line")
+    parser.add_argument("--workers", type=int, default=8, help="threads for the Mongo I/O")
+    parser.add_argument("--processes", type=int, default=0,
+                        help="processes for the transform (0 = transform in the I/O threads)")
+    parser.add_argument("--output-dir", default="batch_output",
+                        help="per-ID CSV directory, or the Parquet dataset root")
+    parser.add_argument("--combined", help="write every ID into this single CSV instead")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, default=OUTPUT_FORMAT,
+                        help="csv files, or a Parquet dataset partitioned by ID and date")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only read documents newer than each ID's watermark and append")
+    parser.add_argument("--watermark-dir", default=WATERMARK_DIR)
+    parser.add_argument("--lookup-cache", default=LOOKUP_CACHE_PATH,
+                        help="SQLite file caching drivers/timezones between runs")
+    parser.add_argument("--lookup-ttl", type=int, default=LOOKUP_CACHE_TTL,
+                        help="seconds before a cached lookup is refetched")
+    parser.add_argument("--feature-store", default=FEATURE_STORE_PATH,
+                        help="parse/parse1: also upsert the daily rows into this SQLite file")
+    parser.add_argument("--scan-partitions", type=int, default=1,
+                        help="initial_main: read each vehicle as this many concurrent createdAt ranges")
+    parser.add_argument("--metrics", default=METRICS_FILE,
+                        help="write stage times, counters and query timings as JSON here")
+    parser.add_argument("--profile", default=PROFILE_FILE,
+                        help="write a cProfile dump of the extraction loops here")
+    parser.add_argument("--check-indexes", action="store_true",
+                        help="explain the job's queries for the first ID and stop on a "
+                             "COLLSCAN or in-memory sort before extracting anything")
+    args = parser.parse_args(argv)
+
+    object_ids = read_ids(args.ids, args.ids_file)
+    if not object_ids:
+        parser.error("no IDs given")
+    if args.scan_partitions > 1 and args.job != "initial_main":
+        parser.error("--scan-partitions only applies to initial_main")
+    if args.combined and args.format == "parquet":
+        parser.error("--combined is CSV only; the Parquet dataset already holds every ID")
+
+    instruments = Instrumentation(args.profile) if args.metrics or args.profile else None
+    connect_started = time.perf_counter()
+
+    # one pooled client shared by every worker thread
+    with MongoConnection(
+        pool_size=args.workers * max(args.scan_partitions, 1) + 2,
+        event_listeners=instruments.listeners() if instruments else None,
+    ) as connection:
+
+        if instruments:
+            instruments.add_time("connect", time.perf_counter() - connect_started)
+        db = connection.db
+        if args.check_indexes:
+            sample = {"driver_id" if args.job != "initial_main" else "vehicle_id": object_ids[0]}
+            check_indexes(db, args.job, hint=INDEX_HINTS, **sample)
+        lookups = LookupCache(db, ttl=args.lookup_ttl, path=args.lookup_cache)
+        features = FeatureStore(args.feature_store) if args.feature_store else None
+
+        failures = run_batch(db, args.job, object_ids, workers=args.workers,
+                             processes=args.processes, output_dir=args.output_dir,
+                             combined_file=args.combined,
+                             store=WatermarkStore(args.watermark_dir) if args.incremental else None,
+                             lookups=lookups, instruments=instruments, connection=connection,
+                             scan_partitions=args.scan_partitions, output_format=args.format,
+                             features=features)
+        lookups.close()
+        if features:
+            features.close()
+
+    if instruments:
+        instruments.report(args.metrics)
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,465 @@
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from functools import partial
+
+import bson
+import pandas as pd
+from bson.raw_bson import RawBSONDocument
+from pymongo import ASCENDING, MongoClient
+
+import initial_main
+import parse
+import parse1
+import synthetic_data
+from batch import JOBS
+from indexes import INDEXES
+from lazy_bson import FieldReader, lazy_documents
+from violation_trim import SAME_DAY, fetch_trimmed_metas
+from writers import ChunkedWriter, CsvSink, output_target
+
+BASELINE_FILE = "benchmark_baselines.json"
+BENCH_DB = "extract_benchmark"
+
+# docs/sec may drop (and peak RSS grow) by this fraction before it counts as a regression
+TOLERANCE = 0.2
+
+# name -> (job, fetch override, which generated ids it runs over)
+CASES = {
+    "parse": ("parse", None, "drivers"),
+    "parse1": ("parse1", None, "drivers"),
+    "initial_main[python]": (
+        "initial_main", partial(initial_main.fetch_vehicle_locations, mode="python"), "vehicles"
+    ),
+    "initial_main[sharded]": (
+        "initial_main", partial(initial_main.fetch_vehicle_locations, mode="python", partitions=4),
+        "vehicles",
+    ),
+    "initial_main[two_phase]": (
+        "initial_main", partial(initial_main.fetch_vehicle_locations, mode="two_phase"), "vehicles"
+    ),
+    "parse1[lazy]": ("parse1", partial(parse1.fetch_driver_data, lazy=True), "drivers"),
+    "parse[trim]": ("parse", partial(parse.fetch_driver_data, trim=True), "drivers"),
+    "parse1[trim]": ("parse1", partial(parse1.fetch_driver_data, trim=True), "drivers"),
+    "initial_main[lazy]": (
+        "initial_main", partial(initial_main.fetch_vehicle_locations, mode="python", lazy=True),
+        "vehicles",
+    ),
+}
+# mongomock cannot return RawBSONDocument, nor run the $filter/$map trimming
+MONGOD_ONLY = {"initial_main[lazy]", "parse[trim]", "parse1[trim]"}
+
+# decode comparison (--decode): how a reply's BSON becomes what the transform reads
+#   dict: plain dicts, as pymongo returns by default
+#   raw:  RawBSONDocument, inflated level by level as fields are read
+#   lazy: the LAZY_DECODE path (parse1: leaf projection, initial_main: LazyDocument)
+#   trim: the TRIM_VIOLATIONS reply (parse1 only, needs mongod)
+DECODE_PATHS = ("dict", "raw", "lazy", "trim")
+
+
+# -------- DATABASE --------
+def open_db(mongo_uri=None):
+    """
+    A local mongod when mongo_uri is given, otherwise an in-memory mongomock
+    database (pip install mongomock; only the benchmark needs it).
+    """
+    if mongo_uri:
+        return MongoClient(mongo_uri)[BENCH_DB]
+
+    try:
+        import mongomock
+    except ImportError:
+        sys.exit("benchmark.py needs --mongo-uri or the mongomock package for the in-memory run")
+    return mongomock.MongoClient()[BENCH_DB]
+
+
+def prepare(db, scale, seed):
+    for name in ("drivers", "timezones", "metas", "driverlocations",
+                 "trackingviolationevents", "recordtables"):
+        db.drop_collection(name)
+
+    started = time.perf_counter()
+    driver_ids, vehicle_ids = synthetic_data.generate(db, seed=seed, **scale)
+
+    # the indexes the production queries rely on (and INDEX_HINTS names)
+    for collection, keys in INDEXES.items():
+        db[collection].create_index(keys)
+
+    print(f"Generated synthetic data in {time.perf_counter() - started:.2f}s")
+    return {"drivers": driver_ids, "vehicles": vehicle_ids}
+
+
+# -------- MEASURE --------
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def source_docs(db, job, object_id):
+    if job == "initial_main":
+        return db.driverlocations.count_documents(initial_main.location_query(object_id))
+    return db.metas.count_documents({"driver": object_id})
+
+
+def disk_mb(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path) / 1e6
+    return sum(
+        os.path.getsize(os.path.join(directory, name))
+        for directory, _, names in os.walk(path) for name in names
+    ) / 1e6
+
+
+def write_output(job, path, open_sink, records):
+    started = time.perf_counter()
+    with ChunkedWriter(open_sink(path), job.to_frame,
+                       columns=job.columns, dict_columns=job.dict_columns,
+                       column_types=job.column_types) as writer:
+        writer.write_many(records)
+    return writer.rows, time.perf_counter() - started
+
+
+def parquet_target(job, object_id, output_dir, name):
+    try:
+        return output_target(object_id, None, job.parquet_layout, "parquet",
+                             os.path.join(output_dir, f"{name}_parquet"))
+    except ImportError:
+        return None, None
+
+
+def run_case(db, name, object_ids, output_dir):
+    """
+    fetch (materialized), transform and CSV write for every id, timed per stage.
+    The same records are also written as Parquet (when pyarrow is installed)
+    and both outputs are reloaded, for the write/size/reload comparison.
+    """
+    job_name, fetch, _ = CASES[name]
+    job = JOBS[job_name]
+    fetch = fetch or job.fetch
+
+    stages = {"fetch": 0.0, "transform": 0.0, "write": 0.0}
+    outputs = {"csv": {"write": 0.0, "mb": 0.0, "reload": 0.0}}
+    docs = sum(source_docs(db, job_name, object_id) for object_id in object_ids)
+    rows = 0
+
+    for object_id in object_ids:
+        state = job.state_class()
+
+        started = time.perf_counter()
+        data = fetch(db, object_id, materialize=True, state=state)
+        stages["fetch"] += time.perf_counter() - started
+
+        started = time.perf_counter()
+        records = job.build_records(object_id, data, state)
+        stages["transform"] += time.perf_counter() - started
+
+        path = os.path.join(output_dir, f"{name}_{object_id}.csv")
+        written, seconds = write_output(job, path, CsvSink, records)
+        stages["write"] += seconds
+        rows += written
+        outputs["csv"]["write"] += seconds
+        outputs["csv"]["mb"] += disk_mb(path)
+        started = time.perf_counter()
+        if written:
+            pd.read_csv(path)
+        outputs["csv"]["reload"] += time.perf_counter() - started
+
+        parquet_path, open_parquet = parquet_target(job, object_id, output_dir, name)
+        if parquet_path:
+            stats = outputs.setdefault("parquet", {"write": 0.0, "mb": 0.0, "reload": 0.0})
+            stats["write"] += write_output(job, parquet_path, open_parquet, records)[1]
+            stats["mb"] += disk_mb(parquet_path)
+            started = time.perf_counter()
+            if written:
+                pd.read_parquet(parquet_path)
+            stats["reload"] += time.perf_counter() - started
+
+    total = sum(stages.values())
+    return {
+        "ids": len(object_ids),
+        "docs": docs,
+        "rows": rows,
+        "seconds": round(total, 4),
+        "docs_per_sec": round(docs / total, 1) if total else 0.0,
+        "stages": {stage: round(seconds, 4) for stage, seconds in stages.items()},
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "outputs": {
+            output: {
+                "write": round(stats["write"], 4),
+                "rows_per_sec": round(rows / stats["write"], 1) if stats["write"] else 0.0,
+                "mb": round(stats["mb"], 3),
+                "reload": round(stats["reload"], 4),
+            }
+            for output, stats in outputs.items()
+        },
+    }
+
+
+# -------- DECODE --------
+def encoded_replies(db, job_name, object_id, path="dict"):
+    """
+    The job's main query for one id as the BSON bytes the server would send.
+    """
+    if job_name == "parse1" and path == "trim":
+        cursor = fetch_trimmed_metas(db, {"driver": object_id}, parse1.METAS_PROJECTION, SAME_DAY)
+    elif job_name == "parse1":
+        projection = parse1.METAS_LEAF_PROJECTION if path == "lazy" else parse1.METAS_PROJECTION
+        cursor = db.metas.find({"driver": object_id}, projection).sort("createdAt", ASCENDING)
+    else:
+        cursor = db.driverlocations.find(
+            initial_main.location_query(object_id), initial_main.LOCATION_PROJECTION
+        ).sort("createdAt", ASCENDING)
+    return b"".join(bson.encode(doc) for doc in cursor)
+
+
+def decode_replies(job_name, path, replies, codec_options):
+    if path in ("dict", "trim") or (path == "lazy" and job_name == "parse1"):
+        return bson.decode_all(replies, codec_options)
+    raw = bson.decode_all(replies, codec_options.with_options(document_class=RawBSONDocument))
+    if path == "raw":
+        return raw
+    return list(lazy_documents(raw, FieldReader(initial_main.THINNING_FIELDS, codec_options)))
+
+
+def run_decode_case(db, job_name, path, object_ids):
+    """
+    BSON decode + transform for one decode path, without a server round trip,
+    so the paths can be compared on any backend.
+    """
+    job = JOBS[job_name]
+    codec_options = bson.DEFAULT_CODEC_OPTIONS
+    stages = {"decode": 0.0, "transform": 0.0}
+    docs = rows = reply_bytes = 0
+
+    for object_id in object_ids:
+        replies = encoded_replies(db, job_name, object_id, path)
+        reply_bytes += len(replies)
+        # drivers, timezones and prefetches as the job reads them, not timed
+        data = job.fetch(db, object_id, materialize=True) if job_name == "parse1" else None
+
+        started = time.perf_counter()
+        fetched = decode_replies(job_name, path, replies, codec_options)
+        stages["decode"] += time.perf_counter() - started
+        docs += len(fetched)
+
+        if data is None:
+            data = fetched
+        else:
+            data["metas"] = fetched
+
+        started = time.perf_counter()
+        rows += len(job.build_records(object_id, data, job.state_class()))
+        stages["transform"] += time.perf_counter() - started
+
+    total = sum(stages.values())
+    return {
+        "docs": docs,
+        "rows": rows,
+        "seconds": round(total, 4),
+        "docs_per_sec": round(docs / total, 1) if total else 0.0,
+        "reply_mb": round(reply_bytes / 1e6, 3),
+        "stages": {stage: round(seconds, 4) for stage, seconds in stages.items()},
+    }
+
+
+def print_decode_report(results):
+    print(f"{'decode case':<26} {'docs':>9} {'rows':>8} {'docs/s':>10} {'vs dict':>8} "
+          f"{'reply MB':>9} {'decode':>8} {'transform':>9}")
+    for name, result in results.items():
+        job_name = name.split("[")[0]
+        plain = results.get(f"{job_name}[dict]")
+        change = ""
+        if plain and plain["docs_per_sec"] and name != f"{job_name}[dict]":
+            change = f"{result['docs_per_sec'] / plain['docs_per_sec'] - 1:+.0%}"
+        stages = result["stages"]
+        print(f"{name:<26} {result['docs']:>9} {result['rows']:>8} {result['docs_per_sec']:>10} "
+              f"{change:>8} {result['reply_mb']:>9.3f} {stages['decode']:>8.3f} "
+              f"{stages['transform']:>9.3f}")
+
+
+def _run_case_in_child(conn, mongo_uri, db, name, object_ids, output_dir):
+    if mongo_uri:
+        # pymongo clients are not fork-safe
+        db = open_db(mongo_uri)
+    try:
+        conn.send(("ok", run_case(db, name, object_ids, output_dir)))
+    except Exception as e:
+        conn.send(("error", f"{type(e).__name__}: {e}"))
+    finally:
+        conn.close()
+
+
+def measure(db, name, object_ids, output_dir, mongo_uri=None):
+    """
+    Runs a case in a forked child so its peak RSS is not the high-water mark
+    of the cases before it. Falls back to running inline without fork.
+    """
+    if "fork" not in multiprocessing.get_all_start_methods():
+        return run_case(db, name, object_ids, output_dir)
+
+    context = multiprocessing.get_context("fork")
+    parent_conn, child_conn = context.Pipe(duplex=False)
+    child = context.Process(
+        target=_run_case_in_child,
+        args=(child_conn, mongo_uri, db, name, object_ids, output_dir),
+    )
+    child.start()
+    child_conn.close()
+    status, result = parent_conn.recv()
+    child.join()
+
+    if status != "ok":
+        raise RuntimeError(f"{name}: {result}")
+    return result
+
+
+# -------- BASELINES --------
+def load_baseline(path):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_report(path, report):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def regressions(report, baseline, tolerance=TOLERANCE):
+    """
+    Cases that got slower or bigger than the baseline allows; only compared
+    when both runs used the same backend, scale and seed.
+    """
+    if not baseline:
+        return []
+    if any(report[key] != baseline.get(key) for key in ("backend", "scale", "seed")):
+        print("Baseline was recorded with a different backend/scale/seed, not comparing")
+        return []
+
+    found = []
+    for name, result in report["cases"].items():
+        before = baseline["cases"].get(name)
+        if not before:
+            continue
+        if result["docs_per_sec"] < before["docs_per_sec"] * (1 - tolerance):
+            found.append(
+                f"{name}: {result['docs_per_sec']} docs/s vs baseline {before['docs_per_sec']}"
+            )
+        if result["peak_rss_mb"] > before["peak_rss_mb"] * (1 + tolerance):
+            found.append(
+                f"{name}: peak RSS {result['peak_rss_mb']} MB vs baseline {before['peak_rss_mb']}"
+            )
+    return found
+
+
+def print_report(report, baseline=None):
+    print(f"{'case':<22} {'docs':>9} {'rows':>8} {'docs/s':>10} {'vs base':>8} "
+          f"{'fetch':>8} {'transform':>9} {'write':>8} {'RSS MB':>8}")
+    for name, result in report["cases"].items():
+        before = (baseline or {}).get("cases", {}).get(name)
+        change = ""
+        if before and before["docs_per_sec"]:
+            change = f"{result['docs_per_sec'] / before['docs_per_sec'] - 1:+.0%}"
+        stages = result["stages"]
+        print(f"{name:<22} {result['docs']:>9} {result['rows']:>8} {result['docs_per_sec']:>10} "
+              f"{change:>8} {stages['fetch']:>8.3f} {stages['transform']:>9.3f} "
+              f"{stages['write']:>8.3f} {result['peak_rss_mb']:>8}")
+
+
+def print_output_report(report):
+    print(f"{'output':<30} {'write s':>9} {'rows/s':>10} {'MB':>9} {'reload s':>9}")
+    for name, result in report["cases"].items():
+        for output, stats in result.get("outputs", {}).items():
+            print(f"{name + ' ' + output:<30} {stats['write']:>9.3f} {stats['rows_per_sec']:>10} "
+                  f"{stats['mb']:>9.3f} {stats['reload']:>9.3f}")
+
+
+# -------- CLI --------
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the extractors on synthetic data, without the SSH tunnel."
+    )
+    parser.add_argument("cases", nargs="*",
+                        help=f"cases to run, from {', '.join(CASES)} (default: all)")
+    parser.add_argument("--mongo-uri", help="local mongod to load the data into "
+                        f"(database {BENCH_DB!r} is dropped); default is in-memory mongomock")
+    parser.add_argument("--drivers", type=int, default=3)
+    parser.add_argument("--vehicles", type=int, default=3)
+    parser.add_argument("--days", type=int, default=120, help="days of metas per driver")
+    parser.add_argument("--metas-per-day", type=float, default=1.5)
+    parser.add_argument("--locations", type=int, default=20000, help="driverlocations per vehicle")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="store this run as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    parser.add_argument("--output", help="also write the report as JSON here")
+    parser.add_argument("--decode", action="store_true",
+                        help="also compare the dict, RawBSONDocument and lazy decode paths")
+    args = parser.parse_args(argv)
+
+    unknown = [name for name in args.cases if name not in CASES]
+    if unknown:
+        parser.error(f"unknown cases: {', '.join(unknown)}")
+
+    scale = {
+        "drivers": args.drivers,
+        "vehicles": args.vehicles,
+        "days": args.days,
+        "metas_per_day": args.metas_per_day,
+        "locations_per_vehicle": args.locations,
+    }
+    db = open_db(args.mongo_uri)
+    ids = prepare(db, scale, args.seed)
+
+    report = {
+        "backend": "mongod" if args.mongo_uri else "mongomock",
+        "scale": scale,
+        "seed": args.seed,
+        "cases": {},
+    }
+    with tempfile.TemporaryDirectory() as output_dir:
+        for name in args.cases or list(CASES):
+            if name in MONGOD_ONLY and not args.mongo_uri:
+                print(f"Skipping {name}: needs --mongo-uri")
+                continue
+            report["cases"][name] = measure(db, name, ids[CASES[name][2]], output_dir, args.mongo_uri)
+
+    baseline = load_baseline(args.baseline)
+    print_report(report, baseline)
+    print_output_report(report)
+
+    if args.decode:
+        report["decode"] = {
+            f"{job_name}[{path}]": run_decode_case(db, job_name, path, ids[kind])
+            for job_name, kind in (("parse1", "drivers"), ("initial_main", "vehicles"))
+            for path in DECODE_PATHS
+            if path != "trim" or (job_name == "parse1" and args.mongo_uri)
+        }
+        print_decode_report(report["decode"])
+
+    if args.output:
+        write_report(args.output, report)
+
+    if args.save_baseline:
+        write_report(args.baseline, report)
+        print(f"Saved baseline to {args.baseline}")
+        return 0
+
+    found = regressions(report, baseline, args.tolerance)
+    for line in found:
+        print(f"REGRESSION {line}")
+    return 1 if found else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
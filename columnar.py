@@ -0,0 +1,173 @@
+from array import array
+
+import numpy as np
+
+# array typecode of a declared column's buffer
+BUFFER_TYPECODES = {"float64": "d", "int64": "q"}
+
+# numbers a declared column converts; bools are left alone
+DECLARED_NUMBERS = {
+    "float64": (float, (int, float, np.integer, np.floating)),
+    "int64": (int, (int, np.integer)),
+}
+
+
+def declared_column(values, dtype):
+    """
+    `values` as a "float64"/"int64" array. A column that also holds other
+    values ("not_avail", ...) stays object, with its numbers converted to
+    the declared type, so every number prints the same in any chunk.
+    """
+    kind, numbers = DECLARED_NUMBERS[dtype]
+    cells = [
+        kind(value) if isinstance(value, numbers) and not isinstance(value, (bool, np.bool_))
+        else value
+        for value in values
+    ]
+    if all(cell.__class__ is kind or (cell is None and kind is float) for cell in cells):
+        try:
+            return np.array(cells, dtype=dtype)
+        except OverflowError:
+            pass
+    return object_column(cells)
+
+
+def typed_frame(df, dtypes):
+    """
+    Casts df's columns to the script's declared dtypes ({column: dtype})
+    instead of what pandas infers from each chunk; see declared_column().
+    """
+    for name, dtype in dtypes.items():
+        if name in df and df[name].dtype != dtype:
+            df[name] = declared_column(df[name].tolist(), dtype)
+    return df
+
+
+def object_column(values):
+    # one cell per value, lists included (np.array would nest them)
+    return np.fromiter(values, dtype=object, count=len(values))
+
+
+# -------- BUFFERS --------
+class TypedBuffer:
+    """
+    A growable float64/int64 column. Cells that are not numbers of that
+    type ("not_avail", an int column's None) are kept aside by row and put
+    back at values(), which then is an object column as declared_column()
+    would make it.
+    """
+
+    def __init__(self, dtype):
+        self.dtype = dtype
+        self.kind, self.numbers = DECLARED_NUMBERS[dtype]
+        self.buffer = array(BUFFER_TYPECODES[dtype])
+        self.others = {}
+
+    def append(self, value):
+        try:
+            if value.__class__ is self.kind:
+                self.buffer.append(value)
+                return
+            if value is None and self.kind is float:
+                self.buffer.append(np.nan)
+                return
+            if isinstance(value, self.numbers) and not isinstance(value, (bool, np.bool_)):
+                self.buffer.append(self.kind(value))
+                return
+        except OverflowError:
+            pass
+        self.others[len(self.buffer)] = value
+        self.buffer.append(0)
+
+    def values(self):
+        column = np.frombuffer(self.buffer, dtype=self.dtype).copy()
+        if self.others:
+            column = column.astype(object)
+            for row, value in self.others.items():
+                column[row] = value
+        return column
+
+
+class DictionaryBuffer:
+    """
+    A column of repeated values (ids, timezone, address) as int32 codes into
+    the list of its distinct values; values() expands them with one take.
+    """
+
+    def __init__(self):
+        self.codes = array("i")
+        self.distinct = []
+        self.index = {}
+
+    def append(self, value):
+        # 1, 1.0 and True are one dict key; only strings are keyed by value
+        key = value if value.__class__ is str else (value.__class__, value)
+        try:
+            code = self.index.get(key)
+        except TypeError:               # unhashable: its own entry
+            code = None
+            key = None
+        if code is None:
+            code = len(self.distinct)
+            self.distinct.append(value)
+            if key is not None:
+                self.index[key] = code
+        self.codes.append(code)
+
+    def values(self):
+        codes = np.frombuffer(self.codes, dtype=np.int32)
+        return object_column(self.distinct)[codes]
+
+
+class ColumnarBuilder:
+    """
+    Collects output rows (tuples in `columns` order) straight into one
+    buffer per column instead of one dict per row, and hands pandas whole
+    arrays (see to_dict()).
+
+    column_types ({column: "float64"/"int64"}, the script's COLUMN_DTYPES)
+    get TypedBuffers, dict_columns DictionaryBuffers; the other columns are
+    lists given to pandas as object arrays.
+    """
+
+    def __init__(self, columns, dict_columns=(), column_types=None):
+        self.columns = tuple(columns)
+        self.dict_columns = set(dict_columns)
+        self.column_types = dict(column_types or {})
+        self.clear()
+
+    def clear(self):
+        self.buffers = [
+            DictionaryBuffer() if name in self.dict_columns
+            else TypedBuffer(self.column_types[name]) if name in self.column_types
+            else []
+            for name in self.columns
+        ]
+        self.appends = [buffer.append for buffer in self.buffers]
+        self.rows = 0
+
+    def append(self, row):
+        for append, value in zip(self.appends, row):
+            append(value)
+        self.rows += 1
+
+    def extend(self, rows):
+        for row in rows:
+            self.append(row)
+        return self
+
+    def __len__(self):
+        return self.rows
+
+    def to_dict(self):
+        """
+        {column: array} for pd.DataFrame().
+        """
+        return {
+            name: object_column(buffer) if isinstance(buffer, list) else buffer.values()
+            for name, buffer in zip(self.columns, self.buffers)
+        }
+
+
+def rows_to_columns(columns, rows, dict_columns=(), column_types=None):
+    return ColumnarBuilder(columns, dict_columns, column_types).extend(rows).to_dict()
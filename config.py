@@ -0,0 +1,80 @@
+import urllib.parse
+import os
+from dotenv import load_dotenv
+
+# -------- LOAD ENV VARIABLES --------
+load_dotenv()
+
+# ---------------- SSH CONFIG ----------------
+SSH_HOST = os.getenv("SSH_HOST")
+SSH_PORT = int(os.getenv("SSH_PORT") or 22)
+SSH_USER = os.getenv("SSH_USER")
+SSH_PASSWORD = os.getenv("SSH_PASSWORD")
+# local port of an already-running tunnel (python connection.py); unset = open one per run
+TUNNEL_PORT = int(os.getenv("TUNNEL_PORT") or 0) or None
+
+# ---------------- MONGO CONFIG ----------------
+MONGO_USER = os.getenv("MONGO_USER")
+MONGO_PASSWORD = urllib.parse.quote_plus(os.getenv("MONGO_PASSWORD") or "")
+MONGO_DB = os.getenv("MONGO_DB")
+MONGO_HOST = os.getenv("MONGO_HOST")
+MONGO_PORT = int(os.getenv("MONGO_PORT") or 27017)
+MONGO_AUTH_SOURCE = os.getenv("MONGO_AUTH_SOURCE") or "driverbookv2_stage"
+
+# ---------------- LOOKUP CACHE ----------------
+# SQLite file for cached drivers/timezones; unset keeps the cache in-process only
+LOOKUP_CACHE_PATH = os.getenv("LOOKUP_CACHE_PATH")
+LOOKUP_CACHE_TTL = int(os.getenv("LOOKUP_CACHE_TTL") or 6 * 3600)
+
+# ---------------- INDEX HINTS ----------------
+# force the indexes in indexes.py instead of letting the planner choose
+INDEX_HINTS = (os.getenv("INDEX_HINTS") or "").lower() in ("1", "true", "yes")
+
+# ---------------- LAZY DECODING ----------------
+# decode only the fields the extractors read (see lazy_bson.py)
+LAZY_DECODE = (os.getenv("LAZY_DECODE") or "").lower() in ("1", "true", "yes")
+
+# ---------------- SERVER-SIDE TRIMMING ----------------
+# fetch metas with the violation arrays filtered by the server (see violation_trim.py)
+TRIM_VIOLATIONS = (os.getenv("TRIM_VIOLATIONS") or "").lower() in ("1", "true", "yes")
+
+# ---------------- OUTPUT ----------------
+# "csv" (one file per script/ID) or "parquet" (partitioned dataset, needs pyarrow)
+OUTPUT_FORMAT = os.getenv("OUTPUT_FORMAT") or "csv"
+# root of the Parquet datasets, one subdirectory per script
+DATASET_DIR = os.getenv("DATASET_DIR") or "datasets"
+
+# ---------------- FEATURE STORE ----------------
+# SQLite file parse.py / parse1.py upsert their daily rows into (see feature_store.py); unset = off
+FEATURE_STORE_PATH = os.getenv("FEATURE_STORE_PATH")
+
+# ---------------- TELEMETRY ROLLUPS ----------------
+# bucket sizes rollups.py computes in one scan (pandas offsets)
+ROLLUP_RESOLUTIONS = (os.getenv("ROLLUP_RESOLUTIONS") or "1min,5min,1h").split(",")
+
+# ---------------- RESUMABLE SCANS ----------------
+# checkpoint long scans and resume them after a dropped tunnel / cursor timeout
+RESUMABLE_SCANS = (os.getenv("RESUMABLE_SCANS") or "").lower() in ("1", "true", "yes")
+SCAN_BATCH_SIZE = int(os.getenv("SCAN_BATCH_SIZE") or 1000)
+# cursor batches between checkpoints
+CHECKPOINT_BATCHES = int(os.getenv("CHECKPOINT_BATCHES") or 10)
+
+# ---------------- LIVE TAIL ----------------
+# how long a change stream read waits for new events before the tail flushes
+LIVE_MAX_AWAIT_MS = int(os.getenv("LIVE_MAX_AWAIT_MS") or 1000)
+# flush rows + save states and the resume token at least this often under load
+LIVE_CHECKPOINT_SECONDS = float(os.getenv("LIVE_CHECKPOINT_SECONDS") or 5)
+
+# ---------------- INSTRUMENTATION ----------------
+# JSON summary of stage times, counters and query round-trips; unset = off
+METRICS_FILE = os.getenv("METRICS_FILE")
+# cProfile dump of the extraction loop (open with pstats / snakeviz)
+PROFILE_FILE = os.getenv("PROFILE_FILE")
+
+
+def mongo_uri(local_port):
+    return (
+        f"mongodb://{MONGO_USER}:{MONGO_PASSWORD}"
+        f"@localhost:{local_port}/{MONGO_DB}"
+        f"?authSource={MONGO_AUTH_SOURCE}"
+    )
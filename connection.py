@@ -0,0 +1,204 @@
+import argparse
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from sshtunnel import SSHTunnelForwarder
+from pymongo import MongoClient
+from pymongo.errors import ConnectionFailure
+
+from config import (
+    SSH_HOST, SSH_PORT, SSH_USER, SSH_PASSWORD,
+    MONGO_DB, MONGO_HOST, MONGO_PORT, TUNNEL_PORT, mongo_uri,
+)
+
+# -------- POOL SETTINGS --------
+POOL_SIZE = 10
+# connections kept open (and authenticated) between extractions
+MIN_POOL_SIZE = 2
+CLIENT_OPTIONS = {
+    "maxIdleTimeMS": 5 * 60 * 1000,
+    "connectTimeoutMS": 10000,
+    "serverSelectionTimeoutMS": 15000,
+    "retryReads": True,
+    "appname": "parsing-extract",
+}
+
+# seconds between pings of a reused connection, and between SSH keepalives
+HEALTH_CHECK_SECONDS = 30
+SSH_KEEPALIVE_SECONDS = 30
+
+
+def client_options(pool_size=POOL_SIZE):
+    return {
+        **CLIENT_OPTIONS,
+        "maxPoolSize": pool_size,
+        "minPoolSize": min(MIN_POOL_SIZE, pool_size),
+    }
+
+
+# -------- SSH TUNNEL --------
+def open_tunnel(local_port=0):
+    tunnel = SSHTunnelForwarder(
+        (SSH_HOST, SSH_PORT),
+        ssh_username=SSH_USER,
+        ssh_password=SSH_PASSWORD,
+        remote_bind_address=(MONGO_HOST, MONGO_PORT),
+        local_bind_address=("localhost", local_port),
+        set_keepalive=SSH_KEEPALIVE_SECONDS,
+    )
+    tunnel.start()
+    return tunnel
+
+
+@contextmanager
+def tunnel_port(port=TUNNEL_PORT):
+    """
+    Local port of the Mongo tunnel: the running one given by TUNNEL_PORT,
+    otherwise a tunnel opened for the duration of the block.
+    """
+    if port:
+        yield port
+        return
+
+    tunnel = open_tunnel()
+    try:
+        yield tunnel.local_bind_port
+    finally:
+        tunnel.stop()
+
+
+# -------- CONNECTION --------
+class MongoConnection:
+    """
+    SSH tunnel + pooled MongoClient kept open for many extractions.
+
+    With TUNNEL_PORT set (see `python connection.py`) it attaches to that
+    tunnel instead of opening one. The connection is warmed with a ping, so
+    SSH, auth and server selection are paid once up front. ensure() pings at
+    most every HEALTH_CHECK_SECONDS and reopens a dropped tunnel on the same
+    local port, which lets the pooled client reconnect without being replaced.
+    """
+
+    def __init__(self, pool_size=POOL_SIZE, tunnel_port=TUNNEL_PORT, event_listeners=None,
+                 health_check_seconds=HEALTH_CHECK_SECONDS):
+        self.pool_size = pool_size
+        self.attached_port = tunnel_port
+        self.event_listeners = event_listeners or []
+        self.health_check_seconds = health_check_seconds
+        self.lock = threading.Lock()
+        self.tunnel = None
+        self.client = None
+        self.local_port = None
+        self.checked_at = 0.0
+
+    def open(self):
+        if self.attached_port:
+            self.local_port = self.attached_port
+        else:
+            self.tunnel = open_tunnel()
+            self.local_port = self.tunnel.local_bind_port
+
+        self.client = MongoClient(
+            mongo_uri(self.local_port),
+            event_listeners=self.event_listeners,
+            **client_options(self.pool_size),
+        )
+        self.ping()
+        return self
+
+    @property
+    def db(self):
+        return self.client[MONGO_DB]
+
+    def ping(self):
+        self.client.admin.command("ping")
+        self.checked_at = time.monotonic()
+
+    # -------- HEALTH --------
+    def ensure(self):
+        """
+        Cheap to call before every extraction; reconnects if the link dropped.
+        """
+        with self.lock:
+            if time.monotonic() - self.checked_at < self.health_check_seconds:
+                return
+            try:
+                if self.tunnel and not self.tunnel.is_active:
+                    raise ConnectionFailure("SSH tunnel is down")
+                self.ping()
+            except ConnectionFailure as e:
+                print(f"Connection lost ({e}), reconnecting")
+                self.reconnect()
+
+    def recover(self):
+        """
+        After a query failed on the link: reconnect now, unless the link works
+        (a cursor timeout) or another thread already reconnected it.
+        """
+        with self.lock:
+            try:
+                self.ping()
+            except ConnectionFailure as e:
+                print(f"Connection lost ({e}), reconnecting")
+                self.reconnect()
+
+    def reconnect(self):
+        if not self.tunnel:
+            # an attached tunnel belongs to another process
+            try:
+                self.ping()
+            except ConnectionFailure as e:
+                raise ConnectionFailure(
+                    f"attached tunnel on localhost:{self.local_port} is not reachable: {e}"
+                )
+            return
+
+        self.tunnel.stop()
+        self.tunnel = open_tunnel(self.local_port)
+        self.ping()
+
+    def close(self):
+        if self.client:
+            self.client.close()
+            self.client = None
+        if self.tunnel:
+            self.tunnel.stop()
+            self.tunnel = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+# -------- SHARED TUNNEL --------
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Keep the SSH tunnel to Mongo open so repeated runs can attach to it."
+    )
+    parser.add_argument("--port", type=int, default=TUNNEL_PORT or 27018,
+                        help="local port to listen on")
+    args = parser.parse_args(argv)
+
+    tunnel = open_tunnel(args.port)
+    print(f"Tunnel up on localhost:{tunnel.local_bind_port}; "
+          f"set TUNNEL_PORT={tunnel.local_bind_port} to reuse it. Ctrl-C to close.")
+    try:
+        while True:
+            time.sleep(HEALTH_CHECK_SECONDS)
+            if not tunnel.is_active:
+                print("SSH transport dropped, reopening")
+                tunnel.stop()
+                tunnel = open_tunnel(args.port)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        tunnel.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,36 @@
+from datetime import datetime
+from functools import lru_cache
+
+
+@lru_cache(maxsize=4096)
+def _parse_mmddyy(event_date_str):
+    # fixed-width fast path; strptime can only split six digits as 2/2/2
+    if len(event_date_str) == 6 and event_date_str.isascii() and event_date_str.isdigit():
+        month = int(event_date_str[0:2])
+        day = int(event_date_str[2:4])
+        year = int(event_date_str[4:6])
+        if not (1 <= month <= 12 and 1 <= day <= 31):
+            return None
+        # same %y pivot as strptime: 00-68 -> 20xx, 69-99 -> 19xx
+        year += 2000 if year <= 68 else 1900
+        try:
+            return datetime(year, month, day)
+        except ValueError:
+            return None
+
+    # anything else ("1525", " 10125", ...) keeps strptime's lenient rules
+    try:
+        return datetime.strptime(event_date_str, "%m%d%y")
+    except ValueError:
+        return None
+
+
+def parse_event_date(event_date_str):
+    """
+    Converts 'MMDDYY' -> datetime, None when missing or invalid.
+    Same results as datetime.strptime(s, "%m%d%y"), memoized per string.
+    """
+    if not isinstance(event_date_str, str):
+        return None
+    return _parse_mmddyy(event_date_str)
+
@@ -0,0 +1,260 @@
+import argparse
+import json
+import sqlite3
+import sys
+import threading
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+
+# one table per script: parse1 -> parse1_features, parse -> parse_features
+TABLE_SUFFIX = "_features"
+# columns that are not features: the key and the indexed lookup fields
+KEY_COLUMNS = ("driver_db_id", "data_date", "tenant_id", "vehicle_id")
+# frame columns stored as the indexed key columns (SQLite names ignore case)
+FRAME_KEYS = {"driver_db_id": "driver_db_id", "Tenant_id": "tenant_id", "vehicle_id": "vehicle_id"}
+# what records_to_frame() leaves in an empty ID field
+EMPTY_IDS = (0, "0", "", "not_avail")
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _sql_value(value):
+    # one frame cell as an SQLite value; lists become JSON text
+    if value is None or (isinstance(value, float) and value != value):
+        return None
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return json.dumps(list(value), default=str)
+    if isinstance(value, (bool, np.bool_)):
+        return int(value)
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, np.floating):
+        return None if np.isnan(value) else float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, (int, float, str)):
+        return value
+    return str(value)
+
+
+def _key_id(value):
+    return None if value is None or value in EMPTY_IDS else str(value)
+
+
+class FeatureStore:
+    """
+    Daily driver features in an SQLite file, one row per (driver_db_id,
+    data_date) and script. Rows are upserted as the scripts write their
+    output, so the latest meta of a day wins; (tenant_id, data_date),
+    (vehicle_id, data_date) and data_date are indexed for lookups.
+
+    List columns (violation patterns, ...) are stored as JSON and come back
+    as lists. Safe to share between threads (batch workers do).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        # readers keep working while a batch writes
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS feature_columns "
+            "(table_name TEXT, column_name TEXT, is_json INTEGER, "
+            "PRIMARY KEY (table_name, column_name))"
+        )
+        self.db.commit()
+        self.columns = {}               # table -> {column: is_json}
+        for table, column, is_json in self.db.execute("SELECT * FROM feature_columns"):
+            self.columns.setdefault(table, {})[column] = bool(is_json)
+
+    # -------- SCHEMA --------
+    def _ensure_table(self, table, df):
+        known = self.columns.get(table)
+        if known is None:
+            self.db.execute(
+                f"CREATE TABLE IF NOT EXISTS {_quote(table)} ("
+                "driver_db_id TEXT NOT NULL, data_date TEXT NOT NULL, "
+                "tenant_id TEXT, vehicle_id TEXT, "
+                "PRIMARY KEY (driver_db_id, data_date)) WITHOUT ROWID"
+            )
+            for column in ("tenant_id", "vehicle_id"):
+                self.db.execute(
+                    f"CREATE INDEX IF NOT EXISTS {_quote(f'{table}_{column}')} "
+                    f"ON {_quote(table)} ({column}, data_date)"
+                )
+            self.db.execute(
+                f"CREATE INDEX IF NOT EXISTS {_quote(f'{table}_data_date')} "
+                f"ON {_quote(table)} (data_date)"
+            )
+            known = self.columns[table] = {}
+
+        for column in df.columns:
+            if column in known:
+                continue
+            values = df[column].dropna()
+            is_json = bool(len(values)) and isinstance(values.iloc[0], (list, tuple, np.ndarray))
+            self.db.execute(f"ALTER TABLE {_quote(table)} ADD COLUMN {_quote(column)}")
+            self.db.execute("INSERT INTO feature_columns VALUES (?, ?, ?)", (table, column, is_json))
+            known[column] = is_json
+
+    # -------- WRITE --------
+    def upsert(self, job, object_id, df, date_column="dataDate"):
+        """
+        Writes one chunk of `job`'s output for driver `object_id`.
+        """
+        if df.empty:
+            return
+        table = job + TABLE_SUFFIX
+        days = pd.to_datetime(df[date_column], errors="coerce").dt.strftime("%Y-%m-%d")
+        drivers = df["driver_db_id"] if "driver_db_id" in df else [str(object_id)] * len(df)
+        tenants = df["Tenant_id"] if "Tenant_id" in df else [None] * len(df)
+        vehicles = df["vehicle_id"] if "vehicle_id" in df else [None] * len(df)
+        features = [
+            column for column in df.columns
+            if column not in FRAME_KEYS and column.lower() not in KEY_COLUMNS
+        ]
+
+        rows = [
+            (str(driver), day, _key_id(tenant), _key_id(vehicle), *map(_sql_value, values))
+            for driver, day, tenant, vehicle, values in zip(
+                drivers, days, tenants, vehicles,
+                df[features].itertuples(index=False, name=None),
+            )
+            if isinstance(day, str)
+        ]
+        names = ", ".join(_quote(name) for name in (*KEY_COLUMNS, *features))
+        marks = ", ".join("?" * (len(KEY_COLUMNS) + len(features)))
+
+        with self.lock:
+            self._ensure_table(table, df[features])
+            # rows come in createdAt order: a later meta of the day replaces the earlier one
+            self.db.executemany(
+                f"INSERT OR REPLACE INTO {_quote(table)} ({names}) VALUES ({marks})", rows
+            )
+            self.db.commit()
+
+    # -------- QUERY --------
+    def query(self, job, driver=None, tenant=None, vehicle=None, start=None, end=None,
+              columns=None):
+        """
+        Rows of `job` for a driver, tenant or vehicle (any combination),
+        with data_date in [start, end] (dates or "YYYY-MM-DD"), by date.
+        """
+        table = job + TABLE_SUFFIX
+        known = self.columns.get(table, {})
+        if not known:
+            return pd.DataFrame()
+
+        where, params = [], []
+        for column, value in (("driver_db_id", driver), ("tenant_id", tenant),
+                              ("vehicle_id", vehicle)):
+            if value is not None:
+                where.append(f"{column} = ?")
+                params.append(str(value))
+        if start is not None:
+            where.append("data_date >= ?")
+            params.append(str(start)[:10])
+        if end is not None:
+            where.append("data_date <= ?")
+            params.append(str(end)[:10])
+
+        selected = list(KEY_COLUMNS) + [c for c in (columns or known) if c not in KEY_COLUMNS]
+        sql = f"SELECT {', '.join(_quote(c) for c in selected)} FROM {_quote(table)}"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY driver_db_id, data_date"
+
+        with self.lock:
+            rows = self.db.execute(sql, params).fetchall()
+        df = pd.DataFrame(rows, columns=selected)
+        for column in selected:
+            if known.get(column):
+                df[column] = [json.loads(value) if value is not None else None
+                              for value in df[column]]
+        return df
+
+    def get(self, job, driver, day):
+        """
+        One driver's features for one day as a dict, or None.
+        """
+        df = self.query(job, driver=driver, start=day, end=day)
+        return df.iloc[0].to_dict() if len(df) else None
+
+    def close(self):
+        with self.lock:
+            if self.db:
+                self.db.close()
+                self.db = None
+
+
+# -------- SINK --------
+class FeatureSink:
+    """
+    Passes each output chunk to `sink` (the CSV/Parquet sink, or None) and
+    upserts it into the feature store.
+    """
+
+    def __init__(self, sink, store, job, object_id):
+        self.sink = sink
+        self.store = store
+        self.job = job
+        self.object_id = object_id
+
+    def write(self, df):
+        if self.sink:
+            self.sink.write(df)
+        self.store.upsert(self.job, self.object_id, df)
+
+    def close(self):
+        if self.sink:
+            self.sink.close()
+
+    def discard(self):
+        if self.sink:
+            self.sink.discard()
+
+
+def with_features(open_sink, store, job, object_id):
+    """
+    open_sink(path, append=...) that also feeds `store` (see extract_to_csv).
+    """
+    def open_feature_sink(path, append=False):
+        return FeatureSink(open_sink(path, append=append), store, job, object_id)
+    return open_feature_sink
+
+
+# -------- CLI --------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Look up stored daily driver features.")
+    parser.add_argument("path", help="feature store SQLite file")
+    parser.add_argument("--job", choices=["parse", "parse1"], default="parse1")
+    parser.add_argument("--driver", help="driver ObjectId (driver_db_id)")
+    parser.add_argument("--tenant")
+    parser.add_argument("--vehicle")
+    parser.add_argument("--from", dest="start", help="first day, YYYY-MM-DD")
+    parser.add_argument("--to", dest="end", help="last day, YYYY-MM-DD")
+    parser.add_argument("--columns", nargs="*", help="feature columns to return (default: all)")
+    parser.add_argument("--output", help="write the rows to this CSV instead of printing them")
+    args = parser.parse_args(argv)
+
+    store = FeatureStore(args.path)
+    df = store.query(args.job, driver=args.driver, tenant=args.tenant, vehicle=args.vehicle,
+                     start=args.start, end=args.end, columns=args.columns)
+    store.close()
+
+    if args.output:
+        df.to_csv(args.output, index=False)
+        print(f"Saved {len(df)} rows to {args.output}")
+    else:
+        print(df.to_string(index=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
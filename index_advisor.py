@@ -0,0 +1,264 @@
+import argparse
+import json
+import sys
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from bson.objectid import ObjectId
+from pymongo.errors import OperationFailure
+
+import parse
+import parse1
+import initial_main
+from connection import MongoConnection
+from indexes import INDEXES, create_command, index_name
+from prefetch import (
+    DISTANCE_PROJECTION,
+    MINOR_VIOLATION_PROJECTION,
+    daily_distance_query,
+    metas_created_span,
+    minor_violations_query,
+)
+from watermarks import created_after
+
+# flag a plan that examines more than this many documents per returned one
+EXAMINED_RATIO = 2.0
+
+# one explainable query the extractors send; `jobs` are the scripts that send it
+QueryShape = namedtuple("QueryShape", "name jobs collection command")
+
+
+# -------- QUERY SHAPES --------
+def find_command(collection, query, projection=None, sort=None, limit=None):
+    command = {"find": collection, "filter": query}
+    if projection:
+        command["projection"] = dict(projection)
+    if sort:
+        command["sort"] = dict(sort)
+    if limit:
+        command["limit"] = limit
+    return command
+
+
+def query_shapes(db, driver_id, vehicle_id):
+    """
+    The queries parse.py, parse1.py and initial_main.py run for these ids,
+    built with the scripts' own query helpers. Incremental variants use the
+    middle of the driver's / vehicle's data as the watermark.
+    """
+    span = metas_created_span(db, driver_id)
+    first, last = span or (datetime.now() - timedelta(days=30), datetime.now())
+    metas_since = first + (last - first) / 2
+
+    location_first = db.driverlocations.find_one(
+        initial_main.location_query(vehicle_id), {"createdAt": 1}, sort=[("createdAt", 1)]
+    )
+    location_since = location_first["createdAt"] if location_first else datetime.now()
+
+    by_created = {"createdAt": 1}
+    return [
+        QueryShape("metas full scan", ("parse",), "metas", find_command(
+            "metas", {"driver": driver_id}, parse.METAS_PROJECTION, by_created)),
+        QueryShape("metas full scan", ("parse1",), "metas", find_command(
+            "metas", {"driver": driver_id}, parse1.METAS_PROJECTION, by_created)),
+        QueryShape("metas since watermark", ("parse", "parse1"), "metas", find_command(
+            "metas", created_after({"driver": driver_id}, metas_since),
+            parse1.METAS_PROJECTION, by_created)),
+        QueryShape("metas first createdAt", ("parse1",), "metas", find_command(
+            "metas", {"driver": driver_id}, {"createdAt": 1}, by_created, limit=1)),
+        QueryShape("metas last createdAt", ("parse1",), "metas", find_command(
+            "metas", {"driver": driver_id}, {"createdAt": 1}, {"createdAt": -1}, limit=1)),
+        QueryShape("minor violations prefetch", ("parse1",), "trackingviolationevents", find_command(
+            "trackingviolationevents", minor_violations_query(driver_id, first, last),
+            MINOR_VIOLATION_PROJECTION, by_created)),
+        QueryShape("daily distance prefetch", ("parse1",), "recordtables", find_command(
+            "recordtables", daily_distance_query(driver_id, first, last),
+            DISTANCE_PROJECTION, by_created)),
+        QueryShape("driverlocations scan", ("initial_main",), "driverlocations", find_command(
+            "driverlocations", initial_main.location_query(vehicle_id),
+            initial_main.LOCATION_PROJECTION, by_created)),
+        QueryShape("driverlocations since watermark", ("initial_main",), "driverlocations", find_command(
+            "driverlocations", initial_main.location_query(vehicle_id, location_since),
+            initial_main.LOCATION_PROJECTION, by_created)),
+        QueryShape("driverlocations two-phase id scan", ("initial_main",), "driverlocations", find_command(
+            "driverlocations", initial_main.location_query(vehicle_id),
+            {name: 1 for name in initial_main.THINNING_FIELDS}, by_created)),
+    ]
+
+
+# -------- EXPLAIN --------
+def plan_stages(explain):
+    """
+    (stage, indexName) for every stage of the winning plan(s); a $sort left
+    in an aggregation pipeline counts as a SORT.
+    """
+    stages = []
+
+    def walk(node, winning):
+        if isinstance(node, dict):
+            if winning and "stage" in node:
+                stages.append((node["stage"], node.get("indexName")))
+            for key, value in node.items():
+                if key != "rejectedPlans":
+                    walk(value, winning or key in ("winningPlan", "queryPlan"))
+        elif isinstance(node, list):
+            for value in node:
+                walk(value, winning)
+
+    walk(explain, False)
+    for stage in explain.get("stages", []):
+        if "$sort" in stage:
+            stages.append(("SORT", None))
+    return stages
+
+
+def execution_stats(explain):
+    if isinstance(explain, dict):
+        if "executionStats" in explain:
+            return explain["executionStats"]
+        values = explain.values()
+    elif isinstance(explain, list):
+        values = explain
+    else:
+        return None
+    for value in values:
+        stats = execution_stats(value)
+        if stats:
+            return stats
+    return None
+
+
+def explain_shape(db, shape, hint=False, plan_only=False):
+    """
+    Explains one shape and returns a report dict with its problems listed.
+    """
+    command = dict(shape.command)
+    recommended = INDEXES.get(shape.collection)
+    if hint and recommended:
+        command["hint"] = dict(recommended)
+
+    report = {
+        "name": shape.name,
+        "jobs": list(shape.jobs),
+        "collection": shape.collection,
+        "hinted": bool(hint and recommended),
+        "problems": [],
+    }
+    try:
+        explain = db.command(
+            "explain", command, verbosity="queryPlanner" if plan_only else "executionStats"
+        )
+    except OperationFailure as e:
+        # a hint for an index that does not exist ends up here
+        report["problems"].append(f"explain failed: {e}")
+        return report
+
+    stages = plan_stages(explain)
+    report["stages"] = [name for name, _ in stages]
+    report["indexes"] = sorted({index for _, index in stages if index})
+
+    if "COLLSCAN" in report["stages"]:
+        report["problems"].append("COLLSCAN")
+    if "SORT" in report["stages"]:
+        report["problems"].append("in-memory SORT")
+    if recommended and report["indexes"] and index_name(recommended) not in report["indexes"]:
+        report["note"] = f"uses {', '.join(report['indexes'])}, expected {index_name(recommended)}"
+
+    stats = execution_stats(explain)
+    if stats:
+        report["returned"] = stats.get("nReturned", 0)
+        report["docs_examined"] = stats.get("totalDocsExamined", 0)
+        report["keys_examined"] = stats.get("totalKeysExamined", 0)
+        report["millis"] = stats.get("executionTimeMillis", 0)
+        if report["docs_examined"] > EXAMINED_RATIO * max(report["returned"], 1):
+            report["problems"].append(
+                f"examines {report['docs_examined']} docs for {report['returned']} returned"
+            )
+
+    return report
+
+
+def advise(db, shapes, hint=False, plan_only=False, strict=False):
+    """
+    Explains and prints every shape. With strict, stops at the first shape
+    with a problem and raises SystemExit(1).
+    """
+    reports = []
+    for shape in shapes:
+        report = explain_shape(db, shape, hint, plan_only)
+        reports.append(report)
+        print_report(report)
+        if strict and report["problems"]:
+            print(f"Strict mode: stopping, fix with {create_command(shape.collection)}")
+            raise SystemExit(1)
+    return reports
+
+
+def print_report(report):
+    status = "OK " if not report["problems"] else "BAD"
+    jobs = "/".join(report["jobs"])
+    print(f"[{status}] {jobs}: {report['name']} ({report['collection']})"
+          f"{' [hinted]' if report['hinted'] else ''}")
+    if report.get("stages"):
+        print(f"      plan: {' <- '.join(report['stages'])}"
+              f"{'  index ' + ', '.join(report['indexes']) if report['indexes'] else ''}")
+    if "returned" in report:
+        print(f"      returned {report['returned']}, docs examined {report['docs_examined']}, "
+              f"keys examined {report['keys_examined']}, {report['millis']} ms")
+    for problem in report["problems"]:
+        print(f"      problem: {problem}")
+    if report.get("note"):
+        print(f"      note: {report['note']}")
+
+
+def check_indexes(db, job, driver_id=None, vehicle_id=None, hint=False):
+    """
+    Plan-only strict check of one job's shapes, for a preflight before a run.
+    """
+    shapes = [
+        shape for shape in query_shapes(db, driver_id or parse1.DRIVER_ID,
+                                        vehicle_id or initial_main.VEHICLE_ID)
+        if job in shape.jobs
+    ]
+    return advise(db, shapes, hint=hint, plan_only=True, strict=True)
+
+
+# -------- CLI --------
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Explain the extraction queries and report collection scans and in-memory sorts."
+    )
+    parser.add_argument("--driver", default=str(parse1.DRIVER_ID), help="sample driver ObjectId")
+    parser.add_argument("--vehicle", default=str(initial_main.VEHICLE_ID),
+                        help="sample vehicle ObjectId")
+    parser.add_argument("--job", choices=["parse", "parse1", "initial_main"],
+                        help="only this script's queries")
+    parser.add_argument("--hint", action="store_true",
+                        help="explain with the indexes.py hints (as INDEX_HINTS=1 runs do)")
+    parser.add_argument("--plan-only", action="store_true",
+                        help="queryPlanner verbosity: no execution, no examined/returned counts")
+    parser.add_argument("--strict", action="store_true",
+                        help="exit 1 at the first query with a problem")
+    parser.add_argument("--json", help="also write the reports here")
+    args = parser.parse_args(argv)
+
+    with MongoConnection() as connection:
+        db = connection.db
+        shapes = [
+            shape for shape in query_shapes(db, ObjectId(args.driver), ObjectId(args.vehicle))
+            if not args.job or args.job in shape.jobs
+        ]
+        reports = advise(db, shapes, hint=args.hint, plan_only=args.plan_only, strict=args.strict)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(reports, f, indent=2)
+
+    bad = {report["collection"] for report in reports if report["problems"]}
+    for collection in sorted(bad):
+        print(f"Suggested: {create_command(collection)}")
+    return 1 if bad and args.strict else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
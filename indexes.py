@@ -0,0 +1,35 @@
+from config import INDEX_HINTS
+
+# access path each extraction query relies on: equality fields, then createdAt
+INDEXES = {
+    "metas": [("driver", 1), ("createdAt", 1)],
+    "driverlocations": [("vehicleId", 1), ("isDeleted", 1), ("createdAt", 1)],
+    "trackingviolationevents": [("driverId", 1), ("isDeleted", 1), ("createdAt", 1)],
+    "recordtables": [("driverId", 1), ("isDeleted", 1), ("createdAt", 1)],
+}
+
+
+def index_name(keys):
+    # the name createIndex gives these keys, e.g. driver_1_createdAt_1
+    return "_".join(f"{field}_{direction}" for field, direction in keys)
+
+
+def index_hint(collection):
+    """
+    The index to hint for `collection` when INDEX_HINTS is on, else None
+    (find(hint=None) lets the planner choose).
+    """
+    if not INDEX_HINTS:
+        return None
+    return INDEXES.get(collection)
+
+
+def hint_kwargs(collection):
+    # aggregate() rejects hint=None, so only pass it when set
+    hint = index_hint(collection)
+    return {"hint": hint} if hint else {}
+
+
+def create_command(collection):
+    keys = ", ".join(f"{field}: {direction}" for field, direction in INDEXES[collection])
+    return f"db.{collection}.createIndex({{{keys}}})"
@@ -1,30 +1,101 @@
-from sshtunnel import SSHTunnelForwarder
-from pymongo import MongoClient, ASCENDING
+from pymongo import ASCENDING
 from bson.objectid import ObjectId
 import pandas as pd
-import urllib.parse
 from datetime import datetime
-import os
-from dotenv import load_dotenv
+import copy
+import time
+from functools import lru_cache
+from columnar import rows_to_columns, typed_frame
+from writers import ParquetLayout, output_target
+from connection import POOL_SIZE, MongoConnection
+from sharded_scan import sharded_find
+from indexes import index_hint
+from lazy_bson import FieldReader, decoded, lazy_documents, raw_collection
+from instrumentation import Instrumentation
+from watermarks import ScanState, WatermarkStore, created_after, extract_to_csv
+from resumable import resumable_extract
+from config import (
+    DATASET_DIR, LAZY_DECODE, METRICS_FILE, OUTPUT_FORMAT, PROFILE_FILE, RESUMABLE_SCANS,
+)
 
-# ================= LOAD ENV =================
-load_dotenv()
+# ================= INPUT VEHICLE ID =================
+VEHICLE_ID = ObjectId("68cf155c25b5590dd4e8a479")
 
-# ================= SSH CONFIG =================
-SSH_HOST = os.getenv("SSH_HOST")
-SSH_PORT = int(os.getenv("SSH_PORT"))
-SSH_USER = os.getenv("SSH_USER")
-SSH_PASSWORD = os.getenv("SSH_PASSWORD")
+# ================= THINNING CONFIG =================
+# "python": stream full documents and thin them here (original behaviour)
+# "two_phase": stream only _id/createdAt/timeStamp and thin those here, then
+#   fetch the kept documents by _id. The thinning still runs in Python (the
+#   rule depends on the last kept point, which no pipeline stage can carry);
+#   it only saves transfer when documents are large and the link is slow.
+DOWNSAMPLE_MODE = "python"
+THINNING_SECONDS = 60
+KEPT_FETCH_BATCH = 1000
+# run both modes once and compare before saving
+VERIFY_DOWNSAMPLING = False
 
-# ================= MONGO CONFIG =================
-MONGO_USER = os.getenv("MONGO_USER")
-MONGO_PASSWORD = urllib.parse.quote_plus(os.getenv("MONGO_PASSWORD"))
-MONGO_DB = os.getenv("MONGO_DB")
-MONGO_HOST = os.getenv("MONGO_HOST")
-MONGO_PORT = int(os.getenv("MONGO_PORT"))
+# ================= SHARDED SCAN =================
+# >1 reads the createdAt range as this many concurrent partitions (python mode);
+# the output is identical to the single cursor
+SCAN_PARTITIONS = 1
 
-# ================= INPUT VEHICLE ID =================
-VEHICLE_ID = ObjectId("68cf155c25b5590dd4e8a479")
+# ================= INCREMENTAL MODE =================
+# read only points created after the stored watermark and append to the output
+INCREMENTAL = False
+
+# ================= OUTPUT FIELDS =================
+# Declared once: drives the Mongo projection and the record extractor.
+LOCATION_FIELDS = [
+    "vehicleId", "tenantId", "driverId",
+
+    "timeStamp", "engineParamsTimestamp",
+
+    "speed", "moving", "direction",
+
+    "engineState", "load_pct", "latitude", "longitude", "address",
+
+    "odometer", "engineHours", "tripDistance", "tripHours", "voltage",
+
+    "engineCoolantTemp", "coolantTemperature", "engineCoolantLevel", "coolantLevel",
+
+    "oilTemprature", "engineOilTemp", "engineOilTemperature", "oilPressure",
+    "engineOilLevel", "oilLevel",
+
+    "turboBoost", "intakePressure", "intakeTemp", "chargeCoolerTemp", "turboRpm",
+    "crankCasePressure",
+
+    "createdAt",
+]
+# written as str(...) in the output
+ID_FIELDS = {"vehicleId", "tenantId", "driverId"}
+# repeated strings, stored once per distinct value while a chunk is buffered
+DICT_FIELDS = ID_FIELDS | {"engineState", "address"}
+
+LOCATION_PROJECTION = {name: 1 for name in LOCATION_FIELDS}
+
+# get_field() makes every reading a float ("" -> 0 aside); declared so a
+# column prints its numbers as floats in every chunk, "not_avail" or not
+COLUMN_DTYPES = {
+    name: "float64" for name in LOCATION_FIELDS if name not in DICT_FIELDS and name != "createdAt"
+}
+
+# all the thinner and the scan checkpoints (resumable.tracked) read; with
+# LAZY_DECODE only points it keeps are fully decoded
+THINNING_FIELDS = ("_id", "createdAt", "timeStamp")
+
+# ================= PARQUET OUTPUT (OUTPUT_FORMAT=parquet) =================
+# datasets/vehicle_locations/vehicle=<id>/date=<createdAt day>/;
+# readings are float64 with "not_avail" stored as null
+PARQUET_LAYOUT = ParquetLayout(
+    dataset="vehicle_locations",
+    key="vehicle",
+    column_types={
+        name: "string" if name in DICT_FIELDS else "timestamp" if name == "createdAt" else "float64"
+        for name in LOCATION_FIELDS
+    },
+    date_column="createdAt",
+    dict_columns=DICT_FIELDS,
+    period="date",
+)
 
 # ================= HELPER FUNCTION =================
 def get_field(doc, key):
@@ -41,105 +112,290 @@ def get_field(doc, key):
     except (ValueError, TypeError):
         return value
 
-# ================= SSH TUNNEL =================
-with SSHTunnelForwarder(
-    (SSH_HOST, SSH_PORT),
-    ssh_username=SSH_USER,
-    ssh_password=SSH_PASSWORD,
-    remote_bind_address=(MONGO_HOST, MONGO_PORT),
-    local_bind_address=("localhost", 0),
-) as tunnel:
-
-    mongo_uri = (
-        f"mongodb://{MONGO_USER}:{MONGO_PASSWORD}"
-        f"@localhost:{tunnel.local_bind_port}/{MONGO_DB}"
-        f"?authSource=driverbookv2_stage"
-    )
 
-    client = MongoClient(mongo_uri)
-    db = client[MONGO_DB]
+@lru_cache(maxsize=4096)
+def _convert_str(value):
+    if value == "":
+        return 0
 
-    print("Connected to MongoDB")
+    try:
+        return float(value)
+    except ValueError:
+        return value
 
-    cursor = db.driverlocations.find(
+
+def convert_value(value):
+    """
+    get_field() for a value that is present, without raising and catching
+    for the BSON types that never convert (ObjectId, datetime, None).
+    """
+    value_type = type(value)
+
+    if value_type is float:
+        return value
+    if value_type is int or value_type is bool:
+        return float(value)
+    if value_type is str:
+        return _convert_str(value)
+    if value is None or value_type is ObjectId or value_type is datetime:
+        return value
+
+    if value == "":
+        return 0
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return value
+
+
+def compile_location_row_extractor(fields=LOCATION_FIELDS, id_fields=ID_FIELDS):
+    """
+    Returns doc -> row tuple in `fields` order, with the same values as
+    calling get_field() per column.
+    """
+    plan = tuple((name, name in id_fields) for name in fields)
+    missing = object()
+
+    def extract(doc):
+        get = doc.get
+        row = []
+        for name, as_str in plan:
+            value = get(name, missing)
+            value = "not_avail" if value is missing else convert_value(value)
+            row.append(str(value) if as_str else value)
+        return tuple(row)
+
+    return extract
+
+
+extract_location_row = compile_location_row_extractor()
+
+
+class LocationThinner(ScanState):
+    """
+    Keeps the first point at least `interval` seconds after the last kept
+    one. The last kept timestamp and last createdAt read are the watermark.
+    """
+
+    def __init__(self, last_created_at=None, interval=THINNING_SECONDS):
+        super().__init__(last_created_at)
+        self.interval = interval
+        #  ADD: track last saved timestamp
+        self.last_saved_timestamp = None
+
+    def thin(self, docs):
+        """
+        Yields (doc, timeStamp) for every kept point.
+        """
+        interval = self.interval
+
+        for doc in docs:
+            self.last_created_at = doc.get("createdAt", self.last_created_at)
+            current_ts = get_field(doc, "timeStamp")
+
+            # skip invalid timestamps
+            if current_ts in ["not_avail", 0]:
+                continue
+
+            # first record always saved
+            if self.last_saved_timestamp is None:
+                self.last_saved_timestamp = current_ts
+            else:
+                # skip if within `interval` seconds (60 by default)
+                if current_ts < self.last_saved_timestamp + interval:
+                    continue
+                self.last_saved_timestamp = current_ts
+
+            yield doc, current_ts
+
+    def to_state(self):
+        return {
+            **super().to_state(),
+            "interval": self.interval,
+            "last_saved_timestamp": self.last_saved_timestamp,
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        # continues at the configured THINNING_SECONDS, not the one saved with the state
+        thinner = super().from_state(state)
+        if state.get("interval", thinner.interval) != thinner.interval:
+            print(f"Watermark was thinned at {state['interval']}s; continuing at "
+                  f"{thinner.interval}s (rewrite the output for one interval throughout)")
+        thinner.last_saved_timestamp = state["last_saved_timestamp"]
+        return thinner
+
+
+def thin_locations(docs, interval=THINNING_SECONDS):
+    return LocationThinner(interval=interval).thin(docs)
+
+
+# ================= FETCH =================
+def location_query(vehicle_id, since=None, seen_ids=()):
+    return created_after(
         {
-            "vehicleId": VEHICLE_ID,
+            "vehicleId": vehicle_id,
             "isDeleted": False
-        }
+        },
+        since,
+        seen_ids,
+    )
+
+
+def fetch_two_phase_locations(db, vehicle_id, state=None, batch_size=KEPT_FETCH_BATCH):
+    """
+    Two-phase fetch. The first cursor ships only THINNING_FIELDS of every
+    point, the thinning rule picks the kept _ids from those, and full
+    documents are fetched for the kept points only (in createdAt order).
+    `state` is the run's LocationThinner: ids are picked with a copy and the
+    transform re-applies the rule to the kept documents, so once they are all
+    yielded its last createdAt is moved to the last point scanned, and the
+    next run does not read the dropped tail again.
+    """
+    state = state or LocationThinner()
+    scan = copy.copy(state)
+    cursor = db.driverlocations.find(
+        location_query(vehicle_id, scan.last_created_at, scan.resume_ids()),
+        {name: 1 for name in THINNING_FIELDS},
+        hint=index_hint("driverlocations"),
     ).sort("createdAt", ASCENDING)
+    kept_ids = [doc["_id"] for doc, _ in scan.thin(cursor)]
+
+    for start in range(0, len(kept_ids), batch_size):
+        chunk = kept_ids[start:start + batch_size]
+        by_id = {
+            doc["_id"]: doc
+            for doc in db.driverlocations.find(
+                {"_id": {"$in": chunk}}, dict(LOCATION_PROJECTION)
+            )
+        }
+        for _id in chunk:
+            if _id in by_id:
+                yield by_id[_id]
+
+    state.last_created_at = scan.last_created_at
+
+
+def fetch_vehicle_locations(db, vehicle_id, materialize=False, mode=None, state=None,
+                            partitions=None, lazy=None):
+    """
+    With lazy (default LAZY_DECODE) the python-mode scan yields LazyDocuments:
+    the thinner decodes only THINNING_FIELDS, the rest waits for kept points.
+    """
+    partitions = partitions or SCAN_PARTITIONS
+    lazy = LAZY_DECODE if lazy is None else lazy
+    since = state.last_created_at if state else None
+    seen_ids = state.resume_ids() if state else ()
+    collection = raw_collection(db.driverlocations) if lazy else db.driverlocations
+
+    if (mode or DOWNSAMPLE_MODE) == "two_phase":
+        # already ships only THINNING_FIELDS for the points it drops
+        docs = fetch_two_phase_locations(db, vehicle_id, state)
+        lazy = False
+    elif partitions > 1:
+        docs = sharded_find(
+            collection, location_query(vehicle_id, since, seen_ids), LOCATION_PROJECTION, partitions,
+            hint=index_hint("driverlocations"),
+        )
+    else:
+        docs = collection.find(
+            location_query(vehicle_id, since, seen_ids), dict(LOCATION_PROJECTION),
+            hint=index_hint("driverlocations"),
+        ).sort("createdAt", ASCENDING)
 
-    records = []
+    if lazy:
+        docs = lazy_documents(docs, FieldReader(THINNING_FIELDS, db.driverlocations.codec_options))
 
-    #  ADD: track last saved timestamp
-    last_saved_timestamp = None
+    return list(docs) if materialize else docs
 
-    for doc in cursor:
-        current_ts = get_field(doc, "timeStamp")
 
-        # skip invalid timestamps
-        if current_ts in ["not_avail", 0]:
-            continue
+# ================= TRANSFORM =================
+def iter_location_rows(vehicle_id, docs, state=None):
+    # LOCATION_FIELDS-ordered tuples for the columnar writer
+    for doc, _ in (state or LocationThinner()).thin(docs):
+        yield extract_location_row(decoded(doc))
 
-        # first record always saved
-        if last_saved_timestamp is None:
-            last_saved_timestamp = current_ts
+
+def build_location_rows(vehicle_id, docs, state=None):
+    return list(iter_location_rows(vehicle_id, docs, state))
+
+
+def records_to_frame(records):
+    # COLUMN_DTYPES are declared, the other columns written as their values
+    return typed_frame(pd.DataFrame(records), COLUMN_DTYPES)
+
+
+def rows_to_frame(rows):
+    return records_to_frame(rows_to_columns(LOCATION_FIELDS, rows, DICT_FIELDS, COLUMN_DTYPES))
+
+
+def extract_vehicle(db, vehicle_id):
+    return rows_to_frame(build_location_rows(vehicle_id, fetch_vehicle_locations(db, vehicle_id)))
+
+
+def verify_two_phase_fetch(db, vehicle_id):
+    """
+    Runs the python and two-phase fetches and checks they save the same rows.
+    """
+    python_df = rows_to_frame(
+        build_location_rows(vehicle_id, fetch_vehicle_locations(db, vehicle_id, mode="python"))
+    )
+    two_phase_df = rows_to_frame(
+        build_location_rows(vehicle_id, fetch_vehicle_locations(db, vehicle_id, mode="two_phase"))
+    )
+    return python_df.equals(two_phase_df)
+
+
+def output_file(vehicle_id):
+    return f"initial_state_{str(vehicle_id)}.csv"
+
+
+# ================= SSH TUNNEL =================
+def main():
+    instruments = Instrumentation(PROFILE_FILE) if METRICS_FILE or PROFILE_FILE else None
+    connect_started = time.perf_counter()
+
+    with MongoConnection(
+        pool_size=max(POOL_SIZE, SCAN_PARTITIONS + 1),
+        event_listeners=instruments.listeners() if instruments else None,
+    ) as connection:
+
+        if instruments:
+            instruments.add_time("connect", time.perf_counter() - connect_started)
+        db = connection.db
+
+        print("Connected to MongoDB")
+
+        if VERIFY_DOWNSAMPLING:
+            same = verify_two_phase_fetch(db, VEHICLE_ID)
+            print(f"Two-phase fetch matches python thinning: {same}")
+
+        path, open_sink = output_target(
+            VEHICLE_ID, output_file(VEHICLE_ID), PARQUET_LAYOUT, OUTPUT_FORMAT, DATASET_DIR
+        )
+        if RESUMABLE_SCANS and OUTPUT_FORMAT == "csv":
+            # checkpointed; picks up after a dropped tunnel / cursor timeout
+            rows = resumable_extract(
+                connection, "initial_main", VEHICLE_ID, path,
+                fetch_vehicle_locations, iter_location_rows, records_to_frame, LocationThinner,
+                store=WatermarkStore() if INCREMENTAL else None,
+                columns=LOCATION_FIELDS, dict_columns=DICT_FIELDS, column_types=COLUMN_DTYPES,
+                instruments=instruments,
+            )
         else:
-            # skip if within 60 seconds
-            if current_ts < last_saved_timestamp + 60:
-                continue
-            last_saved_timestamp = current_ts
-
-        record = {
-            "vehicleId": str(get_field(doc, "vehicleId")),
-            "tenantId": str(get_field(doc, "tenantId")),
-            "driverId": str(get_field(doc, "driverId")),
-
-            "timeStamp": current_ts,
-            "engineParamsTimestamp": get_field(doc, "engineParamsTimestamp"),
-
-            "speed": get_field(doc, "speed"),
-            "moving": get_field(doc, "moving"),
-            "direction": get_field(doc, "direction"),
-
-            "engineState": get_field(doc, "engineState"),
-            "load_pct": get_field(doc, "load_pct"),
-            "latitude": get_field(doc, "latitude"),
-            "longitude": get_field(doc, "longitude"),
-            "address": get_field(doc, "address"),
-
-            "odometer": get_field(doc, "odometer"),
-            "engineHours": get_field(doc, "engineHours"),
-            "tripDistance": get_field(doc, "tripDistance"),
-            "tripHours": get_field(doc, "tripHours"),
-            "voltage": get_field(doc, "voltage"),
-
-            "engineCoolantTemp": get_field(doc, "engineCoolantTemp"),
-            "coolantTemperature": get_field(doc, "coolantTemperature"),
-            "engineCoolantLevel": get_field(doc, "engineCoolantLevel"),
-            "coolantLevel": get_field(doc, "coolantLevel"),
-
-            "oilTemprature": get_field(doc, "oilTemprature"),
-            "engineOilTemp": get_field(doc, "engineOilTemp"),
-            "engineOilTemperature": get_field(doc, "engineOilTemperature"),
-            "oilPressure": get_field(doc, "oilPressure"),
-            "engineOilLevel": get_field(doc, "engineOilLevel"),
-            "oilLevel": get_field(doc, "oilLevel"),
-
-            "turboBoost": get_field(doc, "turboBoost"),
-            "intakePressure": get_field(doc, "intakePressure"),
-            "intakeTemp": get_field(doc, "intakeTemp"),
-            "chargeCoolerTemp": get_field(doc, "chargeCoolerTemp"),
-            "turboRpm": get_field(doc, "turboRpm"),
-            "crankCasePressure": get_field(doc, "crankCasePressure"),
-
-            "createdAt": get_field(doc, "createdAt")
-        }
+            rows = extract_to_csv(
+                db, "initial_main", VEHICLE_ID, path,
+                fetch_vehicle_locations, iter_location_rows, records_to_frame, LocationThinner,
+                store=WatermarkStore() if INCREMENTAL else None,
+                columns=LOCATION_FIELDS, dict_columns=DICT_FIELDS, column_types=COLUMN_DTYPES,
+                instruments=instruments, open_sink=open_sink,
+            )
 
-        records.append(record)
+        print(f"Saved {rows} records to {path}")
 
-    df = pd.DataFrame(records)
+        if instruments:
+            instruments.report(METRICS_FILE)
 
-    output_file = f"initial_state_{str(VEHICLE_ID)}.csv"
-    df.to_csv(output_file, index=False)
 
-    print(f"Saved {len(df)} records to {output_file}")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+import cProfile
+import json
+import os
+import pstats
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from pymongo import monitoring
+
+
+# -------- QUERY ROUND-TRIPS --------
+class QueryTimer(monitoring.CommandListener):
+    """
+    PyMongo command listener: round-trip time and documents returned per
+    (command, collection), e.g. find/metas, getMore/driverlocations.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}               # request_id -> (command, collection)
+        self.stats = defaultdict(lambda: {"count": 0, "docs": 0, "seconds": 0.0, "max_seconds": 0.0,
+                                          "failed": 0})
+
+    def started(self, event):
+        field = "collection" if event.command_name == "getMore" else event.command_name
+        collection = event.command.get(field)
+        if not isinstance(collection, str):
+            collection = None           # endSessions, ping, ...
+        with self.lock:
+            self.pending[event.request_id] = (event.command_name, collection)
+
+    def _finish(self, event, failed):
+        seconds = event.duration_micros / 1e6
+        docs = 0
+        if not failed:
+            cursor = event.reply.get("cursor") or {}
+            docs = len(cursor.get("firstBatch", cursor.get("nextBatch", ())))
+
+        with self.lock:
+            key = self.pending.pop(event.request_id, (event.command_name, None))
+            entry = self.stats[key]
+            entry["count"] += 1
+            entry["docs"] += docs
+            entry["seconds"] += seconds
+            entry["max_seconds"] = max(entry["max_seconds"], seconds)
+            entry["failed"] += failed
+
+    def succeeded(self, event):
+        self._finish(event, failed=False)
+
+    def failed(self, event):
+        self._finish(event, failed=True)
+
+    def summary(self):
+        with self.lock:
+            return {
+                f"{command}/{collection}" if collection else command: {
+                    **entry,
+                    "seconds": round(entry["seconds"], 4),
+                    "max_seconds": round(entry["max_seconds"], 4),
+                }
+                for (command, collection), entry in sorted(self.stats.items(), key=str)
+            }
+
+
+# -------- STAGE TIMERS --------
+class TimedSink:
+    """
+    Wraps a CsvSink so the CSV write time lands in the "csv" stage.
+    """
+
+    def __init__(self, sink, instruments):
+        self.sink = sink
+        self.instruments = instruments
+
+    def write(self, df):
+        with self.instruments.stage("csv"):
+            self.sink.write(df)
+
+    def close(self):
+        with self.instruments.stage("csv"):
+            self.sink.close()
+
+    def discard(self):
+        self.sink.discard()
+
+
+class Instrumentation:
+    """
+    Stage timers, scanned/emitted counters, per-query timings and an optional
+    cProfile of the extraction loop, for one run. Stages nest and are
+    exclusive: time spent in "fetch" while the transform pulls the next
+    document is not counted again under "transform".
+
+    Shared by the batch worker threads; every thread keeps its own stage stack.
+    """
+
+    def __init__(self, profile_path=None):
+        self.profile_path = profile_path
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.stages = defaultdict(float)
+        self.counters = Counter()
+        self.queries = QueryTimer()
+        self.profiles = []
+        self.started = time.perf_counter()
+
+    def listeners(self):
+        # for MongoClient(event_listeners=...)
+        return [self.queries]
+
+    # -------- TIMING --------
+    def add_time(self, name, seconds):
+        with self.lock:
+            self.stages[name] += seconds
+
+    @contextmanager
+    def stage(self, name):
+        stack = self.local.__dict__.setdefault("stack", [])
+        frame = [time.perf_counter(), 0.0]      # started, time spent in nested stages
+        stack.append(frame)
+        try:
+            yield
+        finally:
+            stack.pop()
+            elapsed = time.perf_counter() - frame[0]
+            self.add_time(name, elapsed - frame[1])
+            if stack:
+                stack[-1][1] += elapsed
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] += n
+
+    def timed(self, iterable, stage, counter=None):
+        """
+        Yields from iterable, timing each next() under `stage` and counting items.
+        """
+        iterator = iter(iterable)
+        while True:
+            with self.stage(stage):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            if counter:
+                self.count(counter)
+            yield item
+
+    def timed_call(self, func, stage):
+        def wrapper(*args, **kwargs):
+            with self.stage(stage):
+                return func(*args, **kwargs)
+        return wrapper
+
+    def source(self, data):
+        """
+        Times and counts the documents a fetch_* function returned. The
+        driver scripts return their metas cursor inside the data dict.
+        """
+        if isinstance(data, dict) and "metas" in data:
+            return {**data, "metas": self.source(data["metas"])}
+        if isinstance(data, list):
+            # materialized: already read inside the "query" stage
+            self.count("scanned", len(data))
+            return data
+        return self.timed(data, "fetch", "scanned")
+
+    # -------- PROFILE --------
+    @contextmanager
+    def profile(self):
+        """
+        cProfile around the hot loop when a profile path is set; batch
+        threads each get a profiler and the dump merges them.
+        """
+        if not self.profile_path:
+            yield
+            return
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # another profiler is active on this interpreter
+            yield
+            return
+        try:
+            yield
+        finally:
+            profiler.disable()
+            with self.lock:
+                self.profiles.append(profiler)
+
+    @contextmanager
+    def loop(self):
+        # writer bookkeeping between the timed calls lands in "extract"
+        with self.profile(), self.stage("extract"):
+            yield
+
+    # -------- REPORT --------
+    def summary(self):
+        with self.lock:
+            stages = {name: round(seconds, 4) for name, seconds in self.stages.items()}
+            counters = dict(self.counters)
+
+        if "scanned" in counters and "emitted" in counters:
+            # e.g. points dropped by the 60s thinning in initial_main.py
+            counters["dropped"] = counters["scanned"] - counters["emitted"]
+
+        queries = self.queries.summary()
+        return {
+            "wall_seconds": round(time.perf_counter() - self.started, 4),
+            "stages": stages,
+            "counters": counters,
+            "round_trip_seconds": round(sum(q["seconds"] for q in queries.values()), 4),
+            "queries": queries,
+        }
+
+    def report(self, path=None):
+        summary = self.summary()
+
+        if path:
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(summary, f, indent=2)
+            os.replace(tmp_path, path)
+            print(f"Saved run metrics to {path}")
+
+        if self.profile_path and self.profiles:
+            pstats.Stats(*self.profiles).dump_stats(self.profile_path)
+            print(f"Saved profile to {self.profile_path}")
+
+        stages = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in summary["stages"].items())
+        print(f"Stages: {stages}; round-trips {summary['round_trip_seconds']:.2f}s")
+        return summary
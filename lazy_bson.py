@@ -0,0 +1,144 @@
+import struct
+from collections.abc import Mapping
+
+import bson
+from bson.codec_options import DEFAULT_CODEC_OPTIONS
+from bson.raw_bson import RawBSONDocument
+
+# BSON element type -> size of its value when that size is fixed
+FIXED_SIZES = {
+    0x01: 8,   # double
+    0x06: 0,   # undefined
+    0x07: 12,  # ObjectId
+    0x08: 1,   # bool
+    0x09: 8,   # datetime
+    0x0A: 0,   # null
+    0x10: 4,   # int32
+    0x11: 8,   # timestamp
+    0x12: 8,   # int64
+    0x13: 16,  # decimal128
+    0x7F: 0,   # max key
+    0xFF: 0,   # min key
+}
+# string-like values: int32 length (including the NUL) + bytes
+LENGTH_PREFIXED = {0x02, 0x0D, 0x0E}
+# embedded document, array, code with scope: int32 total size
+SIZE_PREFIXED = {0x03, 0x04, 0x0F}
+
+_int32 = struct.Struct("<i").unpack_from
+
+
+def raw_collection(collection):
+    """
+    The same collection (tz/uuid settings included) returning RawBSONDocument:
+    each document stays as the bytes the server sent until it is read.
+    """
+    return collection.with_options(
+        codec_options=collection.codec_options.with_options(document_class=RawBSONDocument)
+    )
+
+
+def _value_size(raw, kind, start):
+    size = FIXED_SIZES.get(kind)
+    if size is not None:
+        return size
+    if kind in LENGTH_PREFIXED:
+        return 4 + _int32(raw, start)[0]
+    if kind in SIZE_PREFIXED:
+        return _int32(raw, start)[0]
+    if kind == 0x05:  # binary: int32 length + subtype byte
+        return 5 + _int32(raw, start)[0]
+    if kind == 0x0B:  # regex: two cstrings
+        return raw.index(0, raw.index(0, start) + 1) + 1 - start
+    if kind == 0x0C:  # DBPointer: string + ObjectId
+        return 16 + _int32(raw, start)[0]
+    raise bson.errors.InvalidBSON(f"unknown BSON element type {kind:#x}")
+
+
+class FieldReader:
+    """
+    Decodes only `names` from a raw BSON document: steps over the top-level
+    element headers, copies out the wanted elements and C-decodes just those.
+    Stops as soon as every name is found.
+    """
+
+    def __init__(self, names, codec_options=DEFAULT_CODEC_OPTIONS):
+        self.names = frozenset(names)
+        self.encoded = frozenset(name.encode() for name in self.names)
+        self.codec_options = codec_options
+
+    def __call__(self, raw):
+        encoded = self.encoded
+        wanted = len(encoded)
+        index = raw.index
+        parts = []
+        position, end = 4, len(raw) - 1
+
+        while position < end:
+            kind = raw[position]
+            name_end = index(0, position + 1)
+            value_end = name_end + 1 + _value_size(raw, kind, name_end + 1)
+            if raw[position + 1:name_end] in encoded:
+                parts.append(raw[position:value_end])
+                if len(parts) == wanted:
+                    break
+            position = value_end
+
+        body = b"".join(parts)
+        return bson.decode(struct.pack("<i", len(body) + 5) + body + b"\x00", self.codec_options)
+
+    def __reduce__(self):
+        return FieldReader, (tuple(self.names), self.codec_options)
+
+
+class LazyDocument(Mapping):
+    """
+    A document kept as raw BSON. The reader's fields are decoded on their own
+    the first time one is read; any other field decodes the whole document
+    once, with the reader's codec options (same values as the dict path).
+    """
+
+    __slots__ = ("raw", "reader", "fields", "document")
+
+    def __init__(self, raw, reader):
+        self.raw = raw
+        self.reader = reader
+        self.fields = None
+        self.document = None
+
+    def __getitem__(self, key):
+        if self.document is None and key in self.reader.names:
+            if self.fields is None:
+                self.fields = self.reader(self.raw)
+            return self.fields[key]
+        return self.decoded()[key]
+
+    def __iter__(self):
+        return iter(self.decoded())
+
+    def __len__(self):
+        return len(self.decoded())
+
+    def decoded(self):
+        if self.document is None:
+            self.document = bson.decode(self.raw, self.reader.codec_options)
+        return self.document
+
+    def __getstate__(self):
+        # the bytes are all another process needs
+        return self.raw, self.reader
+
+    def __setstate__(self, state):
+        self.raw, self.reader = state
+        self.fields = None
+        self.document = None
+
+
+def lazy_documents(raw_docs, reader):
+    for doc in raw_docs:
+        yield LazyDocument(doc.raw, reader)
+
+
+def decoded(doc):
+    # a plain dict for the extractors, whichever path fetched the document
+    return doc.decoded() if doc.__class__ is LazyDocument else doc
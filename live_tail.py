@@ -0,0 +1,322 @@
+import argparse
+import os
+import sys
+import time
+from collections import namedtuple
+
+from bson import json_util
+from pymongo import MongoClient
+from pymongo.errors import ConnectionFailure
+
+import parse1
+import initial_main
+from batch import JOBS, read_ids, run_batch
+from connection import MongoConnection
+from lookup_cache import LookupCache
+from watermarks import WATERMARK_DIR, WatermarkStore
+from writers import ChunkedWriter, CsvSink
+from config import (
+    LIVE_CHECKPOINT_SECONDS, LIVE_MAX_AWAIT_MS, LOOKUP_CACHE_PATH, LOOKUP_CACHE_TTL, MONGO_DB,
+)
+
+# the resume token is saved next to the ID watermarks, as live_<job>.json
+STREAM_JOB = "live"
+MAX_RETRIES = 5
+RETRY_DELAY = 5
+
+
+# -------- TAILED JOBS --------
+# collection to watch, the field holding the ID, extra server-side filters,
+# the fields the rows need, and event_data(db, object_id, doc, lookups) ->
+# what the job's iter_records() takes for that one document
+Tail = namedtuple("Tail", "collection key match fields event_data")
+
+
+def location_event_data(db, vehicle_id, doc, lookups=None):
+    return [doc]
+
+
+def meta_event_data(db, driver_id, meta, lookups=None):
+    # minor violations and distance for this meta's day only
+    span = (meta["createdAt"], meta["createdAt"])
+    return {**parse1.fetch_driver_context(db, driver_id, span, lookups), "metas": [meta]}
+
+
+TAILS = {
+    "parse1": Tail(
+        "metas", "driver", {}, [*parse1.METAS_PROJECTION, "driver"], meta_event_data,
+    ),
+    "initial_main": Tail(
+        "driverlocations", "vehicleId", {"isDeleted": False}, initial_main.LOCATION_FIELDS,
+        location_event_data,
+    ),
+}
+
+
+def change_pipeline(tail, object_ids):
+    """
+    Inserts for `object_ids` only, cut down to the fields the rows use; the
+    server filters and trims the events before sending them.
+    """
+    match = {"operationType": "insert", f"fullDocument.{tail.key}": {"$in": list(object_ids)}}
+    match.update({f"fullDocument.{name}": value for name, value in tail.match.items()})
+    projection = {f"fullDocument.{name}": 1 for name in ["_id", *tail.fields]}
+    return [{"$match": match}, {"$project": projection}]
+
+
+def already_emitted(state, doc):
+    """
+    True for a document the state is already past: replayed from an older
+    resume token, or read by the catch-up scan.
+    """
+    last = state.last_created_at
+    created_at = doc.get("createdAt")
+    if last is None or created_at is None or created_at > last:
+        return False
+    if created_at < last:
+        return True
+    # same createdAt: only marked _ids are known (the batch scan marks none)
+    return state.seen_at != last or doc["_id"] in state.seen_ids
+
+
+def output_path(output_dir, job, object_id):
+    # the batch file name, so the catch-up run and the tail share one CSV
+    return os.path.join(output_dir, f"{job}_{object_id}.csv")
+
+
+# -------- LIVE TAIL --------
+class LiveTail:
+    """
+    Follows one job's collection with a change stream and appends every new
+    document's rows to its ID's CSV, continuing that ID's rolling state
+    (7-day windows, 60s thinning) from its watermark.
+
+    checkpoint() flushes the rows, then saves each changed ID's state with
+    its CSV size, then the resume token. A restart cuts every CSV back to
+    its checkpointed size and resumes the stream from the token; the events
+    replayed from there are skipped by already_emitted(), so each row is
+    written once. IDs with no watermark yet are caught up by a batch scan
+    first, with the stream already open so nothing in between is missed.
+    """
+
+    def __init__(self, db, job, object_ids, output_dir="live_output", store=None,
+                 lookups=None, workers=8):
+        self.db = db
+        self.job = job
+        self.spec = JOBS[job]
+        self.tail = TAILS[job]
+        self.object_ids = list(object_ids)
+        self.output_dir = output_dir
+        self.store = store or WatermarkStore()
+        self.lookups = lookups
+        self.workers = workers
+        self.states = {}
+        self.writers = {}
+        self.changed = set()
+        self.saved_token = None
+        self.events = 0
+        self.rows = 0
+
+    def path(self, object_id):
+        return output_path(self.output_dir, self.job, object_id)
+
+    def load_token(self):
+        saved = self.store.load(STREAM_JOB, self.job)
+        return json_util.loads(saved["resume_token"]) if saved else None
+
+    def watch(self):
+        return self.db[self.tail.collection].watch(
+            change_pipeline(self.tail, self.object_ids),
+            resume_after=self.load_token(),
+            max_await_time_ms=LIVE_MAX_AWAIT_MS,
+        )
+
+    # -------- START --------
+    def restore_outputs(self):
+        # rows written after an ID's last checkpoint are written again
+        for object_id in self.object_ids:
+            saved = self.store.load(self.job, object_id)
+            path = self.path(object_id)
+            if saved and saved.get("offset") is not None and os.path.exists(path):
+                os.truncate(path, saved["offset"])
+
+    def catch_up(self, resumed):
+        """
+        Batch-scans the IDs the tail cannot continue: all of them on a first
+        start, else those without a watermark and CSV.
+        """
+        object_ids = [
+            object_id for object_id in self.object_ids
+            if not resumed
+            or not (self.store.load(self.job, object_id) and os.path.exists(self.path(object_id)))
+        ]
+        if not object_ids:
+            return
+        print(f"Catching up {len(object_ids)} {self.job} IDs")
+        failures = run_batch(self.db, self.job, object_ids, workers=self.workers,
+                             output_dir=self.output_dir, store=self.store, lookups=self.lookups)
+        if failures:
+            raise failures[0][1]
+
+    def load_states(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        for object_id in self.object_ids:
+            path = self.path(object_id)
+            saved = self.store.load(self.job, object_id)
+            exists = os.path.exists(path)
+            if saved and exists:
+                state = self.spec.state_class.from_state(saved)
+            else:
+                state = self.spec.state_class()
+
+            sink = CsvSink(path, append=exists and os.path.getsize(path) > 0)
+            self.states[object_id] = state
+            self.writers[object_id] = ChunkedWriter(
+                sink, self.spec.to_frame,
+                columns=self.spec.columns, dict_columns=self.spec.dict_columns,
+                column_types=self.spec.column_types,
+            )
+
+    # -------- EVENTS --------
+    def handle(self, change):
+        doc = change["fullDocument"]
+        object_id = doc[self.tail.key]
+        state = self.states.get(object_id)
+        if state is None or already_emitted(state, doc):
+            return
+
+        data = self.tail.event_data(self.db, object_id, doc, self.lookups)
+        records = list(self.spec.iter_records(object_id, data, state))
+        self.writers[object_id].write_many(records)
+        state.mark(doc["createdAt"], doc["_id"])
+
+        self.rows += len(records)
+        self.changed.add(object_id)
+        self.events += 1
+
+    def checkpoint(self, resume_token=None):
+        for object_id in self.changed:
+            self.writers[object_id].flush()
+            path = self.path(object_id)
+            self.store.save(self.job, object_id, {
+                **self.states[object_id].to_state(),
+                "offset": os.path.getsize(path) if os.path.exists(path) else 0,
+            })
+        self.changed.clear()
+
+        if resume_token is not None and resume_token != self.saved_token:
+            self.store.save(STREAM_JOB, self.job, {"resume_token": json_util.dumps(resume_token)})
+            self.saved_token = resume_token
+
+    def follow(self, stream, max_events=None, checkpoint_seconds=LIVE_CHECKPOINT_SECONDS):
+        """
+        Handles events as they come. Rows go out (with a checkpoint) whenever
+        the stream has nothing more for LIVE_MAX_AWAIT_MS, and at least every
+        `checkpoint_seconds` while it keeps delivering.
+        """
+        checkpointed = time.monotonic()
+        while stream.alive:
+            change = stream.try_next()
+            if change is not None:
+                self.handle(change)
+            if change is None or time.monotonic() - checkpointed >= checkpoint_seconds:
+                self.checkpoint(stream.resume_token)
+                checkpointed = time.monotonic()
+            if max_events and self.events >= max_events:
+                break
+        self.checkpoint(stream.resume_token)
+
+    def run(self, connection=None, max_events=None, checkpoint_seconds=LIVE_CHECKPOINT_SECONDS,
+            max_retries=MAX_RETRIES, retry_delay=RETRY_DELAY):
+        """
+        Catches up, then tails until the stream ends (collection dropped) or
+        max_events. A lost connection is recovered and the stream reopened
+        from the saved token.
+        """
+        started = bool(self.states)
+        resumed = self.load_token() is not None
+        attempt = 0
+        while True:
+            try:
+                with self.watch() as stream:
+                    if not started:
+                        self.restore_outputs()
+                        self.catch_up(resumed)
+                        self.load_states()
+                        self.checkpoint(stream.resume_token)
+                        started = True
+                        print(f"Tailing {self.tail.collection} for {len(self.object_ids)} IDs")
+                    self.follow(stream, max_events, checkpoint_seconds)
+                return self.rows
+            except ConnectionFailure as e:
+                attempt += 1
+                if attempt > max_retries:
+                    raise
+                print(f"Change stream lost ({e!r}), reopening (retry {attempt}/{max_retries})")
+                time.sleep(retry_delay)
+                if connection:
+                    connection.recover()
+
+    def close(self):
+        # a stop between checkpoints: save the states, the token stays behind them
+        self.checkpoint()
+        for writer in self.writers.values():
+            writer.close()
+
+
+# -------- CLI --------
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Tail metas (parse1) or driverlocations (initial_main) with a change stream "
+                    "and append new rows to per-ID CSVs. Needs a replica set; for a local test "
+                    "run `mongod --replSet rs0` once initiated with rs.initiate() and pass "
+                    "--mongo-uri mongodb://localhost:27017/?replicaSet=rs0."
+    )
+    parser.add_argument("job", choices=sorted(TAILS))
+    parser.add_argument("ids", nargs="*", help="driver or vehicle ObjectIds")
+    parser.add_argument("--ids-file", help="file with one ObjectId per line")
+    parser.add_argument("--output-dir", default="live_output")
+    parser.add_argument("--watermark-dir", default=WATERMARK_DIR,
+                        help="ID states and the resume token")
+    parser.add_argument("--workers", type=int, default=8, help="threads for the catch-up scan")
+    parser.add_argument("--max-events", type=int, help="stop after this many new documents")
+    parser.add_argument("--checkpoint-seconds", type=float, default=LIVE_CHECKPOINT_SECONDS)
+    parser.add_argument("--mongo-uri", help="connect here instead of through the SSH tunnel")
+    parser.add_argument("--db", default=MONGO_DB, help="database name with --mongo-uri")
+    args = parser.parse_args(argv)
+
+    object_ids = read_ids(args.ids, args.ids_file)
+    if not object_ids:
+        parser.error("no IDs given")
+
+    if args.mongo_uri:
+        connection = None
+        client = MongoClient(args.mongo_uri)
+        db = client[args.db]
+    else:
+        connection = MongoConnection().open()
+        db = connection.db
+
+    lookups = LookupCache(db, ttl=LOOKUP_CACHE_TTL, path=LOOKUP_CACHE_PATH)
+    tail = LiveTail(db, args.job, object_ids, output_dir=args.output_dir,
+                    store=WatermarkStore(args.watermark_dir), lookups=lookups,
+                    workers=args.workers)
+    try:
+        tail.run(connection, max_events=args.max_events,
+                 checkpoint_seconds=args.checkpoint_seconds)
+    except KeyboardInterrupt:
+        print("Stopped")
+    finally:
+        tail.close()
+        lookups.close()
+        if connection:
+            connection.close()
+        else:
+            client.close()
+
+    print(f"Tailed {tail.events} documents, {tail.rows} new rows in {args.output_dir}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,151 @@
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import bson
+
+# lookups per $in query when prefetching
+PREFETCH_BATCH = 500
+
+TIMEZONE_PROJECTION = {"tzCode": 1}
+
+
+class LookupCache:
+    """
+    Cache for _id lookups on small reference collections (drivers, timezones, ...).
+
+    An in-process LRU sits in front of an optional SQLite file; entries from
+    both expire after `ttl` seconds. Missing documents are cached too, so a
+    driver without a profile is not re-queried for every run.
+    """
+
+    def __init__(self, db, maxsize=10000, ttl=6 * 3600, path=None):
+        self.db = db
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()    # key -> (expires_at, doc)
+        self.hits = 0
+        self.misses = 0
+
+        self.disk = None
+        if path:
+            self.disk = sqlite3.connect(path, check_same_thread=False)
+            self.disk.execute(
+                "CREATE TABLE IF NOT EXISTS lookups "
+                "(key TEXT PRIMARY KEY, expires_at REAL, doc BLOB)"
+            )
+            self.disk.execute("DELETE FROM lookups WHERE expires_at < ?", (time.time(),))
+            self.disk.commit()
+
+    @staticmethod
+    def key(collection, _id, projection):
+        fields = ",".join(sorted(projection)) if projection else "*"
+        return f"{collection}|{fields}|{_id!r}"
+
+    # -------- CACHE LEVELS --------
+    def _read(self, key):
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] > now:
+                self.entries.move_to_end(key)
+                return True, entry[1]
+
+            if self.disk:
+                row = self.disk.execute(
+                    "SELECT expires_at, doc FROM lookups WHERE key = ?", (key,)
+                ).fetchone()
+                if row and row[0] > now:
+                    doc = bson.decode(row[1]) if row[1] is not None else None
+                    self._remember(key, row[0], doc)
+                    return True, doc
+
+        return False, None
+
+    def _remember(self, key, expires_at, doc):
+        self.entries[key] = (expires_at, doc)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def _write(self, items):
+        expires_at = time.time() + self.ttl
+        with self.lock:
+            for key, doc in items:
+                self._remember(key, expires_at, doc)
+            if self.disk:
+                self.disk.executemany(
+                    "INSERT OR REPLACE INTO lookups (key, expires_at, doc) VALUES (?, ?, ?)",
+                    [(key, expires_at, bson.encode(doc) if doc is not None else None)
+                     for key, doc in items],
+                )
+                self.disk.commit()
+
+    # -------- LOOKUPS --------
+    def get_many(self, collection, ids, projection=None):
+        """
+        Returns {_id: doc or None}; all misses are fetched with $in queries.
+        """
+        found = {}
+        missing = {}                    # dict as an ordered set
+        for _id in ids:
+            hit, doc = self._read(self.key(collection, _id, projection))
+            if hit:
+                found[_id] = doc
+            else:
+                missing[_id] = None
+        missing = list(missing)
+
+        with self.lock:
+            self.hits += len(found)
+            self.misses += len(missing)
+
+        for start in range(0, len(missing), PREFETCH_BATCH):
+            chunk = missing[start:start + PREFETCH_BATCH]
+            docs = {
+                doc["_id"]: doc
+                for doc in self.db[collection].find(
+                    {"_id": {"$in": chunk}}, dict(projection) if projection else None
+                )
+            }
+            self._write([(self.key(collection, _id, projection), docs.get(_id)) for _id in chunk])
+            for _id in chunk:
+                found[_id] = docs.get(_id)
+
+        return found
+
+    def get(self, collection, _id, projection=None):
+        return self.get_many(collection, [_id], projection)[_id]
+
+    def prefetch_driver_profiles(self, driver_ids, driver_projection):
+        drivers = self.get_many("drivers", driver_ids, driver_projection)
+        timezone_ids = {d["timeZone"] for d in drivers.values() if d and d.get("timeZone")}
+        self.get_many("timezones", list(timezone_ids), TIMEZONE_PROJECTION)
+
+    def close(self):
+        if self.disk:
+            self.disk.close()
+            self.disk = None
+
+
+def driver_profile(db, driver_id, driver_projection, lookups=None):
+    """
+    Returns (driver doc or None, tzCode or None), through `lookups` if given.
+    """
+    if lookups:
+        driver = lookups.get("drivers", driver_id, driver_projection)
+    else:
+        driver = db.drivers.find_one({"_id": driver_id}, dict(driver_projection))
+
+    driver_timezone = None
+    if driver and driver.get("timeZone"):
+        if lookups:
+            tz = lookups.get("timezones", driver["timeZone"], TIMEZONE_PROJECTION)
+        else:
+            tz = db.timezones.find_one({"_id": driver["timeZone"]}, dict(TIMEZONE_PROJECTION))
+        if tz:
+            driver_timezone = tz.get("tzCode")
+
+    return driver, driver_timezone
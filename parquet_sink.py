@@ -0,0 +1,173 @@
+import os
+import shutil
+import threading
+import time
+import uuid
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# column type names used in the scripts' ParquetLayout.column_types
+ARROW_TYPES = {
+    "string": pa.string(),
+    "float64": pa.float64(),
+    "int64": pa.int64(),
+    "bool": pa.bool_(),
+    "date": pa.date32(),
+    "timestamp": pa.timestamp("ms"),
+    "list<string>": pa.list_(pa.string()),
+    "list<int64>": pa.list_(pa.int64()),
+}
+
+# partition value pyarrow's hive partitioning reads back as null
+NULL_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+PARQUET_COMPRESSION = "zstd"
+# ParquetLayout.period -> strftime format of its partition values
+PERIOD_FORMATS = {"date": "%Y-%m-%d", "month": "%Y-%m"}
+
+
+def arrow_schema(layout):
+    """
+    The dataset schema; string columns in layout.dict_columns are Arrow
+    dictionaries, so readers get categoricals instead of repeated strings.
+    """
+    fields = []
+    for name, kind in layout.column_types.items():
+        arrow_type = ARROW_TYPES[kind]
+        if kind == "string" and name in layout.dict_columns:
+            arrow_type = pa.dictionary(pa.int32(), pa.string())
+        fields.append(pa.field(name, arrow_type))
+    return pa.schema(fields)
+
+
+def partition_path(root, layout, object_id):
+    # <root>/<dataset>/<driver|vehicle>=<id>
+    return os.path.join(root, layout.dataset, f"{layout.key}={object_id}")
+
+
+def _missing(value):
+    return value is None or (isinstance(value, float) and value != value)
+
+
+def _to_list(value, element):
+    if not isinstance(value, (list, tuple)):
+        return None
+    return [None if _missing(item) else element(item) for item in value]
+
+
+def column_array(values, kind, arrow_type):
+    """
+    One frame column as an Arrow array of its schema type. Numeric columns
+    turn CSV markers such as "not_avail" into nulls.
+    """
+    if kind == "string":
+        values = [None if _missing(value) else str(value) for value in values]
+        return pa.array(values, type=arrow_type)
+    if kind in ("float64", "int64"):
+        values = pd.to_numeric(values, errors="coerce")
+    elif kind == "bool":
+        values = values.astype(bool)
+    elif kind in ("date", "timestamp"):
+        values = pd.to_datetime(values, errors="coerce")
+    elif kind == "list<string>":
+        return pa.array([_to_list(value, str) for value in values], type=arrow_type)
+    elif kind == "list<int64>":
+        return pa.array([_to_list(value, int) for value in values], type=arrow_type)
+    return pa.array(values, from_pandas=True).cast(arrow_type)
+
+
+def partition_dates(values, period="date"):
+    period_format = PERIOD_FORMATS[period]
+    dates = pd.to_datetime(values, errors="coerce")
+    return [NULL_PARTITION if pd.isna(day) else day.strftime(period_format) for day in dates]
+
+
+class ParquetSink:
+    """
+    Writes DataFrame chunks as one ID's slice of a hive-partitioned Parquet
+    dataset: <path>/date=YYYY-MM-DD/part-<run>-<n>.parquet (or month=YYYY-MM),
+    typed per the layout's schema.
+
+    Rows arrive in createdAt order, so a period's writer is closed as soon as
+    a later one shows up: each run leaves one file per period. Incremental runs
+    (append=True) add their own part files; a full run replaces the ID's
+    directory, as the CSV sink rewrites its file.
+
+    Parts are written as dot files, which dataset readers skip, and renamed
+    by close(). discard() deletes them instead, so a failed incremental run
+    adds nothing its watermark does not cover.
+    """
+
+    def __init__(self, path, append=False, layout=None, compression=PARQUET_COMPRESSION):
+        self.path = path
+        self.layout = layout
+        self.schema = arrow_schema(layout)
+        self.compression = compression
+        self.run = f"{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.writers = {}
+        self.parts = 0
+        self.pending = []               # (dot file, final path) of every part
+        self.lock = threading.Lock()
+
+        if not append and os.path.isdir(path):
+            shutil.rmtree(path)
+        os.makedirs(path, exist_ok=True)
+
+    def table(self, df):
+        columns = [
+            column_array(df[field.name], self.layout.column_types[field.name], field.type)
+            if field.name in df else pa.nulls(len(df), field.type)
+            for field in self.schema
+        ]
+        return pa.Table.from_arrays(columns, schema=self.schema)
+
+    def write(self, df):
+        if df.empty:
+            return
+        table = self.table(df)
+        dates = partition_dates(df[self.layout.date_column], self.layout.period)
+
+        with self.lock:
+            for day in dict.fromkeys(dates):
+                mask = pa.array([value == day for value in dates])
+                self.writer(day).write_table(table.filter(mask))
+
+            # earlier periods are complete
+            last = dates[-1]
+            for day in [day for day in self.writers if day < last]:
+                self.writers.pop(day).close()
+
+    def writer(self, day):
+        if day not in self.writers:
+            directory = os.path.join(self.path, f"{self.layout.period}={day}")
+            os.makedirs(directory, exist_ok=True)
+            # numbered, in case out-of-order rows reopen a period
+            self.parts += 1
+            name = f"part-{self.run}-{self.parts}.parquet"
+            hidden = os.path.join(directory, "." + name)
+            self.pending.append((hidden, os.path.join(directory, name)))
+            self.writers[day] = pq.ParquetWriter(
+                hidden, self.schema, compression=self.compression,
+            )
+        return self.writers[day]
+
+    def close_writers(self):
+        for writer in self.writers.values():
+            writer.close()
+        self.writers = {}
+
+    def close(self):
+        with self.lock:
+            self.close_writers()
+            for hidden, path in self.pending:
+                os.replace(hidden, path)
+            self.pending = []
+
+    def discard(self):
+        with self.lock:
+            self.close_writers()
+            for hidden, _ in self.pending:
+                if os.path.exists(hidden):
+                    os.remove(hidden)
+            self.pending = []
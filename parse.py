@@ -1,99 +1,127 @@
-from sshtunnel import SSHTunnelForwarder
-from pymongo import MongoClient, ASCENDING, DESCENDING
+from pymongo import ASCENDING, DESCENDING
 from bson.objectid import ObjectId
 import pandas as pd
-import urllib.parse
 from datetime import datetime, timedelta
+import time
+from functools import partial
+from event_dates import parse_event_date
+from columnar import typed_frame
+from connection import MongoConnection
+from indexes import index_hint
+from instrumentation import Instrumentation
+from watermarks import ScanState, WatermarkStore, created_after, extract_to_csv
+from resumable import resumable_extract
+from feature_store import FeatureStore, with_features
+from lookup_cache import LookupCache, driver_profile
+from writers import ParquetLayout, output_target
+from violation_trim import LAST_7_DAYS, VIOLATION_COUNT_FIELD, fetch_trimmed_metas
+from config import (
+    DATASET_DIR, METRICS_FILE, OUTPUT_FORMAT, PROFILE_FILE, RESUMABLE_SCANS, TRIM_VIOLATIONS,
+    FEATURE_STORE_PATH, LOOKUP_CACHE_PATH, LOOKUP_CACHE_TTL,
+)
 
 
-# ---------------- SSH CONFIG ----------------
-SSH_HOST = ""
-SSH_PORT = ""
-SSH_USER = ""
-SSH_PASSWORD = ""
-
-# ---------------- MONGO CONFIG ----------------
-MONGO_USER = ""
-MONGO_PASSWORD = urllib.parse.quote_plus("")
-MONGO_DB = ""
-MONGO_HOST = ""
-MONGO_PORT = ""
-
 # -------- INPUT DRIVER ID --------
 DRIVER_ID = ObjectId("68cf142425b5590dd4e8a44a")
 # DRIVER_ID=ObjectId("68496a5ff38dc2543d248051")
 
-# -------- HELPER FUNCTION --------
-def parse_event_date(event_date_str):
-    """
-    Converts 'MMDDYY' -> datetime
-    """
-    try:
-        return datetime.strptime(event_date_str, "%m%d%y")
-    except Exception:
-        return None
+OUTPUT_FILE = "driver_metas_all_with_diagnostics_update.csv"
+
+DRIVER_PROJECTION = {"driverId": 1, "cycleRule": 1, "timeZone": 1}
+
+METAS_PROJECTION = {
+    "clockData": 1,
+    "voilations": 1,
+    "ptiViolation": 1,
+    "deviceCalculations": 1,
+    "createdAt": 1,
+    "lastActivity": 1
+}
+
+# -------- OUTPUT DTYPES --------
+# Declared instead of inferred per chunk. The Node writers store whole numbers
+# as int32, so these columns mix ints and doubles and print as floats.
+COLUMN_DTYPES = {
+    "speed": "float64", "latitude": "float64", "longitude": "float64",
+    "last7Days violation": "int64", "last7Days pti_violations": "int64",
+}
+
+# -------- PARQUET OUTPUT (OUTPUT_FORMAT=parquet) --------
+# datasets/driver_metas/driver=<id>/month=<dataDate month>/; patterns are real lists
+PARQUET_LAYOUT = ParquetLayout(
+    dataset="driver_metas",
+    key="driver",
+    column_types={
+        "driver_id": "string", "cycleRule": "string", "timezone": "string",
+        "splitShiftActive": "bool", "driveSeconds": "float64", "onDutySeconds": "float64",
+        "cycleSeconds": "float64", "remainingDriveMinutes": "float64",
+        "remainingShiftMinutes": "float64", "breakRemainingMinutes": "float64",
+        "violation active": "list<int64>", "last7Days violation": "int64",
+        "violation patterns": "list<string>",
+        "last7Days pti_violations": "int64", "pti_violation patterns": "list<string>",
+        "speed": "float64", "latitude": "float64", "longitude": "float64",
+        "Address": "string", "dataDate": "timestamp",
+    },
+    date_column="dataDate",
+    dict_columns={"driver_id", "cycleRule", "timezone", "Address"},
+    period="month",
+)
+
+# -------- INCREMENTAL MODE --------
+# read only metas created after the stored watermark and append to OUTPUT_FILE
+INCREMENTAL = False
 
+# -------- SERVER-SIDE TRIMMING --------
+# fetch with and without TRIM_VIOLATIONS once and compare before saving
+VERIFY_TRIMMING = False
+
+# -------- HELPER FUNCTION --------
 # def safe_float(value, default=0):
 #     try:
 #         return float(value)
 #     except (ValueError, TypeError):
 #         return default
 
-with SSHTunnelForwarder(
-    (SSH_HOST, SSH_PORT),
-    ssh_username=SSH_USER,
-    ssh_password=SSH_PASSWORD,
-    remote_bind_address=(MONGO_HOST, MONGO_PORT),
-    local_bind_address=("localhost", 0),
-) as tunnel:
-
-    mongo_uri = (
-        f"mongodb://{MONGO_USER}:{MONGO_PASSWORD}"
-        f"@localhost:{tunnel.local_bind_port}/{MONGO_DB}"
-        f"?authSource=driverbookv2_stage"
-    )
+# -------- FETCH --------
+def fetch_driver_data(db, driver_id, materialize=False, state=None, lookups=None, trim=None):
+    since = state.last_created_at if state else None
+    seen_ids = state.resume_ids() if state else ()
+    trim = TRIM_VIOLATIONS if trim is None else trim
 
-    client = MongoClient(mongo_uri)
-    db = client[MONGO_DB]
+    # -------- DRIVER PROFILE + TIMEZONE --------
+    driver, driver_timezone = driver_profile(db, driver_id, DRIVER_PROJECTION, lookups)
 
-    # -------- DRIVER PROFILE --------
-    driver = db.drivers.find_one(
-        {"_id": DRIVER_ID},
-        {"driverId": 1, "cycleRule": 1, "timeZone": 1}
-    )
+    # -------- ALL METAS --------
+    query = created_after({"driver": driver_id}, since, seen_ids)
+    if trim:
+        # violations older than 7 days stay on the server
+        metas_cursor = fetch_trimmed_metas(db, query, METAS_PROJECTION, LAST_7_DAYS)
+    else:
+        metas_cursor = db.metas.find(
+            query, projection=dict(METAS_PROJECTION), hint=index_hint("metas"),
+        ).sort("createdAt", ASCENDING)
 
-    # -------- TIMEZONE LOOKUP --------
-    driver_timezone = None
-    if driver and driver.get("timeZone"):
-        tz_record = db.timezones.find_one(
-            {"_id": driver["timeZone"]},
-            {"tzCode": 1}
-        )
-        if tz_record:
-            driver_timezone = tz_record.get("tzCode")
+    return {
+        "driver": driver,
+        "timezone": driver_timezone,
+        "metas": list(metas_cursor) if materialize else metas_cursor,
+    }
 
-    # -------- ALL METAS --------
-    metas_cursor = db.metas.find(
-        {"driver": DRIVER_ID},
-        projection={
-            "clockData": 1,
-            "voilations": 1,
-            "ptiViolation": 1,
-            "deviceCalculations": 1,
-            "createdAt": 1,
-            "lastActivity": 1
-        }
-    ).sort("createdAt", ASCENDING)
 
-    records = []
+# -------- TRANSFORM --------
+def iter_driver_records(driver_id, data, state=None):
+    driver = data["driver"]
+    driver_timezone = data["timezone"]
+    state = state or ScanState()
 
-    for meta in metas_cursor:
+    for meta in data["metas"]:
         clock = meta.get("clockData", {})
         violations = meta.get("voilations", [])
         pti_violations = meta.get("ptiViolation", [])
         device_calc = meta.get("deviceCalculations", {})
         data_date = meta.get("createdAt")
         last_act= meta.get("lastActivity",{})
+        state.last_created_at = data_date
         
 
 
@@ -144,7 +172,7 @@ with SSHTunnelForwarder(
 
             # Violations (STRUCTURED)
             
-            "violation active": [len(violations)],
+            "violation active": [meta.get(VIOLATION_COUNT_FIELD, len(violations))],
             "last7Days violation": violations_last7Days,
             "violation patterns": list(violation_patterns),
             
@@ -164,11 +192,89 @@ with SSHTunnelForwarder(
             "dataDate": data_date
         }
 
-        records.append(record)
+        yield record
+
+
+def build_driver_records(driver_id, data, state=None):
+    return list(iter_driver_records(driver_id, data, state))
+
+
+def records_to_frame(records):
+    # COLUMN_DTYPES are declared, the other columns written as their values
+    return typed_frame(pd.DataFrame(records, dtype=object).fillna(0), COLUMN_DTYPES)
+
+
+def extract_driver(db, driver_id):
+    return records_to_frame(build_driver_records(driver_id, fetch_driver_data(db, driver_id)))
+
+
+def verify_server_trim(db, driver_id):
+    """
+    Runs the plain and server-trimmed metas fetches and checks they give the same records.
+    """
+    full_df = records_to_frame(
+        build_driver_records(driver_id, fetch_driver_data(db, driver_id, trim=False))
+    )
+    trimmed_df = records_to_frame(
+        build_driver_records(driver_id, fetch_driver_data(db, driver_id, trim=True))
+    )
+    return full_df.equals(trimmed_df)
+
+
+# -------- SSH TUNNEL --------
+def main():
+    instruments = Instrumentation(PROFILE_FILE) if METRICS_FILE or PROFILE_FILE else None
+    connect_started = time.perf_counter()
+
+    with MongoConnection(
+        event_listeners=instruments.listeners() if instruments else None,
+    ) as connection:
+
+        if instruments:
+            instruments.add_time("connect", time.perf_counter() - connect_started)
+        db = connection.db
+        lookups = LookupCache(db, ttl=LOOKUP_CACHE_TTL, path=LOOKUP_CACHE_PATH)
+
+        if VERIFY_TRIMMING:
+            same = verify_server_trim(db, DRIVER_ID)
+            print(f"Server trimming matches python filtering: {same}")
+
+        # -------- DATAFRAME & CSV / PARQUET (streamed in chunks) --------
+        path, open_sink = output_target(
+            DRIVER_ID, OUTPUT_FILE, PARQUET_LAYOUT, OUTPUT_FORMAT, DATASET_DIR
+        )
+        features = FeatureStore(FEATURE_STORE_PATH) if FEATURE_STORE_PATH else None
+        if features:
+            # every chunk written is also upserted by (driver, day)
+            open_sink = with_features(open_sink, features, "parse", DRIVER_ID)
+        if RESUMABLE_SCANS and OUTPUT_FORMAT == "csv":
+            # checkpointed; picks up after a dropped tunnel / cursor timeout
+            rows = resumable_extract(
+                connection, "parse", DRIVER_ID, path,
+                partial(fetch_driver_data, lookups=lookups),
+                iter_driver_records, records_to_frame, ScanState,
+                store=WatermarkStore() if INCREMENTAL else None,
+                instruments=instruments, open_sink=open_sink,
+            )
+        else:
+            rows = extract_to_csv(
+                db, "parse", DRIVER_ID, path,
+                partial(fetch_driver_data, lookups=lookups),
+                iter_driver_records, records_to_frame, ScanState,
+                store=WatermarkStore() if INCREMENTAL else None,
+                instruments=instruments, open_sink=open_sink,
+            )
+        lookups.close()
+        if features:
+            features.close()
+
+        print(f"Saved {rows} records to {path}")
+        if features:
+            print(f"Upserted daily features into {FEATURE_STORE_PATH}")
+
+        if instruments:
+            instruments.report(METRICS_FILE)
 
-    # -------- DATAFRAME & CSV --------
-    df = pd.DataFrame(records)
-    df = df.fillna(0)
 
-    df.to_csv("driver_metas_all_with_diagnostics_update.csv", index=False)
-    print(f"Saved {len(df)} records to CSV")
+if __name__ == "__main__":
+    main()
@@ -1,95 +1,228 @@
-from sshtunnel import SSHTunnelForwarder
-from pymongo import MongoClient, ASCENDING
+from pymongo import ASCENDING
 from bson.objectid import ObjectId
 import pandas as pd
-import urllib.parse
-from datetime import datetime, timedelta
-import os
-from dotenv import load_dotenv
-
-# -------- LOAD ENV VARIABLES --------
-load_dotenv()
-
-# ---------------- SSH CONFIG ----------------
-SSH_HOST = os.getenv("SSH_HOST")
-SSH_PORT = int(os.getenv("SSH_PORT"))
-SSH_USER = os.getenv("SSH_USER")
-SSH_PASSWORD = os.getenv("SSH_PASSWORD")
-
-# ---------------- MONGO CONFIG ----------------
-MONGO_USER = os.getenv("MONGO_USER")
-MONGO_PASSWORD = urllib.parse.quote_plus(os.getenv("MONGO_PASSWORD"))
-MONGO_DB = os.getenv("MONGO_DB")
-MONGO_HOST = os.getenv("MONGO_HOST")
-MONGO_PORT = int(os.getenv("MONGO_PORT"))
+from datetime import datetime
+import time
+from functools import partial
+from event_dates import parse_event_date
+from rolling_window import RollingDayWindow
+from columnar import rows_to_columns, typed_frame
+from writers import ParquetLayout, output_target
+from connection import MongoConnection
+from indexes import index_hint
+from instrumentation import Instrumentation
+from watermarks import ScanState, WatermarkStore, created_after, extract_to_csv
+from resumable import resumable_extract
+from feature_store import FeatureStore, with_features
+from prefetch import (
+    metas_created_span,
+    prefetch_daily_distance,
+    prefetch_minor_violations,
+)
+from lookup_cache import LookupCache, driver_profile
+from violation_trim import SAME_DAY, VIOLATION_COUNT_FIELD, fetch_trimmed_metas
+from config import (
+    DATASET_DIR, LAZY_DECODE, METRICS_FILE, OUTPUT_FORMAT, PROFILE_FILE, RESUMABLE_SCANS,
+    TRIM_VIOLATIONS,
+    FEATURE_STORE_PATH, LOOKUP_CACHE_PATH, LOOKUP_CACHE_TTL,
+)
 
 # -------- INPUT DRIVER ID --------
 DRIVER_ID = ObjectId("686b6410a2a58a0379e78689")
 
-#-------- HELPER FUNCTIONS --------
-def parse_event_date(event_date_str):
-    try:
-        return datetime.strptime(event_date_str, "%m%d%y")
-    except Exception:
-        return None
-
-
-def end_of_day(dt):
-    return dt.replace(hour=23, minute=59, second=59, microsecond=999999)
-
-# -------- SSH TUNNEL --------
-with SSHTunnelForwarder(
-    (SSH_HOST, SSH_PORT),
-    ssh_username=SSH_USER,
-    ssh_password=SSH_PASSWORD,
-    remote_bind_address=(MONGO_HOST, MONGO_PORT),
-    local_bind_address=("localhost", 0),
-) as tunnel:
-
-    mongo_uri = (
-        f"mongodb://{MONGO_USER}:{MONGO_PASSWORD}"
-        f"@localhost:{tunnel.local_bind_port}/{MONGO_DB}"
-        f"?authSource=driverbookv2_stage"
-    )
-
-    client = MongoClient(mongo_uri)
-    db = client[MONGO_DB]
+OUTPUT_FILE = "driver_metas_all_with_diagnostics_update_final2.csv"
+
+DRIVER_PROJECTION = {"driverId": 1, "cycleRule": 1, "timeZone": 1, "fullName": 1, "tenantId": 1}
+
+METAS_PROJECTION = {
+    "clockData": 1,
+    "voilations": 1,
+    "ptiViolation": 1,
+    "deviceCalculations": 1,
+    "createdAt": 1,
+    "lastActivity": 1,
+    "vehicle" : 1
+}
+
+# -------- LAZY DECODING --------
+# Only the leaves iter_driver_rows() reads: the server drops the rest of
+# clockData, lastActivity and each violation before anything is decoded.
+# (RawBSONDocument was slower here; every projected top-level field is read.)
+METAS_LEAF_PROJECTION = {
+    "clockData.isSplitActive": 1,
+    "voilations.type": 1,
+    "voilations.startedAt.eventDate": 1,
+    "ptiViolation.type": 1,
+    "ptiViolation.SHIFT_START_DATE.eventDate": 1,
+    "deviceCalculations.CONSECUTIVE_DRIVING": 1,
+    "deviceCalculations.DRIVING": 1,
+    "deviceCalculations.ON_DUTY_CURRENT_TIME": 1,
+    "deviceCalculations.DRIVING_CYCLE": 1,
+    "deviceCalculations.CYCLE_START_DATE.eventDate": 1,
+    "deviceCalculations.DRIVING_ADDED": 1,
+    "deviceCalculations.ON_DUTY_NOT_DRIVING_CYCLE": 1,
+    "deviceCalculations.OFF_DUTY": 1,
+    "deviceCalculations.OFF_DUTY_CYCLE": 1,
+    "deviceCalculations.device_calc": 1,
+    "createdAt": 1,
+    "lastActivity.latitude": 1,
+    "lastActivity.longitude": 1,
+    "lastActivity.address": 1,
+    "vehicle": 1,
+}
+
+# -------- INCREMENTAL MODE --------
+# read only metas created after the stored watermark and append to OUTPUT_FILE
+INCREMENTAL = False
+
+# -------- SERVER-SIDE TRIMMING --------
+# fetch with and without TRIM_VIOLATIONS once and compare before saving
+VERIFY_TRIMMING = False
+
+# -------- OUTPUT COLUMNS --------
+# one CSV column per value of the tuples iter_driver_rows() yields
+RECORD_COLUMNS = [
+    "driver_id", "driver_db_id", "driver_name", "Tenant_id", "vehicle_id", "cycleRule", "timezone",
+    "splitShiftActive", "consective_driving", "driveSeconds", "onDutySeconds", "cycleSeconds",
+    "cycle_start_date", "Addition_driving_time", "ON_DUTY_NOT_DRIVING_CYCLE", "off_dutySeconds",
+    "OFF_DUTY_CYCLE", "Total_number_of_shift",
+    "violation active", "last7Days violation", "violation patterns",
+    "last7Days pti_violations", "pti_violation patterns",
+    "last7_days_minior_violation", "minior_violation_pattern",
+    "latitude", "longitude", "Address", "distance", "dataDate",
+]
+# repeated strings, stored once per distinct value while a chunk is buffered
+DICT_COLUMNS = {"vehicle_id", "cycle_start_date", "Address"}
+# Declared instead of inferred per chunk. The Node writers store whole numbers
+# as int32, so these columns mix ints and doubles and print as floats.
+COLUMN_DTYPES = {
+    "violation active": "int64", "last7Days violation": "int64",
+    "last7Days pti_violations": "int64", "last7_days_minior_violation": "int64",
+    "latitude": "float64", "longitude": "float64", "distance": "float64",
+}
+
+# -------- PARQUET OUTPUT (OUTPUT_FORMAT=parquet) --------
+# datasets/driver_diagnostics/driver=<id>/month=<dataDate month>/; patterns are real lists
+PARQUET_LAYOUT = ParquetLayout(
+    dataset="driver_diagnostics",
+    key="driver",
+    column_types={
+        "driver_id": "string", "driver_db_id": "string", "driver_name": "string",
+        "Tenant_id": "string", "vehicle_id": "string", "cycleRule": "string",
+        "timezone": "string", "splitShiftActive": "bool", "consective_driving": "float64",
+        "driveSeconds": "float64", "onDutySeconds": "float64", "cycleSeconds": "float64",
+        "cycle_start_date": "string", "Addition_driving_time": "float64",
+        "ON_DUTY_NOT_DRIVING_CYCLE": "float64", "off_dutySeconds": "float64",
+        "OFF_DUTY_CYCLE": "float64", "Total_number_of_shift": "float64",
+        "violation active": "int64", "last7Days violation": "int64",
+        "violation patterns": "list<string>",
+        "last7Days pti_violations": "int64", "pti_violation patterns": "list<string>",
+        "last7_days_minior_violation": "int64", "minior_violation_pattern": "list<string>",
+        "latitude": "float64", "longitude": "float64", "Address": "string",
+        "distance": "float64", "dataDate": "date",
+    },
+    date_column="dataDate",
+    dict_columns=DICT_COLUMNS | {"driver_id", "driver_db_id", "driver_name", "Tenant_id",
+                                 "cycleRule", "timezone"},
+    period="month",
+)
+
+# -------- SCAN STATE --------
+class DriverScanState(ScanState):
+    """
+    Watermark plus the rolling 7-day HOS/PTI windows carried between runs.
+    """
+
+    def __init__(self, last_created_at=None):
+        super().__init__(last_created_at)
+        self.hos_violation_window = RollingDayWindow(days=7)
+        self.pti_violation_window = RollingDayWindow(days=7)
+
+    def to_state(self):
+        return {
+            **super().to_state(),
+            "hos_violation_window": self.hos_violation_window.to_state(),
+            "pti_violation_window": self.pti_violation_window.to_state(),
+        }
 
-    # -------- DRIVER PROFILE --------
-    driver = db.drivers.find_one(
-        {"_id": DRIVER_ID},
-        {"driverId": 1, "cycleRule": 1, "timeZone": 1, "fullName": 1,"tenantId":1}
+    @classmethod
+    def from_state(cls, state):
+        scan_state = super().from_state(state)
+        scan_state.hos_violation_window = RollingDayWindow.from_state(state["hos_violation_window"])
+        scan_state.pti_violation_window = RollingDayWindow.from_state(state["pti_violation_window"])
+        return scan_state
+
+
+# -------- FETCH --------
+def fetch_driver_data(db, driver_id, materialize=False, state=None, lookups=None, lazy=None,
+                      trim=None):
+    """
+    Runs every query for one driver. With materialize=True the metas cursor
+    is drained into a list so the result can be sent to another process;
+    a `state` restored from a watermark limits the scan to newer metas.
+    lazy (default LAZY_DECODE) fetches metas with METAS_LEAF_PROJECTION.
+    trim (default TRIM_VIOLATIONS) drops the violations that cannot count
+    on the server (violation_trim.py).
+    """
+    since = state.last_created_at if state else None
+    seen_ids = state.resume_ids() if state else ()
+    lazy = LAZY_DECODE if lazy is None else lazy
+    trim = TRIM_VIOLATIONS if trim is None else trim
+
+    context = fetch_driver_context(
+        db, driver_id, metas_created_span(db, driver_id, since, seen_ids), lookups
     )
 
-    # -------- TIMEZONE --------
-    driver_timezone = None
-    if driver and driver.get("timeZone"):
-        tz = db.timezones.find_one(
-            {"_id": driver["timeZone"]},
-            {"tzCode": 1}
-        )
-        if tz:
-            driver_timezone = tz.get("tzCode")
-
     # -------- METAS --------
-    metas_cursor = db.metas.find(
-        {"driver": DRIVER_ID},
-        projection={
-            "clockData": 1,
-            "voilations": 1,
-            "ptiViolation": 1,
-            "deviceCalculations": 1,
-            "createdAt": 1,
-            "lastActivity": 1,
-            "vehicle" : 1
-        }
-    ).sort("createdAt", ASCENDING)
-
-    records = []
-    pti_violation_history = []
-    hos_violation_history = []   
-
-    for meta in metas_cursor:
+    query = created_after({"driver": driver_id}, since, seen_ids)
+    projection = METAS_LEAF_PROJECTION if lazy else METAS_PROJECTION
+    if trim:
+        metas_cursor = fetch_trimmed_metas(db, query, projection, SAME_DAY)
+    else:
+        metas_cursor = db.metas.find(
+            query, projection=dict(projection), hint=index_hint("metas"),
+        ).sort("createdAt", ASCENDING)
+
+    return {**context, "metas": list(metas_cursor) if materialize else metas_cursor}
+
+
+def fetch_driver_context(db, driver_id, span, lookups=None):
+    """
+    Everything but the metas: profile, timezone, and the minor violations and
+    daily distances for metas created within `span` (first, last createdAt).
+    The live tail (live_tail.py) calls it per new meta.
+    """
+    # -------- DRIVER PROFILE + TIMEZONE --------
+    driver, driver_timezone = driver_profile(db, driver_id, DRIVER_PROJECTION, lookups)
+
+    # -------- BULK PREFETCH (one query per collection, joined by day) --------
+    minor_violations = None
+    distance_by_day = {}
+    if span:
+        minor_violations = prefetch_minor_violations(db, driver_id, *span)
+        distance_by_day = prefetch_daily_distance(db, driver_id, *span)
+
+    return {
+        "driver": driver,
+        "timezone": driver_timezone,
+        "minor_violations": minor_violations,
+        "distance_by_day": distance_by_day,
+    }
+
+
+# -------- TRANSFORM --------
+def iter_driver_rows(driver_id, data, state=None):
+    driver = data["driver"]
+    driver_timezone = data["timezone"]
+    minor_violations = data["minor_violations"]
+    distance_by_day = data["distance_by_day"]
+
+    state = state or DriverScanState()
+    driver_db_id = str(driver_id)
+    pti_violation_window = state.pti_violation_window
+    hos_violation_window = state.hos_violation_window
+
+    for meta in data["metas"]:
         clock = meta.get("clockData", {})
         violations = meta.get("voilations", [])
         pti_violations = meta.get("ptiViolation", [])
@@ -97,6 +230,7 @@ with SSHTunnelForwarder(
         data_date = meta.get("createdAt")
         last_act = meta.get("lastActivity", {})
         vehicle = meta.get("vehicle")
+        state.last_created_at = data_date
 
         # ================= HOS VIOLATIONS (FIXED – ROLLING 7 DAYS) =================
         # hos_violation_history.append({
@@ -144,21 +278,12 @@ with SSHTunnelForwarder(
                     continue
 
             # ✅ either no startedAt OR valid matching eventDate
-            hos_violation_history.append({
-            "date": data_date.date(),
-            "type": v.get("type", "").lower()
-            })
-
-
-        # Calculate rolling last 7 days HOS totals
-        violations_last7Days = 0
-        violation_patterns = []
-        cutoff = data_date.date() - timedelta(days=7)
-        for entry in hos_violation_history:
-            if cutoff < entry["date"] <= data_date.date():
-                violations_last7Days += 1
-                if entry["type"]:
-                    violation_patterns.append(entry["type"])
+            hos_violation_window.add(data_date.date(), v.get("type", "").lower())
+
+        # Rolling last 7 days HOS totals (evicts days <= data_date - 7)
+        hos_violation_window.advance(data_date.date())
+        violations_last7Days = hos_violation_window.count
+        violation_patterns = hos_violation_window.pattern_list()
 
         # ================= PTI VIOLATIONS (PER-DAY FIXED) =================
         for pv in pti_violations:
@@ -172,113 +297,148 @@ with SSHTunnelForwarder(
                     continue
 
             # ✅ either no startedAt OR valid matching eventDate
-            pti_violation_history.append({
-                "date": data_date.date(),
-                "type": str(pv.get("type", ""))
-            })
-
-        # Calculate rolling last 7 days PTI totals
-        pti_last7_count = 0
-        pti_last7_patterns = []
-        cutoff = data_date.date() - timedelta(days=7)
-        for entry in pti_violation_history:
-            if cutoff < entry["date"] <= data_date.date():
-                pti_last7_count += 1
-                if entry["type"]:
-                    pti_last7_patterns.append(entry["type"])
-
-
-
-        # ================= MINOR VIOLATIONS (UNCHANGED) =================
-        start_date = (data_date - timedelta(days=7)).replace(
-            hour=0, minute=0, second=0, microsecond=0
-        )
-        end_date = end_of_day(data_date)
-
-        minor_violation_count = 0
-        minor_violation_patterns = []
-
-        tracking_cursor = db.trackingviolationevents.find(
-            {
-                "driverId": DRIVER_ID,
-                "createdAt": {
-                    "$gte": start_date,
-                    "$lte": end_date
-                },
-                "isDeleted": False
-            },
-            {"violationType": 1}
-        )
+            pti_violation_window.add(data_date.date(), str(pv.get("type", "")))
 
-        for tv in tracking_cursor:
-            minor_violation_count += 1
-            if tv.get("violationType"):
-                minor_violation_patterns.append(tv["violationType"])
+        # Rolling last 7 days PTI totals
+        pti_violation_window.advance(data_date.date())
+        pti_last7_count = pti_violation_window.count
+        pti_last7_patterns = pti_violation_window.pattern_list()
 
 
+
+        # ================= MINOR VIOLATIONS (PREFETCHED) =================
+        minor_violation_count, minor_violation_patterns = minor_violations.window(data_date)
+
         # =================  DISTANCE  =================
-        day_start = data_date.replace(hour=0, minute=0, second=0, microsecond=0)
-        day_end = end_of_day(data_date)
-
-        record_table = db.recordtables.find_one(
-            {
-                "driverId": DRIVER_ID,
-                "createdAt": {"$gte": day_start, "$lte": day_end},
-                "isDeleted": False
-            },
-            {"distance": 1,},
-            sort=[("createdAt", -1)]
+        distance = distance_by_day.get(data_date.date(), 0)
+
+        # ================= FINAL RECORD (RECORD_COLUMNS order) =================
+        yield (
+            driver.get("driverId") if driver else None,                     # driver_id
+            driver_db_id,                                                   # driver_db_id
+            driver.get("fullName") if driver else None,                     # driver_name
+            driver.get("tenantId") if driver else None,                     # Tenant_id
+            str(vehicle) if vehicle else None,                              # vehicle_id
+            driver.get("cycleRule") if driver else None,                    # cycleRule
+            driver_timezone,                                                # timezone
+            clock.get("isSplitActive", False),                              # splitShiftActive
+            device_calc.get("CONSECUTIVE_DRIVING", False),                  # consective_driving
+            device_calc.get("DRIVING", 0),                                  # driveSeconds
+            device_calc.get("ON_DUTY_CURRENT_TIME", 0),                     # onDutySeconds
+            device_calc.get("DRIVING_CYCLE", 0),                            # cycleSeconds
+            device_calc.get("CYCLE_START_DATE", {}).get("eventDate", ""),   # cycle_start_date
+            device_calc.get("DRIVING_ADDED", 0),                            # Addition_driving_time
+            device_calc.get("ON_DUTY_NOT_DRIVING_CYCLE", 0),                # ON_DUTY_NOT_DRIVING_CYCLE
+            device_calc.get("OFF_DUTY", 0),                                 # off_dutySeconds
+            device_calc.get("OFF_DUTY_CYCLE", 0),                           # OFF_DUTY_CYCLE
+            # clock.get("driveSeconds", 0),                                 # remainingDriveSecond
+            # clock.get("shiftDutySecond", 0),                              # remainingShiftSecond
+            # clock.get("breakSeconds", 0),                                 # breakRemainingSeconds
+            device_calc.get("device_calc", 0),                              # Total_number_of_shift
+
+            meta.get(VIOLATION_COUNT_FIELD, len(violations)),               # violation active
+            violations_last7Days,                                           # last7Days violation
+            violation_patterns,                                             # violation patterns
+
+            pti_last7_count,                                                # last7Days pti_violations
+            pti_last7_patterns,                                             # pti_violation patterns
+
+            minor_violation_count,                                          # last7_days_minior_violation
+            minor_violation_patterns,                                       # minior_violation_pattern
+
+            # last_act.get("speed"),                                        # speed
+            last_act.get("latitude"),                                       # latitude
+            last_act.get("longitude"),                                      # longitude
+            last_act.get("address"),                                        # Address
+            distance,                                                       # distance
+            data_date.date() if isinstance(data_date, datetime) else data_date,  # dataDate
         )
 
-        distance = record_table.get("distance", 0) if record_table else 0
-        driver_name = record_table.get("driverName", 0) if record_table else 0
-
-        # ================= FINAL RECORD =================
-        record = {
-            "driver_id": driver.get("driverId") if driver else None,
-            "driver_db_id": str(DRIVER_ID),
-            "driver_name": driver.get("fullName") if driver else None,
-            "Tenant_id": driver.get("tenantId") if driver else None,
-            "vehicle_id": str(vehicle) if vehicle else None,
-            "cycleRule": driver.get("cycleRule") if driver else None,
-            "timezone": driver_timezone,
-            "splitShiftActive": clock.get("isSplitActive", False),
-            "consective_driving": device_calc.get("CONSECUTIVE_DRIVING", False),
-            "driveSeconds": device_calc.get("DRIVING", 0),
-            "onDutySeconds": device_calc.get("ON_DUTY_CURRENT_TIME", 0),
-            "cycleSeconds": device_calc.get("DRIVING_CYCLE", 0),
-            "cycle_start_date": device_calc.get("CYCLE_START_DATE", {}).get("eventDate", ""),
-            "Addition_driving_time": device_calc.get("DRIVING_ADDED", 0),
-            "ON_DUTY_NOT_DRIVING_CYCLE": device_calc.get("ON_DUTY_NOT_DRIVING_CYCLE", 0),
-            "off_dutySeconds": device_calc.get("OFF_DUTY", 0),
-            "OFF_DUTY_CYCLE": device_calc.get("OFF_DUTY_CYCLE", 0),
-            # "remainingDriveSecond": clock.get("driveSeconds", 0),
-            # "remainingShiftSecond": clock.get("shiftDutySecond", 0),
-            # "breakRemainingSeconds": clock.get("breakSeconds", 0),
-            "Total_number_of_shift": device_calc.get("device_calc", 0),
-
-            "violation active": len(violations),
-            "last7Days violation": violations_last7Days,
-            "violation patterns": violation_patterns,
-
-            "last7Days pti_violations": pti_last7_count,
-            "pti_violation patterns": pti_last7_patterns,
-
-            "last7_days_minior_violation": minor_violation_count,
-            "minior_violation_pattern": minor_violation_patterns,
-
-            # "speed": last_act.get("speed"),
-            "latitude": last_act.get("latitude"),
-            "longitude": last_act.get("longitude"),
-            "Address": last_act.get("address"),
-            "distance": distance, 
-            "dataDate": data_date.date() if isinstance(data_date, datetime) else data_date
-        }
 
-        records.append(record)
+def build_driver_rows(driver_id, data, state=None):
+    return list(iter_driver_rows(driver_id, data, state))
+
+
+def records_to_frame(records):
+    # COLUMN_DTYPES are declared, the other columns written as their values
+    return typed_frame(
+        pd.DataFrame(records).replace("", 0).fillna(0), COLUMN_DTYPES
+    )
+
 
-    # -------- SAVE CSV --------
-    df = pd.DataFrame(records).replace("", 0).fillna(0)
-    df.to_csv("driver_metas_all_with_diagnostics_update_final2.csv", index=False)
+def rows_to_frame(rows):
+    return records_to_frame(rows_to_columns(RECORD_COLUMNS, rows, DICT_COLUMNS, COLUMN_DTYPES))
 
-    print(f"Saved {len(df)} records to CSV")
+
+def extract_driver(db, driver_id):
+    return rows_to_frame(build_driver_rows(driver_id, fetch_driver_data(db, driver_id)))
+
+
+def verify_server_trim(db, driver_id):
+    """
+    Runs the plain and server-trimmed metas fetches and checks they give the same rows.
+    """
+    full_df = rows_to_frame(build_driver_rows(driver_id, fetch_driver_data(db, driver_id, trim=False)))
+    trimmed_df = rows_to_frame(build_driver_rows(driver_id, fetch_driver_data(db, driver_id, trim=True)))
+    return full_df.equals(trimmed_df)
+
+
+# -------- SSH TUNNEL --------
+def main():
+    instruments = Instrumentation(PROFILE_FILE) if METRICS_FILE or PROFILE_FILE else None
+    connect_started = time.perf_counter()
+
+    with MongoConnection(
+        event_listeners=instruments.listeners() if instruments else None,
+    ) as connection:
+
+        if instruments:
+            instruments.add_time("connect", time.perf_counter() - connect_started)
+        db = connection.db
+        lookups = LookupCache(db, ttl=LOOKUP_CACHE_TTL, path=LOOKUP_CACHE_PATH)
+
+        if VERIFY_TRIMMING:
+            same = verify_server_trim(db, DRIVER_ID)
+            print(f"Server trimming matches python filtering: {same}")
+
+        # -------- SAVE CSV / PARQUET (streamed in chunks) --------
+        path, open_sink = output_target(
+            DRIVER_ID, OUTPUT_FILE, PARQUET_LAYOUT, OUTPUT_FORMAT, DATASET_DIR
+        )
+        features = FeatureStore(FEATURE_STORE_PATH) if FEATURE_STORE_PATH else None
+        if features:
+            # every chunk written is also upserted by (driver, day)
+            open_sink = with_features(open_sink, features, "parse1", DRIVER_ID)
+        if RESUMABLE_SCANS and OUTPUT_FORMAT == "csv":
+            # checkpointed; picks up after a dropped tunnel / cursor timeout
+            rows = resumable_extract(
+                connection, "parse1", DRIVER_ID, path,
+                partial(fetch_driver_data, lookups=lookups),
+                iter_driver_rows, records_to_frame, DriverScanState,
+                store=WatermarkStore() if INCREMENTAL else None,
+                columns=RECORD_COLUMNS, dict_columns=DICT_COLUMNS, column_types=COLUMN_DTYPES,
+                instruments=instruments, open_sink=open_sink,
+            )
+        else:
+            rows = extract_to_csv(
+                db, "parse1", DRIVER_ID, path,
+                partial(fetch_driver_data, lookups=lookups),
+                iter_driver_rows, records_to_frame, DriverScanState,
+                store=WatermarkStore() if INCREMENTAL else None,
+                columns=RECORD_COLUMNS, dict_columns=DICT_COLUMNS, column_types=COLUMN_DTYPES,
+                instruments=instruments, open_sink=open_sink,
+            )
+        lookups.close()
+        if features:
+            features.close()
+
+        print(f"Saved {rows} records to {path}")
+        if features:
+            print(f"Upserted daily features into {FEATURE_STORE_PATH}")
+
+        if instruments:
+            instruments.report(METRICS_FILE)
+
+
+if __name__ == "__main__":
+    main()
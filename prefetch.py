@@ -0,0 +1,142 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from pymongo import ASCENDING, DESCENDING
+
+from indexes import index_hint
+from watermarks import created_after
+
+
+def start_of_day(dt):
+    return dt.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def end_of_day(dt):
+    return dt.replace(hour=23, minute=59, second=59, microsecond=999999)
+
+
+# -------- METAS SPAN --------
+def metas_span_ends(db, query):
+    # first and last meta of `query`; awaitables on an AsyncMongoClient database
+    hint = index_hint("metas")
+    return (
+        db.metas.find_one(query, {"createdAt": 1}, sort=[("createdAt", ASCENDING)], hint=hint),
+        db.metas.find_one(query, {"createdAt": 1}, sort=[("createdAt", DESCENDING)], hint=hint),
+    )
+
+
+def metas_created_span(db, driver_id, since=None, seen_ids=()):
+    """
+    Returns (first createdAt, last createdAt) of the driver's metas created
+    after `since` (see created_after), or None.
+    """
+    first, last = metas_span_ends(db, created_after({"driver": driver_id}, since, seen_ids))
+    if not first or not last:
+        return None
+    return first["createdAt"], last["createdAt"]
+
+
+# -------- MINOR VIOLATIONS --------
+class MinorViolationIndex:
+    """
+    trackingviolationevents for a driver grouped by calendar day, fetched once.
+
+    window(data_date) returns the same count/patterns as a find over
+    [start of (data_date - days), end of data_date].
+    """
+
+    def __init__(self, days=7):
+        self.days = days
+        self.counts = defaultdict(int)
+        self.patterns = defaultdict(list)
+
+    def add(self, created_at, violation_type):
+        day = created_at.date()
+        self.counts[day] += 1
+        if violation_type:
+            self.patterns[day].append(violation_type)
+
+    def window(self, data_date):
+        count = 0
+        patterns = []
+        day = data_date.date() - timedelta(days=self.days)
+
+        for _ in range(self.days + 1):
+            if day in self.counts:
+                count += self.counts[day]
+                patterns.extend(self.patterns[day])
+            day += timedelta(days=1)
+
+        return count, patterns
+
+
+MINOR_VIOLATION_PROJECTION = {"violationType": 1, "createdAt": 1}
+DISTANCE_PROJECTION = {"distance": 1, "createdAt": 1}
+
+
+def minor_violations_query(driver_id, first_date, last_date, days=7):
+    return {
+        "driverId": driver_id,
+        "createdAt": {
+            "$gte": start_of_day(first_date - timedelta(days=days)),
+            "$lte": end_of_day(last_date)
+        },
+        "isDeleted": False
+    }
+
+
+def minor_violations_cursor(db, driver_id, first_date, last_date, days=7):
+    # db may be a MongoClient or an AsyncMongoClient database
+    return db.trackingviolationevents.find(
+        minor_violations_query(driver_id, first_date, last_date, days),
+        dict(MINOR_VIOLATION_PROJECTION),
+        hint=index_hint("trackingviolationevents"),
+    ).sort("createdAt", ASCENDING)
+
+
+def index_minor_violations(events, days=7):
+    index = MinorViolationIndex(days=days)
+    for tv in events:
+        index.add(tv["createdAt"], tv.get("violationType"))
+    return index
+
+
+def prefetch_minor_violations(db, driver_id, first_date, last_date, days=7):
+    return index_minor_violations(
+        minor_violations_cursor(db, driver_id, first_date, last_date, days), days
+    )
+
+
+# -------- DISTANCE --------
+def daily_distance_query(driver_id, first_date, last_date):
+    return {
+        "driverId": driver_id,
+        "createdAt": {
+            "$gte": start_of_day(first_date),
+            "$lte": end_of_day(last_date)
+        },
+        "isDeleted": False
+    }
+
+
+def daily_distance_cursor(db, driver_id, first_date, last_date):
+    return db.recordtables.find(
+        daily_distance_query(driver_id, first_date, last_date),
+        dict(DISTANCE_PROJECTION),
+        hint=index_hint("recordtables"),
+    ).sort("createdAt", ASCENDING)
+
+
+def distance_by_day(records):
+    """
+    Maps calendar day -> distance of that day's latest recordtables entry.
+    """
+    by_day = {}
+    # ascending order, so the last write per day is the latest record
+    for rt in records:
+        by_day[rt["createdAt"].date()] = rt.get("distance", 0)
+    return by_day
+
+
+def prefetch_daily_distance(db, driver_id, first_date, last_date):
+    return distance_by_day(daily_distance_cursor(db, driver_id, first_date, last_date))
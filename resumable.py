@@ -0,0 +1,179 @@
+import os
+import time
+from contextlib import nullcontext
+
+from pymongo.errors import ConnectionFailure, CursorNotFound
+
+from instrumentation import TimedSink
+from watermarks import WatermarkStore
+from writers import ChunkedWriter, CsvSink
+from config import CHECKPOINT_BATCHES, SCAN_BATCH_SIZE
+
+CHECKPOINT_DIR = ".checkpoints"
+
+# failures a resume can get past: dropped tunnel/socket, server selection
+# timeouts, and a cursor the server reaped while we were slow
+RETRYABLE = (ConnectionFailure, CursorNotFound)
+MAX_RETRIES = 5
+RETRY_DELAY = 5
+
+
+def _documents(data):
+    # parse/parse1 fetches return a dict around the metas cursor
+    return data["metas"] if isinstance(data, dict) else data
+
+
+def _with_documents(data, docs):
+    if isinstance(data, dict):
+        return {**data, "metas": docs}
+    return docs
+
+
+class Checkpointer:
+    """
+    Saves {state, offset, rows} for one scan: the ScanState after the last
+    fully processed document, and the CSV size / row count once every row
+    from those documents is flushed. Both describe the same point, so a
+    resume truncates the file to `offset` and continues from the state.
+    """
+
+    def __init__(self, store, job, object_id, path):
+        self.store = store
+        self.job = job
+        self.object_id = object_id
+        self.path = path
+
+    def load(self):
+        return self.store.load(self.job, self.object_id)
+
+    def save(self, state, rows):
+        offset = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        self.store.save(self.job, self.object_id, {
+            "state": state.to_state(),
+            "offset": offset,
+            "rows": rows,
+        })
+
+    def clear(self):
+        self.store.clear(self.job, self.object_id)
+
+
+def tracked(docs, state, every, checkpoint):
+    """
+    Yields the documents, marking each one in `state` once the transform has
+    asked for the next (so it is fully processed), and calling checkpoint()
+    every `every` documents at that same point.
+    """
+    previous = None
+    for count, doc in enumerate(docs):
+        if previous is not None:
+            state.mark(previous["createdAt"], previous["_id"])
+            if count % every == 0:
+                checkpoint()
+        previous = doc
+        yield doc
+    if previous is not None:
+        state.mark(previous["createdAt"], previous["_id"])
+
+
+def scan_once(db, object_id, path, fetch, iter_records, to_frame, state, rows,
+              checkpointer, batch_size, checkpoint_batches, columns=None, dict_columns=(),
+              column_types=None, open_sink=CsvSink, instruments=None):
+    """
+    One attempt: scans from `state`, appending to the CSV unless it is empty.
+    Returns the total row count.
+    """
+    if instruments:
+        with instruments.stage("query"):
+            data = fetch(db, object_id, state=state)
+    else:
+        data = fetch(db, object_id, state=state)
+    docs = _documents(data)
+    if hasattr(docs, "batch_size"):
+        docs.batch_size(batch_size)
+
+    sink = open_sink(path, append=os.path.exists(path) and os.path.getsize(path) > 0)
+    loop = nullcontext()
+    if instruments:
+        docs = instruments.source(docs)
+        sink = TimedSink(sink, instruments)
+        to_frame = instruments.timed_call(to_frame, "frame")
+        loop = instruments.loop()
+
+    writer = ChunkedWriter(sink, to_frame, columns=columns, dict_columns=dict_columns,
+                           column_types=column_types)
+
+    def checkpoint():
+        writer.flush()
+        checkpointer.save(state, rows + writer.rows)
+
+    docs = tracked(docs, state, batch_size * checkpoint_batches, checkpoint)
+    records = iter_records(object_id, _with_documents(data, docs), state)
+    if instruments:
+        records = instruments.timed(records, "transform", "emitted")
+    with loop, writer:
+        writer.write_many(records)
+    return rows + writer.rows
+
+
+def resumable_extract(connection, job, object_id, path, fetch, iter_records, to_frame,
+                      state_class, store=None, checkpoints=None, batch_size=SCAN_BATCH_SIZE,
+                      checkpoint_batches=CHECKPOINT_BATCHES, max_retries=MAX_RETRIES,
+                      retry_delay=RETRY_DELAY, columns=None, dict_columns=(),
+                      column_types=None, open_sink=CsvSink, instruments=None):
+    """
+    extract_to_csv() for long scans over a flaky link (CSV output).
+
+    Every `checkpoint_batches` cursor batches of `batch_size` documents the
+    rows so far are flushed and a checkpoint is saved. When the scan fails
+    with a RETRYABLE error, the connection is recovered, the CSV is cut back
+    to the checkpointed size and the scan continues from the checkpointed
+    createdAt/_ids and rolling state, so no row is lost or written twice.
+    A checkpoint left by a killed run is picked up the same way.
+    `store` is the incremental WatermarkStore, `open_sink` the CSV sink
+    factory and `instruments` the Instrumentation, as in extract_to_csv();
+    the stages and counters add up over the retried attempts.
+    """
+    checkpointer = Checkpointer(checkpoints or WatermarkStore(CHECKPOINT_DIR), job, object_id, path)
+    checkpoint = checkpointer.load()
+
+    if checkpoint and os.path.exists(path):
+        print(f"Resuming {job} {object_id} from its checkpoint ({checkpoint['rows']} rows)")
+    else:
+        watermark = store.load(job, object_id) if store else None
+        if watermark and os.path.exists(path):
+            state = state_class.from_state(watermark)
+        else:
+            state = state_class()
+            if os.path.exists(path):
+                os.remove(path)
+        checkpointer.save(state, 0)
+        checkpoint = checkpointer.load()
+
+    attempt = 0
+    while True:
+        try:
+            if attempt:
+                connection.recover()
+            state = state_class.from_state(checkpoint["state"])
+            if os.path.exists(path):
+                os.truncate(path, checkpoint["offset"])
+            rows = scan_once(
+                connection.db, object_id, path, fetch, iter_records, to_frame, state,
+                checkpoint["rows"], checkpointer, batch_size, checkpoint_batches,
+                columns, dict_columns, column_types, open_sink, instruments,
+            )
+            break
+        except RETRYABLE as e:
+            attempt += 1
+            if attempt > max_retries:
+                raise
+            checkpoint = checkpointer.load()
+            print(f"Scan of {object_id} failed ({e!r}); resuming from row {checkpoint['rows']} "
+                  f"(retry {attempt}/{max_retries})")
+            time.sleep(retry_delay)
+
+    checkpointer.clear()
+    if store and state.last_created_at:
+        store.save(job, object_id, state.to_state())
+    return rows
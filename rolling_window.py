@@ -0,0 +1,59 @@
+from collections import deque
+from datetime import date, timedelta
+
+
+class RollingDayWindow:
+    """
+    Rolling window of per-day buckets covering (day - days, day].
+
+    Days must be added in non-decreasing order (metas are sorted by createdAt),
+    so each bucket is appended and evicted at most once.
+    """
+
+    def __init__(self, days=7):
+        self.window = timedelta(days=days)
+        self.buckets = deque()          # [day, entry count, pattern count]
+        self.patterns = deque()         # truthy types, oldest first
+        self.count = 0
+
+    def add(self, day, pattern_type):
+        if self.buckets and self.buckets[-1][0] == day:
+            bucket = self.buckets[-1]
+        else:
+            bucket = [day, 0, 0]
+            self.buckets.append(bucket)
+
+        bucket[1] += 1
+        self.count += 1
+
+        if pattern_type:
+            bucket[2] += 1
+            self.patterns.append(pattern_type)
+
+    def advance(self, day):
+        cutoff = day - self.window
+
+        while self.buckets and self.buckets[0][0] <= cutoff:
+            _, entries, pattern_entries = self.buckets.popleft()
+            self.count -= entries
+            for _ in range(pattern_entries):
+                self.patterns.popleft()
+
+    def pattern_list(self):
+        return list(self.patterns)
+
+    def to_state(self):
+        return {
+            "buckets": [[day.isoformat(), entries, pattern_entries]
+                        for day, entries, pattern_entries in self.buckets],
+            "patterns": list(self.patterns),
+        }
+
+    @classmethod
+    def from_state(cls, state, days=7):
+        window = cls(days=days)
+        for day, entries, pattern_entries in state["buckets"]:
+            window.buckets.append([date.fromisoformat(day), entries, pattern_entries])
+            window.count += entries
+        window.patterns.extend(state["patterns"])
+        return window
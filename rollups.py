@@ -0,0 +1,269 @@
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+from pymongo import ASCENDING
+
+from batch import read_ids
+from connection import MongoConnection
+from indexes import index_hint
+from initial_main import compile_location_row_extractor, location_query
+from writers import ChunkedWriter, ParquetLayout, output_target
+from config import DATASET_DIR, OUTPUT_FORMAT, ROLLUP_RESOLUTIONS
+
+# readings summarized per bucket; the rest of LOCATION_FIELDS is left out
+ROLLUP_FIELDS = [
+    "speed", "load_pct", "voltage", "odometer", "engineHours",
+    "engineCoolantTemp", "coolantTemperature",
+    "oilTemprature", "engineOilTemp", "engineOilTemperature", "oilPressure",
+    "turboBoost", "intakePressure", "intakeTemp",
+]
+# written per field; buckets carry min/max/sum/count/last between chunks
+AGGREGATES = ("min", "max", "mean", "last")
+
+
+def rollup_columns(fields=ROLLUP_FIELDS):
+    return ["vehicleId", "bucket", "points"] + [
+        f"{name}_{aggregate}" for name in fields for aggregate in AGGREGATES
+    ]
+
+
+def rollup_layout(resolution, fields=ROLLUP_FIELDS):
+    """
+    datasets/vehicle_rollups_<resolution>/vehicle=<id>/date=... (month=...
+    from one hour up, where a day has only a few rows).
+    """
+    return ParquetLayout(
+        dataset=f"vehicle_rollups_{resolution}",
+        key="vehicle",
+        column_types={
+            name: "string" if name == "vehicleId" else "timestamp" if name == "bucket"
+            else "int64" if name == "points" else "float64"
+            for name in rollup_columns(fields)
+        },
+        date_column="bucket",
+        dict_columns={"vehicleId"},
+        period="month" if pd.Timedelta(resolution) >= pd.Timedelta("1h") else "date",
+    )
+
+
+def rollup_file(output_dir, resolution, vehicle_id):
+    return os.path.join(output_dir, f"rollup_{resolution}_{vehicle_id}.csv")
+
+
+# -------- FETCH --------
+def fetch_rollup_points(db, vehicle_id, fields=ROLLUP_FIELDS):
+    """
+    Every point of the vehicle (no thinning), createdAt plus `fields` only.
+    """
+    projection = {name: 1 for name in ("createdAt", *fields)}
+    return db.driverlocations.find(
+        location_query(vehicle_id), projection, hint=index_hint("driverlocations"),
+    ).sort("createdAt", ASCENDING)
+
+
+def points_frame(columns):
+    """
+    One chunk of extracted rows as a frame: createdAt datetime, readings
+    numeric ("not_avail" and other strings -> NaN).
+    """
+    df = pd.DataFrame(columns)
+    df["createdAt"] = pd.to_datetime(df["createdAt"], errors="coerce")
+    for name in df.columns[1:]:
+        df[name] = pd.to_numeric(df[name], errors="coerce")
+    return df[df["createdAt"].notna()]
+
+
+# -------- ROLLUP --------
+def partial_aggregates(df, buckets, fields):
+    """
+    Per bucket: points, and min/max/sum/count/last of every field, as
+    (partial, field) columns. NaN readings are skipped; last is the last
+    non-null reading in row (createdAt) order.
+    """
+    grouped = df[fields].groupby(buckets.to_numpy(), sort=True)
+    return pd.concat({
+        "points": grouped.size().to_frame("points"),
+        "min": grouped.min(),
+        "max": grouped.max(),
+        "sum": grouped.sum(),
+        "count": grouped.count(),
+        "last": grouped.last(),
+    }, axis=1)
+
+
+def merge_partials(partials):
+    # rows of the same bucket from consecutive chunks, earlier chunk first
+    def merged(partial, how):
+        return getattr(partials[partial].groupby(level=0, sort=True), how)()
+
+    return pd.concat({
+        "points": merged("points", "sum"),
+        "min": merged("min", "min"),
+        "max": merged("max", "max"),
+        "sum": merged("sum", "sum"),
+        "count": merged("count", "sum"),
+        "last": merged("last", "last"),
+    }, axis=1)
+
+
+class Rollup:
+    """
+    One resolution of one vehicle. Chunks come in createdAt order, so only
+    the last bucket of a chunk can continue in the next one: it is held
+    back as partials and merged with the next chunk's first bucket.
+    """
+
+    def __init__(self, vehicle_id, resolution, sink, fields=ROLLUP_FIELDS):
+        self.vehicle_id = str(vehicle_id)
+        self.resolution = resolution
+        self.sink = sink
+        self.fields = list(fields)
+        self.pending = None
+        self.rows = 0
+
+    def add(self, df):
+        if df.empty:
+            return
+        buckets = df["createdAt"].dt.floor(self.resolution)
+        partials = partial_aggregates(df, buckets, self.fields)
+        if self.pending is not None and self.pending.index[0] == partials.index[0]:
+            first = merge_partials(pd.concat([self.pending, partials.iloc[:1]]))
+            partials = pd.concat([first, partials.iloc[1:]])
+        elif self.pending is not None:
+            partials = pd.concat([self.pending, partials])
+        self.pending = partials.iloc[-1:]
+        self.emit(partials.iloc[:-1])
+
+    def emit(self, partials):
+        if partials.empty:
+            return
+        out = {
+            "vehicleId": self.vehicle_id,
+            # one format for every chunk (to_csv drops 00:00:00 when a whole chunk is midnights)
+            "bucket": partials.index.strftime("%Y-%m-%d %H:%M:%S"),
+            "points": partials["points", "points"].to_numpy(),
+        }
+        counts = partials["count"].to_numpy(dtype=float)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = np.where(counts > 0, partials["sum"].to_numpy(dtype=float) / counts, np.nan)
+        for position, name in enumerate(self.fields):
+            out[f"{name}_min"] = partials["min", name].to_numpy()
+            out[f"{name}_max"] = partials["max", name].to_numpy()
+            out[f"{name}_mean"] = means[:, position]
+            out[f"{name}_last"] = partials["last", name].to_numpy()
+        self.sink.write(pd.DataFrame(out))
+        self.rows += len(partials)
+
+    def close(self):
+        if self.pending is not None:
+            self.emit(self.pending)
+            self.pending = None
+        self.sink.close()
+
+
+class RollupSink:
+    """
+    ChunkedWriter sink feeding each points chunk to every resolution's Rollup.
+    """
+
+    def __init__(self, rollups):
+        self.rollups = rollups
+
+    def write(self, df):
+        for rollup in self.rollups:
+            rollup.add(df)
+
+    def close(self):
+        for rollup in self.rollups:
+            rollup.close()
+
+    def discard(self):
+        for rollup in self.rollups:
+            rollup.sink.discard()
+
+
+# -------- RUN --------
+def rollup_vehicle(db, vehicle_id, resolutions=ROLLUP_RESOLUTIONS, fields=ROLLUP_FIELDS,
+                   output_dir="rollups", output_format="csv"):
+    """
+    One scan of the vehicle's points, rolled up at every resolution into its
+    own output (CSV file or Parquet dataset). Returns {resolution: rows}.
+    """
+    rollups = []
+    for resolution in resolutions:
+        path, open_sink = output_target(
+            vehicle_id, rollup_file(output_dir, resolution, vehicle_id),
+            rollup_layout(resolution, fields), output_format, output_dir,
+        )
+        rollups.append(Rollup(vehicle_id, resolution, open_sink(path), fields))
+
+    columns = ["createdAt", *fields]
+    extract = compile_location_row_extractor(fields=columns, id_fields=())
+    writer = ChunkedWriter(RollupSink(rollups), points_frame, columns=columns)
+    with writer:
+        writer.write_many(extract(doc) for doc in fetch_rollup_points(db, vehicle_id, fields))
+    return {rollup.resolution: rollup.rows for rollup in rollups}
+
+
+# -------- CLI --------
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Roll driverlocations up into min/max/mean/last per time bucket, "
+                    "at several resolutions in one scan."
+    )
+    parser.add_argument("ids", nargs="*", help="vehicle ObjectIds")
+    parser.add_argument("--ids-file", help="file with one ObjectId per line")
+    parser.add_argument("--resolutions", nargs="+", default=ROLLUP_RESOLUTIONS,
+                        help="bucket sizes as pandas offsets, e.g. 1min 5min 1h")
+    parser.add_argument("--fields", nargs="+", default=ROLLUP_FIELDS)
+    parser.add_argument("--workers", type=int, default=4, help="vehicles scanned at once")
+    parser.add_argument("--format", choices=["csv", "parquet"], default=OUTPUT_FORMAT)
+    parser.add_argument("--output-dir", help="CSV directory, or the Parquet dataset root "
+                                             f"(default: rollups, or {DATASET_DIR} for parquet)")
+    args = parser.parse_args(argv)
+
+    object_ids = read_ids(args.ids, args.ids_file)
+    if not object_ids:
+        parser.error("no IDs given")
+    for resolution in args.resolutions:
+        try:
+            pd.Timedelta(resolution)
+        except ValueError:
+            parser.error(f"bad resolution {resolution!r}")
+    output_dir = args.output_dir or (DATASET_DIR if args.format == "parquet" else "rollups")
+    os.makedirs(output_dir, exist_ok=True)
+
+    failures = 0
+    with MongoConnection(pool_size=args.workers + 2) as connection:
+        db = connection.db
+
+        def run_one(vehicle_id):
+            started = time.perf_counter()
+            rows = rollup_vehicle(db, vehicle_id, args.resolutions, args.fields,
+                                  output_dir, args.format)
+            return rows, time.perf_counter() - started
+
+        with ThreadPoolExecutor(max_workers=args.workers) as pool:
+            futures = {pool.submit(run_one, vehicle_id): vehicle_id for vehicle_id in object_ids}
+            for done, future in enumerate(as_completed(futures), start=1):
+                vehicle_id = futures[future]
+                try:
+                    rows, seconds = future.result()
+                except Exception as exc:
+                    failures += 1
+                    print(f"[{done}/{len(futures)}] FAILED {vehicle_id}: {exc!r}")
+                    continue
+                summary = ", ".join(f"{resolution}: {count}" for resolution, count in rows.items())
+                print(f"[{done}/{len(futures)}] {vehicle_id}: {summary} rows in {seconds:.2f}s")
+
+    print(f"Saved rollups to {output_dir}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,225 @@
+import pickle
+import queue
+import tempfile
+import threading
+from collections import namedtuple
+
+from pymongo import ASCENDING, DESCENDING
+
+# documents per batch handed from a partition thread to the merge
+SHARD_BATCH = 1000
+# batches a partition may hold in memory ahead of the merge; later partitions
+# spill the rest to a temporary file instead of waiting for the merge
+SHARD_BUFFER = 50
+# bytes all partitions may have spilled at once; past it they wait for the merge
+SHARD_SPILL_LIMIT = 1 << 30
+
+_DONE = object()
+# where a spilled batch sits in its partition's file
+_Spilled = namedtuple("_Spilled", "offset size")
+
+
+def createdat_partitions(collection, query, partitions, hint=None):
+    """
+    Splits the createdAt span of `query` into up to `partitions` equal time
+    ranges, as extra createdAt conditions: [{"$lt": b1}, {"$gte": b1, "$lt": b2},
+    ..., {"$gte": bn, "$lte": last}]. The last range is capped at the newest
+    document seen now, so rows inserted mid-scan are left for the next run.
+    """
+    first = collection.find_one(query, {"createdAt": 1}, sort=[("createdAt", ASCENDING)], hint=hint)
+    last = collection.find_one(query, {"createdAt": 1}, sort=[("createdAt", DESCENDING)], hint=hint)
+    if not first or not last:
+        return []
+
+    first, last = first["createdAt"], last["createdAt"]
+    step = (last - first) / max(partitions, 1)
+    bounds = sorted({first + step * i for i in range(1, partitions)} - {first})
+
+    ranges = []
+    lower = None
+    for bound in bounds:
+        ranges.append({"$lt": bound} if lower is None else {"$gte": lower, "$lt": bound})
+        lower = bound
+    ranges.append({"$lte": last} if lower is None else {"$gte": lower, "$lte": last})
+    return ranges
+
+
+def _with_range(query, createdat_range):
+    # keeps an incremental run's {"$gt": watermark}
+    return {**query, "createdAt": {**query.get("createdAt", {}), **createdat_range}}
+
+
+class _SpillBudget:
+    """
+    Bytes the spools may hold on disk together. A partition that would go
+    past the limit waits until the merge has read a spilled file back; one
+    batch larger than the whole limit still fits into an empty budget.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self.freed = threading.Condition()
+
+    def reserve(self, size, timeout):
+        with self.freed:
+            if self.used and self.used + size > self.limit:
+                self.freed.wait(timeout)
+                if self.used and self.used + size > self.limit:
+                    return False
+            self.used += size
+            return True
+
+    def release(self, size):
+        with self.freed:
+            self.used -= size
+            self.freed.notify_all()
+
+
+class _Spool:
+    """
+    One partition's batches in read order: up to `buffer` in memory, and with
+    a `budget` the rest pickled to a temporary file until the merge reaches
+    them. Without one, or once the merge reads this partition, the reader
+    waits for room instead, as the first partition does.
+    """
+
+    def __init__(self, buffer, budget):
+        self.items = queue.Queue()
+        self.slots = threading.Semaphore(buffer)
+        self.budget = budget
+        self.merging = False
+        self.lock = threading.Lock()
+        self.file = None
+        self.spilled = 0                # batches in the file not read back yet
+
+    def put(self, batch, stop):
+        # False once the merge has stopped
+        data = None
+        while not stop.is_set():
+            if self.slots.acquire(blocking=False):
+                self.items.put(batch)
+                return True
+            if self.budget and not self.merging:
+                if data is None:
+                    data = pickle.dumps(batch, pickle.HIGHEST_PROTOCOL)
+                if self.budget.reserve(len(data), timeout=0.5):
+                    self.items.put(self._write(data))
+                    return True
+            elif self.slots.acquire(timeout=0.5):
+                self.items.put(batch)
+                return True
+        return False
+
+    def finish(self, item):
+        # _DONE or the reader's exception; never waits
+        self.items.put(item)
+
+    def get(self):
+        self.merging = True
+        item = self.items.get()
+        if isinstance(item, _Spilled):
+            return self._read(item)
+        if isinstance(item, list):
+            self.slots.release()
+        return item
+
+    def _write(self, data):
+        with self.lock:
+            if self.file is None:
+                self.file = tempfile.TemporaryFile()
+            self.file.seek(0, 2)
+            offset = self.file.tell()
+            self.file.write(data)
+            self.spilled += 1
+        return _Spilled(offset, len(data))
+
+    def _read(self, spilled):
+        with self.lock:
+            self.file.seek(spilled.offset)
+            batch = pickle.loads(self.file.read(spilled.size))
+            self.spilled -= 1
+            if not self.spilled:
+                # everything spilled is read back: hand the space to the others
+                self.budget.release(self.file.seek(0, 2))
+                self.file.truncate(0)
+        return batch
+
+    def close(self):
+        with self.lock:
+            if self.file:
+                self.file.close()
+                self.file = None
+
+
+def _read_partition(collection, query, projection, hint, out, stop, batch_size):
+    try:
+        cursor = collection.find(query, projection, hint=hint).sort("createdAt", ASCENDING)
+        cursor.batch_size(batch_size)
+        batch = []
+        for doc in cursor:
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                if not out.put(batch, stop):
+                    cursor.close()
+                    return
+                batch = []
+        if batch and not out.put(batch, stop):
+            return
+        out.finish(_DONE)
+    except Exception as e:
+        out.finish(e)
+
+
+def sharded_find(collection, query, projection, partitions, hint=None,
+                 batch_size=SHARD_BATCH, buffer=SHARD_BUFFER, spill=True,
+                 spill_limit=SHARD_SPILL_LIMIT):
+    """
+    Same documents, in the same createdAt order, as
+    collection.find(query, projection).sort("createdAt"), read by one thread
+    per createdAt range over the client's connection pool. Ranges are
+    yielded back to back, so anything order-dependent downstream (the 60s
+    thinning) sees exactly the serial stream.
+
+    Each range keeps up to `buffer` x `batch_size` documents in memory ahead
+    of the merge. Past that, the ranges after the one being merged spill to
+    a temporary file (`spill`), so they keep reading at full speed while
+    the merge is behind, up to `spill_limit` bytes on disk for all of them;
+    then they wait for the merge to read spilled batches back. With
+    spill=False they wait instead, and a range only gets `buffer` x
+    `batch_size` documents ahead. The spill files are deleted when the scan
+    ends, fails or is closed early.
+    """
+    ranges = createdat_partitions(collection, query, partitions, hint)
+    stop = threading.Event()
+    budget = _SpillBudget(spill_limit) if spill else None
+    # the first range is merged as it is read, it never needs to spill
+    spools = [_Spool(buffer, budget if position > 0 else None)
+              for position in range(len(ranges))]
+    threads = [
+        threading.Thread(
+            target=_read_partition,
+            args=(collection, _with_range(query, createdat_range), dict(projection), hint,
+                  out, stop, batch_size),
+            daemon=True,
+        )
+        for createdat_range, out in zip(ranges, spools)
+    ]
+    for thread in threads:
+        thread.start()
+
+    try:
+        for out in spools:
+            while (batch := out.get()) is not _DONE:
+                if isinstance(batch, Exception):
+                    raise batch
+                yield from batch
+    finally:
+        # also reached when the consumer stops early
+        stop.set()
+        try:
+            for thread in threads:
+                thread.join()
+        finally:
+            for out in spools:
+                out.close()
@@ -0,0 +1,182 @@
+import random
+from datetime import datetime, timedelta
+
+from bson.objectid import ObjectId
+
+VIOLATION_TYPES = ["DRIVING", "SHIFT", "CYCLE", "BREAK", ""]
+PTI_TYPES = [1, 2, 3, "PRE_TRIP", None]
+MINOR_VIOLATION_TYPES = ["speeding", "hard_brake", "hard_accel", None]
+ADDRESSES = ["Dallas, TX", "Tulsa, OK", "Wichita, KS", "Amarillo, TX", ""]
+
+START = datetime(2025, 1, 1)
+
+
+class IdFactory:
+    """
+    Deterministic ObjectIds so repeated runs of one seed hit identical data.
+    """
+
+    def __init__(self, seed):
+        self.prefix = 0xbe0000000000000000000000 + (seed << 40)
+        self.counter = 0
+
+    def __call__(self):
+        self.counter += 1
+        return ObjectId("%024x" % (self.prefix + self.counter))
+
+
+def mmddyy(dt):
+    return dt.strftime("%m%d%y")
+
+
+def _event(rng, day):
+    roll = rng.random()
+    if roll < 0.1:
+        return {}
+    if roll < 0.12:
+        return {"eventDate": "bad"}
+    return {"eventDate": mmddyy(day - timedelta(days=rng.choice([0, 0, 0, 1, 3, 9])))}
+
+
+def make_meta(rng, driver_id, vehicle_ids, created_at):
+    return {
+        "driver": driver_id,
+        "vehicle": rng.choice(vehicle_ids + [None]),
+        "createdAt": created_at,
+        "clockData": {
+            "isSplitActive": rng.random() < 0.2,
+            "driveSeconds": rng.randint(0, 39600),
+            "shiftDutySecond": rng.randint(0, 50400),
+            "breakSeconds": rng.randint(0, 28800),
+        },
+        "voilations": [
+            {"type": rng.choice(VIOLATION_TYPES), "startedAt": _event(rng, created_at)}
+            for _ in range(rng.randint(0, 6))
+        ],
+        "ptiViolation": [
+            {"type": rng.choice(PTI_TYPES), "SHIFT_START_DATE": _event(rng, created_at)}
+            for _ in range(rng.randint(0, 3))
+        ],
+        "deviceCalculations": {
+            "DRIVING": rng.randint(0, 39600),
+            "ON_DUTY_CURRENT_TIME": rng.randint(0, 50400),
+            "DRIVING_CYCLE": rng.randint(0, 252000),
+            "CONSECUTIVE_DRIVING": rng.randint(0, 28800),
+            "CYCLE_START_DATE": {"eventDate": mmddyy(created_at - timedelta(days=rng.randint(0, 7)))},
+            "DRIVING_ADDED": rng.choice([0, "", 600]),
+            "OFF_DUTY": rng.randint(0, 86400),
+        },
+        "lastActivity": {
+            "speed": rng.uniform(0, 70),
+            "latitude": rng.uniform(30, 40),
+            "longitude": rng.uniform(-100, -90),
+            "address": rng.choice(ADDRESSES),
+        },
+    }
+
+
+def make_location(rng, vehicle_id, tenant_id, driver_id, created_at, timestamp):
+    doc = {
+        "vehicleId": vehicle_id,
+        "tenantId": tenant_id,
+        "driverId": driver_id,
+        "isDeleted": rng.random() < 0.02,
+        "createdAt": created_at,
+        "timeStamp": timestamp if rng.random() > 0.01 else "",
+        "engineParamsTimestamp": timestamp,
+        "speed": rng.choice([rng.uniform(0, 70), str(round(rng.uniform(0, 70), 1)), ""]),
+        "moving": rng.random() < 0.7,
+        "direction": rng.randint(0, 359),
+        "engineState": rng.choice(["ON", "OFF", "IDLE"]),
+        "latitude": rng.uniform(30, 40),
+        "longitude": rng.uniform(-100, -90),
+        "address": rng.choice(ADDRESSES),
+        "odometer": 100000 + timestamp / 100,
+        "engineHours": 5000 + timestamp / 3600,
+        "voltage": str(round(rng.uniform(11.5, 14.5), 2)),
+        "engineCoolantTemp": rng.uniform(70, 105),
+        "oilPressure": rng.uniform(20, 60),
+        "engineOilTemp": rng.uniform(80, 120),
+        "turboBoost": rng.uniform(0, 30),
+        # payload the extractors never read, like the real collection
+        "raw": {"can": [rng.randint(0, 255) for _ in range(32)], "fw": "3.4.1"},
+    }
+    if rng.random() < 0.3:
+        del doc["turboBoost"]
+    return doc
+
+
+def generate(db, drivers=3, vehicles=3, days=120, metas_per_day=1.5,
+             locations_per_vehicle=20000, location_interval=10, events_per_day=2, seed=0):
+    """
+    Fills db with drivers, timezones, metas, driverlocations,
+    trackingviolationevents and recordtables. Returns (driver_ids, vehicle_ids).
+    """
+    rng = random.Random(seed)
+    new_id = IdFactory(seed)
+    tenant_id = new_id()
+
+    timezone_id = new_id()
+    db.timezones.insert_one({"_id": timezone_id, "tzCode": "America/Chicago"})
+
+    driver_ids = [new_id() for _ in range(drivers)]
+    vehicle_ids = [new_id() for _ in range(vehicles)]
+
+    for number, driver_id in enumerate(driver_ids):
+        db.drivers.insert_one({
+            "_id": driver_id,
+            "driverId": f"DRV{number:05d}",
+            "fullName": f"Driver {number}",
+            "cycleRule": "USA 70 hour / 8 day",
+            "timeZone": timezone_id,
+            "tenantId": tenant_id,
+        })
+
+        metas = []
+        events = []
+        records = []
+        for day in range(days):
+            day_start = START + timedelta(days=day)
+            for _ in range(int(metas_per_day) + (rng.random() < metas_per_day % 1)):
+                created_at = day_start + timedelta(seconds=rng.randint(0, 86399))
+                metas.append(make_meta(rng, driver_id, vehicle_ids, created_at))
+            for _ in range(rng.randint(0, 2 * events_per_day)):
+                events.append({
+                    "driverId": driver_id,
+                    "createdAt": day_start + timedelta(seconds=rng.randint(0, 86399)),
+                    "isDeleted": rng.random() < 0.05,
+                    "violationType": rng.choice(MINOR_VIOLATION_TYPES),
+                })
+            for _ in range(rng.randint(0, 2)):
+                records.append({
+                    "driverId": driver_id,
+                    "createdAt": day_start + timedelta(seconds=rng.randint(0, 86399)),
+                    "isDeleted": False,
+                    "distance": round(rng.uniform(0, 700), 1),
+                    "driverName": f"Driver {number}",
+                })
+
+        # inserted in createdAt order, as the production writers do
+        for collection, docs in (("metas", metas), ("trackingviolationevents", events),
+                                 ("recordtables", records)):
+            docs.sort(key=lambda doc: doc["createdAt"])
+            if docs:
+                db[collection].insert_many(docs)
+
+    for vehicle_id in vehicle_ids:
+        created_at = START
+        timestamp = int(START.timestamp())
+        batch = []
+        for _ in range(locations_per_vehicle):
+            step = rng.choice([1, location_interval, location_interval, 2 * location_interval, 90])
+            created_at += timedelta(seconds=step)
+            timestamp += step
+            batch.append(make_location(rng, vehicle_id, tenant_id, rng.choice(driver_ids),
+                                       created_at, timestamp))
+            if len(batch) >= 5000:
+                db.driverlocations.insert_many(batch)
+                batch = []
+        if batch:
+            db.driverlocations.insert_many(batch)
+
+    return driver_ids, vehicle_ids
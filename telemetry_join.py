@@ -0,0 +1,170 @@
+import argparse
+import os
+import sys
+
+import pandas as pd
+
+from initial_main import DICT_FIELDS, LOCATION_FIELDS
+
+# parse1's dataDate is a day; its snapshot is the vehicle's last one that day
+END_OF_DAY = pd.Timedelta(days=1) - pd.Timedelta(microseconds=1)
+# meta time = dataDate + offset
+ALIGN_OFFSETS = {"day_end": END_OF_DAY, "exact": pd.Timedelta(0)}
+TELEMETRY_PREFIX = "telemetry_"
+# one unit for both join keys: CSV dates parse as us, Parquet timestamps read back as ms
+JOIN_TIME_DTYPE = "datetime64[ns]"
+
+# readings that several firmwares report under different names, first non-null wins
+COOLANT_TEMP_FIELDS = ["engineCoolantTemp", "coolantTemperature"]
+OIL_TEMP_FIELDS = ["oilTemprature", "engineOilTemp", "engineOilTemperature"]
+
+# the snapshot columns attached by join_nearest(), prefixed with TELEMETRY_PREFIX
+SNAPSHOT_FIELDS = [name for name in LOCATION_FIELDS if name not in ("vehicleId", "tenantId")]
+NUMERIC_FIELDS = [name for name in LOCATION_FIELDS if name not in DICT_FIELDS and name != "createdAt"]
+
+
+# -------- LOAD --------
+def read_output(path):
+    """
+    One script output: a CSV file, or a Parquet dataset directory
+    (datasets/<dataset>/ or one <key>=<id> partition of it).
+    """
+    if os.path.isdir(path):
+        return pd.read_parquet(path)
+    return pd.read_csv(path, low_memory=False)
+
+
+def read_outputs(paths):
+    return pd.concat([read_output(path) for path in paths], ignore_index=True)
+
+
+def _coalesce(frame, names):
+    names = [name for name in names if name in frame]
+    if not names:
+        return pd.Series(float("nan"), index=frame.index)
+    return frame[names].bfill(axis=1).iloc[:, 0]
+
+
+def telemetry_frame(df):
+    """
+    initial_main rows ready to join: readings numeric ("not_avail" -> NaN),
+    vehicleId a string, sorted by createdAt; rows without createdAt dropped.
+    """
+    df = df[[name for name in LOCATION_FIELDS if name in df]].copy()
+    df["vehicleId"] = df["vehicleId"].astype(str)
+    df["createdAt"] = pd.to_datetime(df["createdAt"], errors="coerce")
+    for name in NUMERIC_FIELDS:
+        if name in df:
+            df[name] = pd.to_numeric(df[name], errors="coerce")
+    df = df[df["createdAt"].notna()]
+    return df.sort_values("createdAt", kind="mergesort", ignore_index=True)
+
+
+def _meta_keys(metas, align):
+    # (vehicle, time) per meta row, as join keys; a missing vehicle never matches
+    vehicle = metas["vehicle_id"].astype(str)
+    at = pd.to_datetime(metas["dataDate"], errors="coerce") + ALIGN_OFFSETS[align]
+    return vehicle, at.astype(JOIN_TIME_DTYPE)
+
+
+# -------- NEAREST SNAPSHOT --------
+def join_nearest(metas, telemetry, align="day_end", direction="backward",
+                 tolerance=pd.Timedelta(days=1), fields=SNAPSHOT_FIELDS):
+    """
+    Attaches to every meta the vehicle's telemetry row nearest its time
+    (merge_asof by vehicle: backward = last one at or before it), within
+    `tolerance`. One sorted pass; metas keep their order, unmatched ones
+    get NaN readings.
+    """
+    vehicle, at = _meta_keys(metas, align)
+    left = metas.assign(_vehicle=vehicle, _at=at, _order=range(len(metas)))
+    matched = left["_at"].notna()
+
+    right = telemetry[["vehicleId"] + [name for name in fields if name in telemetry]]
+    right = right.rename(columns=lambda name: TELEMETRY_PREFIX + name)
+    right["_at"] = telemetry["createdAt"].astype(JOIN_TIME_DTYPE)
+
+    joined = pd.merge_asof(
+        left[matched].sort_values("_at", kind="mergesort"), right,
+        on="_at", left_by="_vehicle", right_by=TELEMETRY_PREFIX + "vehicleId",
+        direction=direction, tolerance=tolerance,
+    )
+    joined = pd.concat([joined, left[~matched]], ignore_index=True)
+    joined = joined.sort_values("_order", kind="mergesort", ignore_index=True)
+    return joined.drop(columns=["_vehicle", "_at", "_order", TELEMETRY_PREFIX + "vehicleId"])
+
+
+# -------- DAILY AGGREGATES --------
+def daily_telemetry(telemetry):
+    """
+    One row per vehicle and (UTC) day: points, max/mean speed, max coolant
+    and oil temperature, min oil pressure and the odometer distance.
+    """
+    readings = pd.DataFrame({
+        "vehicle_id": telemetry["vehicleId"],
+        "day": telemetry["createdAt"].astype(JOIN_TIME_DTYPE).dt.normalize(),
+        "speed": telemetry.get("speed"),
+        "coolant_temp": _coalesce(telemetry, COOLANT_TEMP_FIELDS),
+        "oil_temp": _coalesce(telemetry, OIL_TEMP_FIELDS),
+        "oil_pressure": telemetry.get("oilPressure"),
+        "odometer": telemetry.get("odometer"),
+    })
+    daily = readings.groupby(["vehicle_id", "day"], sort=False).agg(
+        telemetry_points=("day", "size"),
+        max_speed=("speed", "max"),
+        mean_speed=("speed", "mean"),
+        max_coolant_temp=("coolant_temp", "max"),
+        max_oil_temp=("oil_temp", "max"),
+        min_oil_pressure=("oil_pressure", "min"),
+        odometer_start=("odometer", "min"),
+        odometer_end=("odometer", "max"),
+    )
+    daily["odometer_distance"] = daily.pop("odometer_end") - daily.pop("odometer_start")
+    return daily.reset_index()
+
+
+def join_daily(metas, daily):
+    """
+    Attaches daily_telemetry() rows by vehicle and dataDate's day; metas
+    keep their order, days without telemetry get NaN.
+    """
+    vehicle, at = _meta_keys(metas, "exact")
+    keys = pd.DataFrame({"vehicle_id": vehicle, "day": at.dt.normalize()})
+    aggregates = keys.merge(daily, on=["vehicle_id", "day"], how="left", validate="many_to_one")
+    return pd.concat([metas.reset_index(drop=True), aggregates.drop(columns=["vehicle_id", "day"])],
+                     axis=1)
+
+
+# -------- CLI --------
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Join parse1 driver rows with initial_main vehicle telemetry by vehicle and time."
+    )
+    parser.add_argument("metas", help="parse1 CSV or Parquet dataset")
+    parser.add_argument("telemetry", nargs="+", help="initial_main CSVs or Parquet dataset")
+    parser.add_argument("--mode", choices=["nearest", "daily"], default="nearest",
+                        help="nearest snapshot per meta, or that day's aggregates")
+    parser.add_argument("--align", choices=sorted(ALIGN_OFFSETS), default="day_end",
+                        help="meta time: end of dataDate's day (parse1) or dataDate itself")
+    parser.add_argument("--direction", choices=["backward", "forward", "nearest"],
+                        default="backward")
+    parser.add_argument("--tolerance", default="1D", help="max snapshot distance, e.g. 1D or 6h")
+    parser.add_argument("--output", default="driver_metas_with_telemetry.csv")
+    args = parser.parse_args(argv)
+
+    metas = read_output(args.metas)
+    telemetry = telemetry_frame(read_outputs(args.telemetry))
+
+    if args.mode == "nearest":
+        joined = join_nearest(metas, telemetry, align=args.align, direction=args.direction,
+                              tolerance=pd.Timedelta(args.tolerance))
+    else:
+        joined = join_daily(metas, daily_telemetry(telemetry))
+
+    joined.to_csv(args.output, index=False)
+    print(f"Saved {len(joined)} rows to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
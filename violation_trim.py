@@ -0,0 +1,103 @@
+from pymongo import ASCENDING
+
+from indexes import hint_kwargs
+
+# metas arrays the transforms filter, and the object holding each element's eventDate
+TRIMMED_ARRAYS = {"voilations": "startedAt", "ptiViolation": "SHIFT_START_DATE"}
+# size of the untrimmed voilations array ("violation active")
+VIOLATION_COUNT_FIELD = "voilationsCount"
+
+# which elements the server drops; only ones the python transform would skip
+SAME_DAY = "same_day"          # parse1: eventDate missing or on createdAt's day
+LAST_7_DAYS = "last_7_days"    # parse: eventDate on/after createdAt - 7 days
+
+MMDDYY = "^[0-9]{6}$"
+WEEK_MS = 7 * 24 * 3600 * 1000
+
+
+# -------- EXPRESSIONS --------
+def _is_string(value):
+    return {"$eq": [{"$type": value}, "string"]}
+
+
+def _meta_day():
+    # createdAt as MMDDYY
+    return {"$concat": [
+        {"$dateToString": {"format": "%m%d", "date": "$createdAt"}},
+        {"$substrCP": [{"$dateToString": {"format": "%Y", "date": "$createdAt"}}, 2, 2]},
+    ]}
+
+
+def _event_day(event_date):
+    # MMDDYY -> date, with strptime's %y pivot (00-68 -> 20xx, 69-99 -> 19xx)
+    year = {"$toInt": {"$substrCP": [event_date, 4, 2]}}
+    return {"$dateFromParts": {
+        "year": {"$add": [year, {"$cond": [{"$lte": [year, 68]}, 2000, 1900]}]},
+        "month": {"$toInt": {"$substrCP": [event_date, 0, 2]}},
+        "day": {"$toInt": {"$substrCP": [event_date, 2, 2]}},
+    }}
+
+
+def keep_element(event_date, rule):
+    """
+    $filter condition. Elements are dropped only when the rule can decide
+    them on the server (an MMDDYY string, or no usable date for parse);
+    anything else, e.g. strptime's lenient non-6-digit forms, is sent and
+    the python transform decides as before.
+    """
+    is_mmddyy = {"$regexMatch": {"input": event_date, "regex": MMDDYY}}
+    if rule == SAME_DAY:
+        # parse1 counts elements without an eventDate
+        decided = {"$or": [{"$not": [is_mmddyy]}, {"$eq": [event_date, "$$day"]}]}
+        return {"$cond": [_is_string(event_date), decided, True]}
+    # parse counts only dates it can parse
+    decided = {"$cond": [is_mmddyy, {"$gte": [_event_day(event_date), "$$cutoff"]}, True]}
+    return {"$cond": [_is_string(event_date), decided, False]}
+
+
+def trimmed_array(field, rule):
+    """
+    The elements of `field` that can count, reduced to type + eventDate.
+    """
+    date_field = TRIMMED_ARRAYS[field]
+    event_date = f"$$v.{date_field}.eventDate"
+    return {"$let": {
+        "vars": {"day": _meta_day(), "cutoff": {"$subtract": ["$createdAt", WEEK_MS]}},
+        "in": {"$map": {
+            "input": {"$filter": {
+                "input": {"$ifNull": [f"${field}", []]},
+                "as": "v",
+                "cond": keep_element(event_date, rule),
+            }},
+            "as": "v",
+            "in": {"type": "$$v.type", date_field: {"eventDate": event_date}},
+        }},
+    }}
+
+
+# -------- FETCH --------
+def trimmed_metas_pipeline(query, projection, rule):
+    """
+    find(query, projection).sort(createdAt) as an aggregation, with the
+    violation arrays trimmed server-side and their original size in
+    VIOLATION_COUNT_FIELD.
+    """
+    fields = {
+        name: value for name, value in projection.items()
+        if name.split(".")[0] not in TRIMMED_ARRAYS
+    }
+    return [
+        {"$match": query},
+        {"$sort": {"createdAt": ASCENDING}},
+        {"$project": {
+            **fields,
+            **{field: trimmed_array(field, rule) for field in TRIMMED_ARRAYS},
+            VIOLATION_COUNT_FIELD: {"$size": {"$ifNull": ["$voilations", []]}},
+        }},
+    ]
+
+
+def fetch_trimmed_metas(db, query, projection, rule):
+    return db.metas.aggregate(
+        trimmed_metas_pipeline(query, projection, rule), **hint_kwargs("metas")
+    )
@@ -0,0 +1,174 @@
+import json
+import os
+from contextlib import nullcontext
+from datetime import datetime
+
+from bson.objectid import ObjectId
+
+from instrumentation import TimedSink
+from writers import ChunkedWriter, CsvSink, StagedSink
+
+WATERMARK_DIR = ".watermarks"
+
+
+# -------- SCAN STATE --------
+class ScanState:
+    """
+    What an extractor needs to continue a scan: the last createdAt it read.
+    Scripts with rolling state (7-day windows, 60s thinning) extend it.
+
+    Resumable scans (resumable.py) also mark() each processed document, so
+    the _ids already read at that createdAt can be skipped on resume instead
+    of relying on createdAt alone (several points can share one timestamp).
+    """
+
+    def __init__(self, last_created_at=None):
+        self.last_created_at = last_created_at
+        self.seen_at = None
+        self.seen_ids = []
+
+    def mark(self, created_at, doc_id):
+        if created_at != self.seen_at:
+            self.seen_at = created_at
+            self.seen_ids = []
+        self.seen_ids.append(doc_id)
+
+    def resume_ids(self):
+        # _ids already processed at last_created_at
+        return self.seen_ids if self.seen_at == self.last_created_at else []
+
+    def to_state(self):
+        return {
+            "last_created_at": self.last_created_at.isoformat() if self.last_created_at else None,
+            "seen_at": self.seen_at.isoformat() if self.seen_at else None,
+            "seen_ids": [str(doc_id) for doc_id in self.seen_ids],
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        scan_state = cls()
+        if state.get("last_created_at"):
+            scan_state.last_created_at = datetime.fromisoformat(state["last_created_at"])
+        if state.get("seen_at"):
+            scan_state.seen_at = datetime.fromisoformat(state["seen_at"])
+            scan_state.seen_ids = [ObjectId(doc_id) for doc_id in state["seen_ids"]]
+        return scan_state
+
+
+def created_after(query, since, seen_ids=()):
+    """
+    createdAt > since; with seen_ids, createdAt >= since minus those _ids,
+    which still walks the (key, createdAt) index.
+    """
+    if since is None:
+        return query
+    if seen_ids:
+        return {**query, "createdAt": {"$gte": since}, "_id": {"$nin": list(seen_ids)}}
+    return {**query, "createdAt": {"$gt": since}}
+
+
+# -------- STORE --------
+class WatermarkStore:
+    """
+    One JSON file per (job, id) holding the ScanState of the last run.
+    """
+
+    def __init__(self, directory=WATERMARK_DIR):
+        self.directory = directory
+
+    def path(self, job, object_id):
+        return os.path.join(self.directory, f"{job}_{object_id}.json")
+
+    def load(self, job, object_id):
+        try:
+            with open(self.path(job, object_id)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def save(self, job, object_id, state):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(job, object_id)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, path)
+
+    def clear(self, job, object_id):
+        try:
+            os.remove(self.path(job, object_id))
+        except FileNotFoundError:
+            pass
+
+
+# -------- EXTRACTION --------
+def extract_to_csv(db, job, object_id, path, fetch, iter_records, to_frame, state_class,
+                   store=None, sink=None, instruments=None, columns=None, dict_columns=(),
+                   column_types=None, open_sink=CsvSink):
+    """
+    Streams one ID's records to `path`.
+
+    With a store, a run that finds both a watermark and the existing output
+    only reads createdAt > watermark, restores the rolling state and appends.
+    Otherwise it is a full scan that (re)writes the file. An append that fails
+    is truncated back, so the next run writes those rows once. `sink`
+    overrides the per-file sink (batch combined output), in which case it is
+    not closed; with a store the ID's rows reach it only once all of them are
+    written (StagedSink), as other IDs append to it meanwhile.
+    `instruments` (an Instrumentation) times each stage and counts documents.
+    With `columns`, iter_records yields row tuples in that order (see ChunkedWriter;
+    dict_columns and column_types set up its buffers).
+    open_sink(path, append=...) makes the per-file sink; writers.output_target()
+    gives the Parquet one, for which `path` is the ID's dataset directory.
+    """
+    watermark = store.load(job, object_id) if store else None
+
+    if watermark and (sink or os.path.exists(path)):
+        state = state_class.from_state(watermark)
+    else:
+        state = state_class()
+    since = state.last_created_at
+
+    close_sink = sink is None
+    staged = None
+    if close_sink:
+        sink = open_sink(path, append=since is not None)
+    elif store:
+        sink = staged = StagedSink(sink)
+    # a failed append is cut back to this, since the watermark stays where it was
+    offset = os.path.getsize(path) if close_sink and since and os.path.isfile(path) else None
+
+    if instruments:
+        with instruments.stage("query"):
+            data = instruments.source(fetch(db, object_id, state=state))
+        sink = TimedSink(sink, instruments)
+        to_frame = instruments.timed_call(to_frame, "frame")
+        # the batch process pool does the whole transform in this call
+        with instruments.stage("transform"):
+            records = iter_records(object_id, data, state)
+        records = instruments.timed(records, "transform", "emitted")
+        loop = instruments.loop()
+    else:
+        data = fetch(db, object_id, state=state)
+        records = iter_records(object_id, data, state)
+        loop = nullcontext()
+
+    writer = ChunkedWriter(sink, to_frame, close_sink=close_sink,
+                           columns=columns, dict_columns=dict_columns,
+                           column_types=column_types)
+    try:
+        with loop, writer:
+            writer.write_many(records)
+        if staged:
+            staged.commit()
+    except BaseException:
+        if offset is not None:
+            os.truncate(path, offset)
+        if staged:
+            staged.discard()
+        raise
+
+    if store and state.last_created_at:
+        store.save(job, object_id, state.to_state())
+
+    return writer.rows
@@ -0,0 +1,161 @@
+import pickle
+import tempfile
+import threading
+from collections import namedtuple
+from functools import partial
+
+import pandas as pd
+
+from columnar import ColumnarBuilder
+
+# rows per DataFrame chunk; bounds memory regardless of the cursor size
+CHUNK_SIZE = 10000
+
+
+# -------- SINKS --------
+class CsvSink:
+    """
+    Appends DataFrame chunks to one CSV file, writing the header once.
+    Safe to share between threads (the batch combined output does).
+    """
+
+    def __init__(self, path, append=False):
+        self.path = path
+        self.lock = threading.Lock()
+        self.header_written = append
+
+    def write(self, df):
+        if df.empty:
+            return
+        with self.lock:
+            df.to_csv(self.path, mode="a" if self.header_written else "w",
+                      header=not self.header_written, index=False)
+            self.header_written = True
+
+    def close(self):
+        # same file an empty DataFrame.to_csv used to leave behind
+        with self.lock:
+            if not self.header_written:
+                pd.DataFrame().to_csv(self.path, index=False)
+                self.header_written = True
+
+    def discard(self):
+        # rows already appended stay; extract_to_csv truncates a failed append
+        self.close()
+
+
+class StagedSink:
+    """
+    Holds one ID's chunks in a temporary file and hands them to `sink` on
+    commit(); discard() drops them. An ID that fails part way leaves nothing
+    in a shared output (the batch combined file) its watermark does not cover.
+    """
+
+    def __init__(self, sink):
+        self.sink = sink
+        self.spool = tempfile.TemporaryFile()
+        self.chunks = 0
+
+    def write(self, df):
+        if df.empty:
+            return
+        pickle.dump(df, self.spool, pickle.HIGHEST_PROTOCOL)
+        self.chunks += 1
+
+    def commit(self):
+        try:
+            self.spool.seek(0)
+            for _ in range(self.chunks):
+                self.sink.write(pickle.load(self.spool))
+        finally:
+            self.spool.close()
+
+    def discard(self):
+        self.spool.close()
+
+
+# -------- OUTPUT FORMATS --------
+# How a job's rows are laid out as a Parquet dataset (see parquet_sink.py):
+# dataset directory name, ID partition key ("driver"/"vehicle"), column ->
+# type name, the column whose date partitions the rows, dictionary columns,
+# and the partition period: "date" (date=YYYY-MM-DD) or "month" (month=YYYY-MM)
+# for jobs with only a few rows per day.
+ParquetLayout = namedtuple(
+    "ParquetLayout", "dataset key column_types date_column dict_columns period"
+)
+
+OUTPUT_FORMATS = ("csv", "parquet")
+
+
+def output_target(object_id, csv_path, layout=None, output_format="csv", dataset_root="."):
+    """
+    (path, open_sink) for one ID: the CSV file, or the ID's partition
+    directory under dataset_root/<layout.dataset>.
+    """
+    if output_format == "csv":
+        return csv_path, CsvSink
+    if output_format != "parquet":
+        raise ValueError(f"unknown output format {output_format!r}")
+
+    # pyarrow is only needed for Parquet output
+    from parquet_sink import ParquetSink, partition_path
+    return partition_path(dataset_root, layout, object_id), partial(ParquetSink, layout=layout)
+
+
+# -------- CHUNKED WRITER --------
+class ChunkedWriter:
+    """
+    Buffers records and hands them to the sink as fixed-size DataFrames.
+
+    to_frame is the script's records_to_frame(), so its fillna/replace rules
+    run per chunk. They are element-wise, and its column dtypes are declared
+    (COLUMN_DTYPES), so every value is written the same whatever chunk it
+    lands in.
+
+    With `columns`, records are row tuples in that order, buffered in a
+    ColumnarBuilder (typed per `column_types`) and given to to_frame as
+    {column: array}.
+    """
+
+    def __init__(self, sink, to_frame, chunk_size=CHUNK_SIZE, close_sink=True,
+                 columns=None, dict_columns=(), column_types=None):
+        self.sink = sink
+        self.to_frame = to_frame
+        self.chunk_size = chunk_size
+        self.close_sink = close_sink
+        self.columnar = columns is not None
+        self.buffer = ColumnarBuilder(columns, dict_columns, column_types) if self.columnar else []
+        self.rows = 0
+
+    def write(self, record):
+        self.buffer.append(record)
+        if len(self.buffer) >= self.chunk_size:
+            self.flush()
+
+    def write_many(self, records):
+        for record in records:
+            self.write(record)
+        return self.rows
+
+    def flush(self):
+        if not len(self.buffer):
+            return
+        records = self.buffer.to_dict() if self.columnar else self.buffer
+        self.sink.write(self.to_frame(records))
+        self.rows += len(self.buffer)
+        self.buffer.clear()
+
+    def close(self):
+        self.flush()
+        if self.close_sink:
+            self.sink.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        elif self.close_sink:
+            # after a failure the buffered rows are dropped and the sink discards its parts
+            self.sink.discard()